@@ -1,19 +1,110 @@
+import asyncio
+import itertools
+import json
 import logging
+import os
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict
+from functools import partial
+from typing import Any, Dict, List, Optional
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 
-from src.utils import retrieve_and_generate_stream
+from src import retrieval, settings, streaming
+from src.admission import Rejected, admission, admitted, holding, parse_priority
+from src.batch import (
+    BATCH_DEFAULT_CONCURRENCY,
+    BatchError,
+    Checkpoint,
+    parse_items,
+    run_batch,
+)
+from src.cache import RESPONSE_CACHE_ENABLED, record, replay, response_cache
+from src.clients import registry
+from src.memory import MEMORY_ENABLED, conversations, remember
+from src.metrics import (
+    RequestMetrics,
+    metrics,
+    router_model_error_rate,
+    router_model_ttft,
+)
+from src.resumable import ResumeError, streams
+from src.retrieval import (
+    DEFAULT_PIPELINE,
+    PIPELINES,
+    effective_pipeline,
+    generate_from_passages_stream,
+    kb_key,
+    passage_cache,
+)
+from src.router import POLICIES, model_event, router
+from src.sessions import sessions, track
+from src.singleflight import flights
+from src.usage import account, usage_ledger
+from src.utils import (
+    BEDROCK_PREWARM_TIMEOUT,
+    inference_config,
+    prewarm,
+    retrieve_and_generate_stream,
+)
+from src.warmer import FAQ_WARMER_ENABLED, faq_warmer
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 BAKU_TZ = timezone(timedelta(hours=4))
+STARTED_AT = time.time()
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# Share one upstream stream between identical concurrent requests
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "true").lower() == "true"
+
+# What the startup warm-up did, reported on /health
+warmup: Dict[str, Any] = {}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build Bedrock clients and connections (and load the local index) before
+    # taking traffic, so the first request does not pay for them
+    started = time.perf_counter()
+    try:
+        warmup.update(
+            await asyncio.wait_for(asyncio.to_thread(prewarm), BEDROCK_PREWARM_TIMEOUT)
+        )
+    except asyncio.TimeoutError:
+        warmup["error"] = "timeout"
+    await asyncio.to_thread(retrieval.local_index)
+    warmup["seconds"] = round(time.perf_counter() - started, 3)
+    logger.info("Warm-up done: %s", warmup)
+    # Settings reload on SIGHUP or when the settings file changes
+    settings.install_sighup_handler()
+    watcher = asyncio.create_task(settings.watch())
+    usage_flusher = asyncio.create_task(usage_ledger.run_flusher())
+    stream_sweeper = asyncio.create_task(streams.run_sweeper())
+    warmer = asyncio.create_task(faq_warmer.run()) if FAQ_WARMER_ENABLED else None
+    yield
+    watcher.cancel()
+    usage_flusher.cancel()
+    stream_sweeper.cancel()
+    if warmer is not None:
+        warmer.cancel()
+    usage_ledger.close()
+    # Release pooled Bedrock connections on shutdown
+    logger.info("Closing Bedrock clients: %s", registry.stats())
+    registry.close()
+    streaming.shutdown()
+    retrieval.shutdown()
+    response_cache.close()
+    faq_warmer.close()
+    conversations.close()
+
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -21,6 +112,7 @@ app = FastAPI(
     description="REST API for ML project",
     version="1.0.0",
     docs_url="/docs",
+    lifespan=lifespan,
 )
 
 # Add CORS middleware to allow Streamlit frontend
@@ -31,29 +123,362 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Count and time requests by route, without wrapping streamed bodies
+app.add_middleware(RequestMetrics)
+
+
+component_stats = metrics.gauge(
+    "backend_component_stat", "Internal component counters", ("component", "stat")
+)
+
+
+def _component_gauges():
+    gauges = {
+        "response_cache": response_cache.stats(),
+        "passage_cache": passage_cache.stats(),
+        "singleflight": flights.stats(),
+        "resumable_streams": streams.stats(),
+        "bedrock_clients": registry.stats(),
+        "admission": admission.stats(),
+        "usage": usage_ledger.stats(),
+        "conversations": conversations.stats(),
+        "faq": faq_warmer.stats(),
+    }
+    for component, stats in gauges.items():
+        for key, value in stats.items():
+            component_stats.labels(component, key).set(value)
+    for model, stats in router.stats()["models"].items():
+        if stats["ttft_p50"] is not None:
+            router_model_ttft.labels(model).set(stats["ttft_p50"])
+        router_model_error_rate.labels(model).set(stats["error_rate"])
+
+
+metrics.add_collector(_component_gauges)
 
 
 class Data(BaseModel):
     prompt: str
     modelName: str
+    # Bedrock session of the previous turn in this chat, if any
+    sessionId: Optional[str] = None
+    # Chat whose earlier turns the backend keeps and sends as context; takes
+    # the place of sessionId, and no session is returned for it
+    chatId: Optional[str] = Field(None, max_length=128)
+    # Routing policy (cheapest, fastest, auto); when set, the router picks the
+    # model and modelName is ignored
+    routing: Optional[str] = None
+    # "managed" (retrieve_and_generate) or "decoupled" (cached retrieve, then
+    # generate from the passages)
+    pipeline: Optional[str] = None
+    # Knowledge bases to search, a subset of the configured ones; all of
+    # them when unset. Several are always answered by the decoupled
+    # pipeline; the X-Pipeline response header names the one used.
+    knowledgeBases: Optional[List[str]] = Field(None, min_length=1)
+    # Generation parameters; the model's defaults apply when unset
+    maxTokens: Optional[int] = Field(None, ge=1)
+    temperature: Optional[float] = Field(None, ge=0.0, le=1.0)
 
 
 @app.get("/health")
 def health() -> Dict[str, Any]:
     utc_time = datetime.now(timezone.utc).isoformat()
     baku_time = datetime.now(BAKU_TZ).isoformat()
-    return {"status": "healthy", "utc_time": utc_time, "baku_time": baku_time}
+    config = settings.current()
+    checks = {
+        "aws_credentials": bool(config.access_key and config.secret_key),
+        "stream_capacity": streaming.active < streaming.STREAM_MAX_CONCURRENCY,
+        "admission_queue": admission.queue_depth < admission.queue_size,
+    }
+    return {
+        "status": "healthy",
+        "ready": all(checks.values()),
+        "checks": checks,
+        "active_streams": streaming.active,
+        "uptime_seconds": round(time.time() - STARTED_AT, 1),
+        "utc_time": utc_time,
+        "baku_time": baku_time,
+        "bedrock_clients": registry.stats(),
+        "warmup": warmup,
+        "response_cache": response_cache.stats(),
+        "passage_cache": passage_cache.stats(),
+        "singleflight": flights.stats(),
+        "resumable_streams": streams.stats(),
+        "admission": admission.stats(),
+        "router": router.stats(),
+        "usage": usage_ledger.stats(),
+        "conversations": conversations.stats(),
+        "knowledge_bases": retrieval.stats(),
+        "faq": faq_warmer.stats(),
+        "settings": settings.stats(),
+        "bedrock_sessions": len(sessions),
+    }
+
+
+@app.get("/models")
+def models() -> Dict[str, Any]:
+    """Models, routing policies and pipelines the frontend may offer."""
+    return {
+        "models": [model.public() for model in settings.current().models],
+        "routing": list(POLICIES),
+        "pipelines": list(PIPELINES),
+    }
+
+
+@app.get("/usage")
+def usage(day: Optional[str] = None) -> Dict[str, Any]:
+    """Tokens and cost per user and per model for a UTC day (default today)."""
+    if day is not None:
+        try:
+            datetime.strptime(day, "%Y-%m-%d")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="day must be YYYY-MM-DD")
+    return usage_ledger.report(day)
+
+
+@app.get("/chats/{chat_id}/memory")
+def chat_memory(
+    chat_id: str, request: Request, x_client_id: Optional[str] = Header(None)
+) -> Dict[str, Any]:
+    """The summary and recent turns the backend keeps for a chat."""
+    client_id = x_client_id or (request.client.host if request.client else "")
+    memory = conversations.view(conversations.key(client_id, chat_id))
+    if memory is None:
+        raise HTTPException(status_code=404, detail="No memory for this chat")
+    return memory
+
+
+@app.delete("/chats/{chat_id}/memory")
+def forget_chat(
+    chat_id: str, request: Request, x_client_id: Optional[str] = Header(None)
+) -> Dict[str, Any]:
+    """Drop a chat's memory, e.g. when the user deletes the chat."""
+    client_id = x_client_id or (request.client.host if request.client else "")
+    return {"deleted": conversations.forget(conversations.key(client_id, chat_id))}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics() -> PlainTextResponse:
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.exception_handler(Rejected)
+async def rejected_handler(request: Request, exc: Rejected) -> JSONResponse:
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.reason, "retry_after": exc.retry_after},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
 
 @app.post("/generate")
-async def generate(data: Data):
+async def generate(
+    data: Data,
+    request: Request,
+    last_event_id: Optional[str] = Header(None),
+    x_client_id: Optional[str] = Header(None),
+    x_priority: Optional[str] = Header(None),
+):
+    if last_event_id:
+        # Reconnect: continue the buffered stream instead of calling Bedrock
+        try:
+            stream = streams.resume(last_event_id)
+        except ResumeError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        return StreamingResponse(
+            stream, media_type="text/event-stream", headers=SSE_HEADERS
+        )
+
+    if data.routing and data.routing not in POLICIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown routing policy {data.routing!r}; use one of {POLICIES}",
+        )
+    if not data.routing and data.modelName not in settings.current().model_by_id:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown model {data.modelName!r}; see /models",
+        )
+
+    pipeline = data.pipeline or DEFAULT_PIPELINE
+    if pipeline not in PIPELINES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown pipeline {pipeline!r}; use one of {PIPELINES}",
+        )
+
+    try:
+        kbs = settings.current().select_knowledge_bases(data.knowledgeBases)
+    except KeyError as e:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown knowledge base(s): {e.args[0]}"
+        )
+
+    # Rate limit per client: the frontend sends its user id, anything else
+    # is limited by address. The id is not authenticated (see src/usage.py).
+    client_id = x_client_id or (request.client.host if request.client else "")
+    admission.limit(client_id)
+
+    pipeline = effective_pipeline(pipeline, kbs)
+    headers = {**SSE_HEADERS, "X-Pipeline": pipeline}
+
     prompt = data.prompt
-    model_name = data.modelName
+    routing = data.routing
+    # Cache and single-flight key on the policy when the router picks the model
+    model_name = f"routing:{routing}" if routing else data.modelName
+    stream_fn = retrieve_and_generate_stream
+    if pipeline == "decoupled":
+        stream_fn = generate_from_passages_stream
+    inference = inference_config(data.maxTokens, data.temperature)
+    if inference:
+        stream_fn = partial(stream_fn, inference=inference)
+    if data.knowledgeBases:
+        stream_fn = partial(stream_fn, kb_ids=[kb.id for kb in kbs])
+    # Answers differ per pipeline and generation parameters, so they are part
+    # of the cache key
+    options = f"|{pipeline}"
+    if inference:
+        options += "|" + json.dumps(inference, sort_keys=True)
+    variant = model_name + options
+    memory_key = history = None
+    if MEMORY_ENABLED and data.chatId:
+        # The backend's memory of the chat replaces the Bedrock session
+        memory_key = conversations.key(client_id, data.chatId)
+        history = await asyncio.to_thread(conversations.history, memory_key)
+        if history is not None:
+            stream_fn = partial(stream_fn, history=history)
+        session_id = None
+    else:
+        session_id = sessions.resolve(data.sessionId)
+    # Follow-up turns depend on the conversation, so only first turns are
+    # served from the cache or shared between users.
+    shared = session_id is None and history is None
+
+    def remembered(stream):
+        if memory_key is None:
+            return stream
+        return remember(stream, memory_key, client_id, prompt)
+
+    if FAQ_WARMER_ENABLED:
+        faq_warmer.observe(prompt, mine=shared)
+    if shared and FAQ_WARMER_ENABLED:
+        precomputed = await faq_warmer.lookup(prompt, variant, kb_key(kbs))
+        if precomputed is not None:
+            return StreamingResponse(
+                streams.start(lambda: remembered(replay(precomputed))),
+                media_type="text/event-stream",
+                headers=headers,
+            )
+
+    if shared and RESPONSE_CACHE_ENABLED:
+        cache_key = response_cache.key(prompt, variant, kb_key(kbs))
+        cached = await response_cache.aget(cache_key)
+        if cached is not None:
+            return StreamingResponse(
+                streams.start(lambda: remembered(replay(cached))),
+                media_type="text/event-stream",
+                headers=headers,
+            )
+
+    # Cache hits above are free; budgets apply to answers that call Bedrock
+    requested_model = None if routing else data.modelName
+    model_id = usage_ledger.check(client_id, requested_model)
+    if model_id != requested_model:
+        # Over its daily budget: answer with a cheaper model, cached as such
+        model_name = model_id
+        variant = model_name + options
+        if shared and RESPONSE_CACHE_ENABLED:
+            cache_key = response_cache.key(prompt, variant, kb_key(kbs))
+
+    # Only answers that call Bedrock need a slot: requests joining an
+    # identical answer already in flight ride on its slot.
+    priority = parse_priority(x_priority)
+    coalesce = shared and SINGLEFLIGHT_ENABLED
+    flight_key = (variant, prompt)
+    slot = None
+    if not (coalesce and flights.in_flight(flight_key)):
+        slot = await admission.acquire(priority)
+
+    def upstream():
+        if routing:
+            answer = router.stream(
+                prompt, routing, session_id=session_id, stream_fn=stream_fn
+            )
+        else:
+            answer = stream_fn(
+                model_name=model_name,
+                user_query=prompt,
+                session_id=session_id,
+            )
+            if model_name != data.modelName:
+                answer = itertools.chain([model_event(model_name)], answer)
+        # Estimates count the history sent along with the question
+        sent = prompt if history is None else history.transcript() + "\n\n" + prompt
+        stream = account(streaming.aiter_blocking(answer), sent, client_id, model_name)
+        if shared and RESPONSE_CACHE_ENABLED:
+            stream = record(response_cache, cache_key, stream)
+        return stream
+
+    def events():
+        if not coalesce:
+            return holding(slot, track(remembered(upstream())))
+        if slot is None:
+            # The flight ended before this request subscribed: if it starts
+            # the next one, it queues for a slot inside the stream.
+            leader = partial(admitted, priority, upstream)
+            stream = flights.subscribe(flight_key, leader)
+        else:
+            stream = flights.subscribe(flight_key, upstream, release=slot.release)
+        return track(remembered(stream))
+
+    return StreamingResponse(
+        streams.start(events), media_type="text/event-stream", headers=headers
+    )
+
+
+@app.post("/generate/batch")
+async def generate_batch(
+    request: Request,
+    modelName: Optional[str] = None,
+    routing: Optional[str] = None,
+    pipeline: Optional[str] = None,
+    concurrency: int = BATCH_DEFAULT_CONCURRENCY,
+    checkpoint: Optional[str] = None,
+    x_client_id: Optional[str] = Header(None),
+    x_priority: Optional[str] = Header(None),
+):
+    """Answer a JSONL body of questions; stream NDJSON results as they finish.
+
+    Query parameters give the defaults for every line (see src/batch.py).
+    With ``checkpoint`` the results are also kept on the server under that
+    name, per client, and repeating the request skips questions already
+    answered.
+    """
+    body = await request.body()
+    try:
+        items = parse_items(
+            body.decode("utf-8").splitlines(), modelName, routing, pipeline
+        )
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Batch must be UTF-8 JSONL")
+    except BatchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    client_id = x_client_id or (request.client.host if request.client else "")
+    admission.limit(client_id)
+    try:
+        saved = Checkpoint.named(checkpoint, client_id) if checkpoint else None
+    except BatchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def lines():
+        results = run_batch(
+            items, concurrency, saved, parse_priority(x_priority or "low"), client_id
+        )
+        async for result in results:
+            yield json.dumps(result, ensure_ascii=False) + "\n"
 
     return StreamingResponse(
-        retrieve_and_generate_stream(
-            model_name=model_name,
-            user_query=prompt,
-        ),
-        media_type="text/event-stream",
+        lines(), media_type="application/x-ndjson", headers=SSE_HEADERS
     )
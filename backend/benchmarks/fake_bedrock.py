@@ -0,0 +1,190 @@
+"""A local stand-in for the Bedrock clients used by benchmarks.
+
+The fake replays a recorded event sequence (see ``recordings/``) or a
+synthetic answer with configurable first-token latency, token rate and
+jitter. Reads block with ``time.sleep`` exactly like a boto3 EventStream,
+so the backend's threading behaviour is exercised as in production. The
+same fake also answers ``retrieve`` and ``converse_stream`` for the
+decoupled pipeline, and ``converse`` for chat summaries.
+
+It is injected through the client registry behind ``create_agent``: either
+call ``install(...)`` in-process or serve ``benchmarks.fake_server:app``,
+configured by ``BEDROCK_FAKE=<recording.json>`` and the ``BEDROCK_FAKE_*``
+knobs.
+"""
+
+import json
+import os
+import random
+import time
+import uuid
+from pathlib import Path
+from typing import List, Optional
+
+RECORDINGS_DIR = Path(__file__).resolve().parent / "recordings"
+
+DEFAULT_ANSWER = "Azercell offers prepaid and postpaid tariffs. " * 8
+DEFAULT_CITATION = {
+    "citation": {
+        "retrievedReferences": [
+            {
+                "content": {"text": "Tariff overview"},
+                "location": {"s3Location": {"uri": "s3://kb/tariffs.pdf"}},
+            }
+        ]
+    }
+}
+
+
+def load_recording(path) -> List[dict]:
+    """Load ``{"events": [{"delay": s, "event": {...}}, ...]}`` from *path*."""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["events"]
+
+
+def synthetic_recording(answer: str = DEFAULT_ANSWER) -> List[dict]:
+    events = [
+        {"delay": 0.0, "event": {"output": {"text": token + " "}}}
+        for token in answer.split(" ")
+    ]
+    events.append({"delay": 0.0, "event": DEFAULT_CITATION})
+    return events
+
+
+class FakeEventStream:
+    """Blocking iterator that mimics a boto3 EventStream."""
+
+    def __init__(self, events: List[dict], delays: List[float]):
+        self._events = events
+        self._delays = delays
+        self.closed = False
+
+    def __iter__(self):
+        for event, delay in zip(self._events, self._delays):
+            if self.closed:
+                return
+            if delay > 0:
+                time.sleep(delay)
+            yield event
+
+    def close(self):
+        self.closed = True
+
+
+class FakeAgentRuntime:
+    def __init__(
+        self,
+        recording: Optional[List[dict]] = None,
+        first_token_latency: float = 0.05,
+        tokens_per_second: Optional[float] = 200.0,
+        jitter: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        """
+        *tokens_per_second* overrides the recorded gaps between output events
+        (None keeps them); *jitter* scales every delay by a random factor in
+        ``[1 - jitter, 1 + jitter]``.
+        """
+        self.recording = recording or synthetic_recording()
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.jitter = jitter
+        self._random = random.Random(seed)
+
+    def _delays(self) -> List[float]:
+        delays = []
+        first = True
+        for item in self.recording:
+            delay = item.get("delay", 0.0)
+            if "output" in item["event"]:
+                if first:
+                    delay, first = self.first_token_latency, False
+                elif self.tokens_per_second:
+                    delay = 1.0 / self.tokens_per_second
+            if self.jitter:
+                delay *= self._random.uniform(1 - self.jitter, 1 + self.jitter)
+            delays.append(max(0.0, delay))
+        return delays
+
+    def retrieve_and_generate_stream(self, **kwargs):
+        events = [item["event"] for item in self.recording]
+        return {
+            "sessionId": kwargs.get("sessionId") or str(uuid.uuid4()),
+            "stream": FakeEventStream(events, self._delays()),
+        }
+
+    def retrieve(self, **kwargs):
+        """Knowledge-base search: the recording's citations as passages."""
+        results = []
+        for item in self.recording:
+            citation = item["event"].get("citation", {})
+            for n, ref in enumerate(citation.get("retrievedReferences", [])):
+                results.append({**ref, "score": 1.0 / (n + 1)})
+        if self.first_token_latency:
+            time.sleep(self.first_token_latency)
+        return {"retrievalResults": results}
+
+    def converse_stream(self, **kwargs):
+        """bedrock-runtime streaming: the recording's output as text deltas."""
+        events, delays = [], []
+        for item, delay in zip(self.recording, self._delays()):
+            if "output" in item["event"]:
+                text = item["event"]["output"]["text"]
+                events.append({"contentBlockDelta": {"delta": {"text": text}}})
+                delays.append(delay)
+        events.append({"messageStop": {"stopReason": "end_turn"}})
+        # Rough usage, like the metadata event Bedrock sends last
+        prompt = json.dumps(kwargs.get("messages", []))
+        output = sum(len(e["contentBlockDelta"]["delta"]["text"]) for e in events[:-1])
+        usage = {"inputTokens": len(prompt) // 4, "outputTokens": output // 4}
+        events.append({"metadata": {"usage": usage}})
+        delays.extend((0.0, 0.0))
+        return {"stream": FakeEventStream(events, delays)}
+
+    def converse(self, **kwargs):
+        """bedrock-runtime without streaming: the whole output at once."""
+        if self.first_token_latency:
+            time.sleep(self.first_token_latency)
+        text = "".join(
+            item["event"]["output"]["text"]
+            for item in self.recording
+            if "output" in item["event"]
+        )
+        prompt = json.dumps(kwargs.get("messages", []))
+        return {
+            "output": {"message": {"role": "assistant", "content": [{"text": text}]}},
+            "stopReason": "end_turn",
+            "usage": {"inputTokens": len(prompt) // 4, "outputTokens": len(text) // 4},
+        }
+
+    def close(self):
+        pass
+
+
+def fake_factory(**options):
+    """Build a ClientRegistry factory returning a fake client."""
+
+    def factory(service, region, access_key, secret_key, config):
+        return FakeAgentRuntime(**options)
+
+    return factory
+
+
+def install(registry=None, **options) -> None:
+    """Route every client created through *registry* to the fake."""
+    if registry is None:
+        from src.clients import registry
+    registry.set_factory(fake_factory(**options))
+
+
+def options_from_env() -> dict:
+    source = os.getenv("BEDROCK_FAKE", "")
+    tokens_per_second = float(os.getenv("BEDROCK_FAKE_TOKENS_PER_SECOND", "200"))
+    options = {
+        "first_token_latency": float(os.getenv("BEDROCK_FAKE_LATENCY", "0.05")),
+        "tokens_per_second": tokens_per_second or None,
+        "jitter": float(os.getenv("BEDROCK_FAKE_JITTER", "0")),
+    }
+    if source and source not in ("1", "true"):
+        options["recording"] = load_recording(source)
+    return options
@@ -0,0 +1,18 @@
+"""The real app with every Bedrock client replaced by the fake.
+
+For servers started by hand or by a benchmark in another process:
+
+    BEDROCK_FAKE_LATENCY=0.2 uv run uvicorn benchmarks.fake_server:app
+
+The fake is installed through the client registry before the app starts,
+so the startup warm-up already uses it. The ``BEDROCK_FAKE_*`` variables
+configure it, and ``BEDROCK_FAKE=<recording.json>`` replays a recording
+(see fake_bedrock.py).
+"""
+
+from app import app
+from benchmarks.fake_bedrock import install, options_from_env
+
+install(**options_from_env())
+
+__all__ = ["app"]
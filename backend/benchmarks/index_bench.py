@@ -0,0 +1,166 @@
+"""Query latency and recall of the local hybrid index.
+
+Builds an index from a corpus and runs a held-out question set against the
+BM25, dense and fused rankings, reporting recall@k and per-query latency
+percentiles (plus batched dense throughput). Without ``--corpus`` a
+synthetic corpus is generated, with questions made of a few words from one
+document, some of them misspelled; ``--questions`` takes JSONL lines of
+``{"question": ..., "doc_id": ...}`` for a real exported corpus.
+
+Usage:
+    uv run python -m benchmarks.index_bench --docs 20000
+    uv run python -m benchmarks.index_bench --corpus export.jsonl \
+        --questions heldout.jsonl --output index.json
+"""
+
+import argparse
+import json
+import random
+import statistics
+import tempfile
+import time
+from typing import Callable, Dict, List, Sequence
+
+from src.features.hybrid_index import HybridIndex, build_index, load_corpus, rrf
+
+
+def synthetic_corpus(n_docs: int, seed: int) -> List[Dict[str, str]]:
+    rng = random.Random(seed)
+    letters = "abcçdeəfgğhxıijkqlmnoöprsştuüvyz"
+    vocabulary = [
+        "".join(rng.choice(letters) for _ in range(rng.randint(4, 10)))
+        for _ in range(max(2000, n_docs // 2))
+    ]
+    # Zipf-like word frequencies, so common words are shared and rare ones
+    # identify documents
+    weights = [1.0 / (rank + 1) for rank in range(len(vocabulary))]
+    docs = []
+    for n in range(n_docs):
+        words = rng.choices(vocabulary, weights, k=rng.randint(40, 120))
+        docs.append({"id": f"doc-{n}", "text": " ".join(words), "uri": f"doc://{n}"})
+    return docs
+
+
+def synthetic_questions(docs, n: int, seed: int) -> List[Dict[str, str]]:
+    rng = random.Random(seed + 1)
+    questions = []
+    for doc in rng.sample(docs, min(n, len(docs))):
+        words = rng.sample(doc["text"].split(), 5)
+        if rng.random() < 0.5:  # a typo only the trigram embedding can absorb
+            word = words[0]
+            cut = rng.randrange(len(word))
+            words[0] = word[:cut] + word[cut + 1 :]
+        questions.append({"question": " ".join(words), "doc_id": doc["id"]})
+    return questions
+
+
+def load_questions(path) -> List[Dict[str, str]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def evaluate(
+    name: str,
+    search: Callable[[str], Sequence[int]],
+    questions,
+    doc_ids: List[str],
+    ks=(1, 5, 10),
+) -> Dict[str, float]:
+    latencies, hits = [], {k: 0 for k in ks}
+    for q in questions:
+        started = time.perf_counter()
+        ranking = list(search(q["question"]))
+        latencies.append(time.perf_counter() - started)
+        ranked_ids = [doc_ids[d] for d in ranking]
+        for k in ks:
+            hits[k] += q["doc_id"] in ranked_ids[:k]
+    result = {f"{name}_recall@{k}": hits[k] / len(questions) for k in ks}
+    result[f"{name}_latency_p50_ms"] = percentile(latencies, 0.50) * 1000
+    result[f"{name}_latency_p95_ms"] = percentile(latencies, 0.95) * 1000
+    result[f"{name}_latency_p99_ms"] = percentile(latencies, 0.99) * 1000
+    result[f"{name}_latency_mean_ms"] = statistics.mean(latencies) * 1000
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--corpus", help="JSONL file or directory of documents")
+    parser.add_argument("--questions", help="held-out questions (JSONL)")
+    parser.add_argument("--docs", type=int, default=20000, help="synthetic size")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=64, help="dense batch size")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    if args.corpus:
+        docs = load_corpus(args.corpus)
+    else:
+        docs = synthetic_corpus(args.docs, args.seed)
+    if args.questions:
+        questions = load_questions(args.questions)
+    else:
+        questions = synthetic_questions(docs, args.queries, args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        build = build_index(docs, f"{tmp}/index")
+        build_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        rebuild = build_index(docs, f"{tmp}/index")  # nothing changed
+        rebuild_seconds = time.perf_counter() - started
+
+        index = HybridIndex(f"{tmp}/index")
+        doc_ids = [doc["id"] for doc in index.docs]
+        k = args.k
+
+        def bm25(q):
+            return index.bm25(q, k)[0].tolist()
+
+        def dense(q):
+            return index.dense([q], k)[0][0].tolist()
+
+        def hybrid(q):
+            fused = rrf(
+                [index.bm25(q, 50)[0].tolist(), index.dense([q], 50)[0][0].tolist()]
+            )
+            return [doc for doc, _ in fused[:k]]
+
+        results = {
+            "docs": len(index),
+            "questions": len(questions),
+            "build_seconds": build_seconds,
+            "rebuild_unchanged_seconds": rebuild_seconds,
+            "rebuild_reused": rebuild["reused"],
+            "terms": build["terms"],
+        }
+        for name, search in (("bm25", bm25), ("dense", dense), ("hybrid", hybrid)):
+            results.update(evaluate(name, search, questions, doc_ids))
+
+        texts = [q["question"] for q in questions]
+        started = time.perf_counter()
+        for start in range(0, len(texts), args.batch):
+            index.dense(texts[start : start + args.batch], k)
+        results["dense_batched_queries_per_s"] = len(texts) / (
+            time.perf_counter() - started
+        )
+
+    for key, value in results.items():
+        if isinstance(value, float):
+            value = f"{value:.4f}"
+        print(f"{key:<32} {value}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
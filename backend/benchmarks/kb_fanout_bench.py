@@ -0,0 +1,112 @@
+"""Fan-out across several knowledge bases, against stub knowledge bases.
+
+Every knowledge base is a stub with its own search latency (one of them
+fails instead of answering). The bench fires concurrent questions through
+``retrieve_passages`` and reports the answer latency and each knowledge
+base's stats. The fan-out behaviour itself (deadlines, late searches
+cached, failures, ordering) is checked by tests/test_retrieval_fanout.py.
+
+The run fails (exit code 1) if the p95 answer latency is over the deadline
+by more than 0.2 s.
+
+Usage (from backend/):
+    uv run python -m benchmarks.kb_fanout_bench --questions 200
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fake_bedrock import FakeAgentRuntime
+from src import retrieval, settings
+from src.clients import registry
+
+# id -> search latency in seconds, None for a knowledge base that fails
+LATENCIES = {"FASTKB": 0.05, "MIDKB": 0.2, "SLOWKB": 1.5, "BROKENKB": None}
+
+
+class StubAgent(FakeAgentRuntime):
+    """Fake Bedrock whose knowledge-base search latency depends on the id."""
+
+    def __init__(self, latencies, results: int):
+        super().__init__(first_token_latency=0.0, tokens_per_second=None)
+        self.latencies = latencies
+        self.results = results
+
+    def retrieve(self, knowledgeBaseId, retrievalQuery, **kwargs):
+        latency = self.latencies[knowledgeBaseId]
+        if latency is None:
+            time.sleep(0.01)
+            raise RuntimeError(f"{knowledgeBaseId} is unavailable")
+        time.sleep(latency)
+        query = retrievalQuery["text"]
+        # Scores interleave between knowledge bases, so the merge must rerank
+        offset = sorted(self.latencies).index(knowledgeBaseId) / 10
+        return {
+            "retrievalResults": [
+                {
+                    "content": {"text": f"{knowledgeBaseId} on {query}: passage {n}"},
+                    "location": {"s3Location": {"uri": f"s3://{knowledgeBaseId}/{n}"}},
+                    "score": 0.95 - n * 0.2 - offset,
+                }
+                for n in range(self.results)
+            ]
+        }
+
+
+def configure(path: str, kb_ids, deadline: float) -> None:
+    knowledge_bases = [{"id": kb, "deadline": deadline} for kb in kb_ids]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"knowledge_bases": knowledge_bases}, f)
+    if not settings.reload(path):
+        raise SystemExit("settings rejected, see the log")
+
+
+def timed(query: str, kb_ids=None):
+    started = time.perf_counter()
+    passages = retrieval.retrieve_passages(query, kb_ids=kb_ids)
+    return passages, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--deadline", type=float, default=0.5)
+    parser.add_argument("--results", type=int, default=5, help="passages per KB")
+    args = parser.parse_args()
+
+    registry.set_factory(
+        lambda service, region, access_key, secret_key, config: StubAgent(
+            LATENCIES, args.results
+        )
+    )
+    path = os.path.join(tempfile.mkdtemp(), "settings.json")
+    configure(path, list(LATENCIES), args.deadline)
+    def question(n: int) -> float:
+        return timed(f"question {n}")[1]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        latencies = sorted(pool.map(question, range(args.questions)))
+    total = time.perf_counter() - started
+    p95 = latencies[int(0.95 * (len(latencies) - 1))]
+    print(
+        f"{args.questions} questions, {args.concurrency} at a time, in {total:.2f} s:"
+        f" p50 {statistics.median(latencies):.3f} s, p95 {p95:.3f} s"
+    )
+    for kb, stats in retrieval.stats().items():
+        print(f"  {kb:9} {stats}")
+    retrieval.shutdown()
+    sys.exit(0 if p95 < args.deadline + 0.2 else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""Cold-start benchmark: import time and time to the first successful answer.
+
+Each measurement runs in a fresh interpreter, as after a container restart:
+
+* ``import app`` wall time (median of ``--runs``), and the slowest
+  top-level imports from ``python -X importtime``;
+* the one-off AWS SDK costs the startup warm-up moves off the first
+  request: importing and parsing the Bedrock service models, then building
+  the first and a second client (no network);
+* a real server (uvicorn subprocess, fake Bedrock) from process start to
+  ``/health`` answering and to the first ``/generate`` returning text, plus
+  that first request's own latency.
+
+``--prewarm`` sets BEDROCK_PREWARM for the server, so runs with ``off`` and
+``connections`` can be compared with ``--output``/``--compare``. The fake
+replaces the AWS clients, so the server numbers show what the warm-up adds
+to readiness; what it saves the first real request is the SDK costs above.
+
+Usage:
+    uv run python -m benchmarks.startup_bench --output startup.json
+    uv run python -m benchmarks.startup_bench --prewarm off --compare startup.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks.stream_load import print_results
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+IMPORT_APP = (
+    "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+)
+SDK_COSTS = """
+import json, time
+from src.clients import preload, registry
+t = time.perf_counter(); preload(); loaded = time.perf_counter() - t
+t = time.perf_counter(); registry.get("bedrock-agent-runtime", "us-east-1", "k", "s")
+first = time.perf_counter() - t
+t = time.perf_counter(); registry.get("bedrock-runtime", "us-east-1", "k", "s")
+second = time.perf_counter() - t
+print(json.dumps({"sdk_preload_s": loaded, "first_client_s": first,
+                  "second_client_s": second}))
+"""
+
+
+def python(code: str, env: Optional[dict] = None, *flags: str):
+    return subprocess.run(
+        [sys.executable, *flags, "-c", code],
+        cwd=BACKEND_DIR,
+        env={**os.environ, "PYTHONPATH": str(BACKEND_DIR), **(env or {})},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def slowest_imports(n: int) -> Dict[str, float]:
+    """Modules ``app`` imports directly, by cumulative seconds."""
+    stderr = python("import app", None, "-X", "importtime").stderr
+    children: Dict[str, float] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # importtime lists a module's imports before it, indented one level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children[name.strip()] = int(cumulative) / 1e6
+        elif depth == 0:
+            if name.strip() == "app":
+                break
+            children = {}
+    return dict(sorted(children.items(), key=lambda kv: -kv[1])[:n])
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def first_request(prewarm: str, timeout: float) -> Dict[str, float]:
+    port = free_port()
+    env = {
+        **os.environ,
+        "PYTHONPATH": str(BACKEND_DIR),
+        "BEDROCK_FAKE_LATENCY": "0.05",
+        "BEDROCK_PREWARM": prewarm,
+        "RESPONSE_CACHE_ENABLED": "false",
+        "USAGE_DB_PATH": "",
+    }
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "benchmarks.fake_server:app",
+            "--port",
+            str(port),
+        ],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        with httpx.Client(timeout=timeout) as client:
+            while True:
+                if time.perf_counter() - started > timeout:
+                    raise RuntimeError("server did not start")
+                try:
+                    health = client.get(f"{base}/health")
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.01)
+            ready = time.perf_counter() - started
+            request_started = time.perf_counter()
+            response = client.post(
+                f"{base}/generate",
+                json={
+                    "prompt": "Hansı tariflər var?",
+                    "modelName": "anthropic.claude-3-haiku-20240307-v1:0",
+                },
+            )
+            if response.status_code != 200 or "event: text" not in response.text:
+                raise RuntimeError(f"first request failed: {response.text[:200]}")
+            done = time.perf_counter()
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        "ready_s": ready,
+        "first_success_s": done - started,
+        "first_request_s": done - request_started,
+        "warmup_s": health.json().get("warmup", {}).get("seconds", 0.0),
+    }
+
+
+def median_of(samples: List[Dict[str, float]]) -> Dict[str, float]:
+    return {key: statistics.median(s[key] for s in samples) for key in samples[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--prewarm", default="connections", choices=("off", "clients", "connections")
+    )
+    parser.add_argument("--top", type=int, default=8, help="slowest imports shown")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--compare", help="earlier JSON results to diff against")
+    args = parser.parse_args()
+
+    imports = [float(python(IMPORT_APP).stdout) for _ in range(args.runs)]
+    results: Dict[str, float] = {"import_app_s": statistics.median(imports)}
+    results.update(
+        median_of([json.loads(python(SDK_COSTS).stdout) for _ in range(args.runs)])
+    )
+    results.update(
+        median_of([first_request(args.prewarm, args.timeout) for _ in range(args.runs)])
+    )
+    slowest = slowest_imports(args.top)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+    print("\nslowest imports of app (cumulative s):")
+    for name, seconds in slowest.items():
+        print(f"  {name:<40} {seconds:.4f}")
+
+    if args.output:
+        config = {k: v for k, v in vars(args).items() if k not in ("output", "compare")}
+        report = {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "config": config,
+            "results": results,
+            "slowest_imports": slowest,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
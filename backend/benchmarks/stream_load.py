@@ -0,0 +1,224 @@
+"""Load driver: N concurrent SSE clients against the app with a fake Bedrock.
+
+The app runs in a separate process (so client and server do not share a
+GIL) with the fake bedrock-agent-runtime client injected through the client
+registry. Each client parses the SSE framing and records time to the first
+text frame. Results are printed and can be written as JSON and compared
+with an earlier run.
+
+Usage:
+    uv run python -m benchmarks.stream_load --streams 500 --output run.json
+    uv run python -m benchmarks.stream_load --recording \
+        benchmarks/recordings/tariffs_az.json --compare run.json
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import time
+from typing import Dict, List, Optional
+
+import httpx
+import uvicorn
+
+from benchmarks.fake_bedrock import install, load_recording
+
+# Any configured model; the fake Bedrock answers for all of them
+MODEL = "anthropic.claude-3-haiku-20240307-v1:0"
+
+
+def serve(port: int, options: dict) -> None:
+    """Run the real app against a fake Bedrock in a separate process."""
+    from app import app
+
+    install(**options)
+    uvicorn.run(app, port=port, log_level="warning")
+
+
+def rss_bytes(pid: int) -> Optional[int]:
+    """Resident set size of *pid* (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+async def sample_rss(pid: int, peak: List[int], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        rss = rss_bytes(pid)
+        if rss is not None:
+            peak[0] = max(peak[0], rss)
+        await asyncio.sleep(0.05)
+
+
+async def one_stream(client: httpx.AsyncClient, url: str, prompt: str) -> dict:
+    started = time.perf_counter()
+    ttft = None
+    text_bytes = 0
+    frames = 0
+    buffer = b""
+    async with client.stream(
+        "POST", url, json={"prompt": prompt, "modelName": MODEL}
+    ) as resp:
+        resp.raise_for_status()
+        async for chunk in resp.aiter_bytes():
+            buffer += chunk
+            *complete, buffer = buffer.split(b"\n\n")
+            for frame in complete:
+                if b"event: text" not in frame:
+                    continue
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                frames += 1
+                data = frame.split(b"data: ", 1)[1]
+                text_bytes += len(json.loads(data)["text"].encode())
+    return {
+        "ttft": ttft if ttft is not None else float("nan"),
+        "duration": time.perf_counter() - started,
+        "text_bytes": text_bytes,
+        "frames": frames,
+    }
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def wait_until_up(port: int) -> None:
+    async with httpx.AsyncClient() as client:
+        for _ in range(100):
+            try:
+                await client.get(f"http://127.0.0.1:{port}/health")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError("benchmark server did not start")
+
+
+async def run(args, server_pid: int) -> Dict:
+    await wait_until_up(args.port)
+    baseline_rss = rss_bytes(server_pid)
+    peak = [baseline_rss or 0]
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_rss(server_pid, peak, stop))
+
+    limits = httpx.Limits(
+        max_connections=args.streams, max_keepalive_connections=args.streams
+    )
+    url = f"http://127.0.0.1:{args.port}/generate"
+    # Distinct prompts unless asked otherwise, so the cache and single-flight
+    # layers do not collapse the load into one upstream call
+    prompts = [
+        "What tariffs exist?" if args.same_prompt else f"What tariffs exist? #{n}"
+        for n in range(args.streams)
+    ]
+    async with httpx.AsyncClient(limits=limits, timeout=300) as client:
+        started = time.perf_counter()
+        results = await asyncio.gather(*(one_stream(client, url, p) for p in prompts))
+        elapsed = time.perf_counter() - started
+    stop.set()
+    await sampler
+
+    ttfts = [r["ttft"] for r in results]
+    total_bytes = sum(r["text_bytes"] for r in results)
+    memory_per_stream = None
+    if baseline_rss is not None:
+        memory_per_stream = (peak[0] - baseline_rss) / args.streams
+    return {
+        "streams": args.streams,
+        "wall_seconds": elapsed,
+        "ttft_p50": percentile(ttfts, 0.50),
+        "ttft_p95": percentile(ttfts, 0.95),
+        "ttft_p99": percentile(ttfts, 0.99),
+        "duration_mean": statistics.mean(r["duration"] for r in results),
+        "throughput_streams_per_s": args.streams / elapsed,
+        "throughput_text_bytes_per_s": total_bytes / elapsed,
+        "frames_per_stream": statistics.mean(r["frames"] for r in results),
+        "server_rss_baseline_bytes": baseline_rss,
+        "server_rss_peak_bytes": peak[0] or None,
+        "memory_per_stream_bytes": memory_per_stream,
+    }
+
+
+def print_results(results: Dict, baseline: Optional[Dict] = None) -> None:
+    for key, value in results.items():
+        line = f"{key:<30} {value}"
+        if isinstance(value, float):
+            line = f"{key:<30} {value:.4f}"
+        other = (baseline or {}).get(key)
+        if isinstance(value, (int, float)) and isinstance(other, (int, float)):
+            if other:
+                line += f"   ({(value - other) / other * 100:+.1f}% vs baseline)"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--streams", type=int, default=500)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--recording", help="recorded event sequence (JSON)")
+    parser.add_argument("--first-token-latency", type=float, default=0.05)
+    parser.add_argument(
+        "--tokens-per-second",
+        type=float,
+        default=200.0,
+        help="0 keeps the recorded gaps",
+    )
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--same-prompt", action="store_true")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--compare", help="earlier JSON results to diff against")
+    args = parser.parse_args()
+
+    fake_options = {
+        "first_token_latency": args.first_token_latency,
+        "tokens_per_second": args.tokens_per_second or None,
+        "jitter": args.jitter,
+        "seed": args.seed,
+    }
+    if args.recording:
+        fake_options["recording"] = load_recording(args.recording)
+
+    server = multiprocessing.Process(
+        target=serve, args=(args.port, fake_options), daemon=True
+    )
+    server.start()
+    try:
+        results = asyncio.run(run(args, server.pid))
+    finally:
+        server.terminate()
+        server.join()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if args.output:
+        config = {k: v for k, v in vars(args).items() if k not in ("output", "compare")}
+        report = {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "config": config,
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
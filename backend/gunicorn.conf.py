@@ -0,0 +1,35 @@
+"""Multi-worker serving: gunicorn master with uvicorn workers.
+
+    uv run --with gunicorn gunicorn -c gunicorn.conf.py app:app
+
+The master imports the app once (``preload_app``) and parses the Bedrock
+service models before forking, so workers start with both already in
+memory (shared copy-on-write) instead of each paying for them. Every worker
+then runs the app's startup warm-up to build its own clients and
+connections; the client registry and SQLite connections are reset in the
+child after the fork.
+
+A simpler alternative without preloading is ``uvicorn app:app --workers N``.
+
+Either way each worker has its own admission limits, caches, single-flight
+table and resumable streams: limits apply per worker, and a stream can only
+be resumed on the worker that started it. Usage totals are shared through
+the usage database (see src/usage.py).
+"""
+
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# Streams can be long; leave them time to finish on restart
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "180"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = 75
+
+
+def on_starting(server):
+    from src.clients import preload
+
+    preload()
@@ -1,5 +1,78 @@
+"""Answer a JSONL file of questions in bulk, e.g. for an evaluation run.
+
+Runs the questions in this process through the same pipelines as the
+``/generate`` endpoint (see src/batch.py for the input format) and writes
+one NDJSON result per question, in completion order, then a summary. With
+``--checkpoint`` an interrupted run picks up where it stopped.
+
+Usage:
+    uv run python main.py questions.jsonl --model anthropic.claude-3-haiku-20240307-v1:0
+    uv run python main.py questions.jsonl --routing auto --pipeline decoupled \
+        --concurrency 8 --checkpoint runs/eval.jsonl --output results.jsonl
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+
+from src.batch import (
+    BATCH_DEFAULT_CONCURRENCY,
+    BatchError,
+    Checkpoint,
+    parse_items,
+    run_batch,
+)
+from src.usage import usage_ledger
+
+
+async def run(items, checkpoint, output, args) -> int:
+    summary = {}
+    results = run_batch(items, args.concurrency, checkpoint, user=args.user)
+    async for result in results:
+        if result["type"] == "summary":
+            summary = result
+        else:
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            status = result.get("error") or f"{result.get('latency')} s"
+            print(f"{result['id']}: {status}", file=sys.stderr)
+    for key, value in summary.items():
+        if key != "type":
+            print(f"{key:<20} {value}", file=sys.stderr)
+    return 1 if summary.get("errors") else 0
+
+
 def main():
-    print("Hello from backend!")
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("questions", help="JSONL file of questions")
+    parser.add_argument("--model", help="model id for lines without modelName")
+    parser.add_argument("--routing", help="routing policy instead of a model")
+    parser.add_argument("--pipeline", help="managed or decoupled")
+    parser.add_argument(
+        "--concurrency", type=int, default=BATCH_DEFAULT_CONCURRENCY
+    )
+    parser.add_argument("--checkpoint", help="JSONL file to resume from and append to")
+    parser.add_argument("--output", help="write results here instead of stdout")
+    parser.add_argument("--user", default="cli", help="user charged for the tokens")
+    args = parser.parse_args()
+    # Files are opened and parsed here, outside the event loop
+    try:
+        with open(args.questions, encoding="utf-8") as f:
+            items = parse_items(f, args.model, args.routing, args.pipeline)
+    except BatchError as e:
+        parser.error(str(e))
+    checkpoint = Checkpoint(args.checkpoint) if args.checkpoint else None
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        status = asyncio.run(run(items, checkpoint, output, args))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        usage_ledger.close()
+    sys.exit(status)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,6 @@
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+# Load backend/.env before any module reads its settings from the environment
+load_dotenv(dotenv_path=Path(__file__).resolve().parent.parent / ".env")
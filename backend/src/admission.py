@@ -0,0 +1,267 @@
+"""Admission control for /generate.
+
+Every new answer needs a slot before it may call Bedrock. At most
+``max_concurrent`` answers hold a slot at once. Further requests wait
+in a bounded priority queue (lower number = served first, FIFO within a
+priority) until a slot frees up or their deadline passes. Each client also
+has a token bucket, so one client cannot fill the queue on its own.
+
+Requests that cannot be admitted fail fast instead of piling up:
+
+* 429 when the client's bucket is empty, with Retry-After set to when the
+  next token is due;
+* 503 when the queue is full or the wait deadline passed, with Retry-After
+  estimated from the current queue.
+
+Limits come from src/settings.py and are re-applied on a settings reload.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from src import settings
+from src.metrics import (
+    admission_queue_depth,
+    admission_rejections,
+    admission_wait,
+)
+
+# Buckets of clients idle this long are dropped
+ADMISSION_BUCKET_TTL = float(os.getenv("ADMISSION_BUCKET_TTL", "600"))
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+
+class Rejected(Exception):
+    """The request was not admitted; maps to an HTTP error with Retry-After."""
+
+    def __init__(self, status_code: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def parse_priority(value: Optional[str]) -> int:
+    """Map an ``X-Priority`` header (name or number) to a queue priority.
+
+    Numbers are clamped to the named range, so a client cannot jump ahead
+    of "high" with a negative priority.
+    """
+    if not value:
+        return PRIORITIES["normal"]
+    value = value.strip().lower()
+    if value in PRIORITIES:
+        return PRIORITIES[value]
+    try:
+        priority = int(value)
+    except ValueError:
+        return PRIORITIES["normal"]
+    return min(max(priority, min(PRIORITIES.values())), max(PRIORITIES.values()))
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self) -> float:
+        """Take one token; return 0 on success or seconds until one is due."""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    def __init__(
+        self, limits: settings.Limits, bucket_ttl: float = ADMISSION_BUCKET_TTL
+    ):
+        self.bucket_ttl = bucket_ttl
+        self.active = 0
+        # (priority, arrival order, future resolved when a slot is handed over)
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._buckets_lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        # Recent slot hold times, used to estimate Retry-After for 503s
+        self._mean_hold = 5.0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected: Dict[str, int] = {"rate_limited": 0, "queue_full": 0}
+        self.timed_out = 0
+        self.configure(limits)
+
+    def configure(self, limits: settings.Limits) -> None:
+        """Apply new limits; answers already holding a slot keep it."""
+        self.max_concurrent = limits.max_concurrent
+        self.queue_size = limits.queue_size
+        self.queue_timeout = limits.queue_timeout
+        self.rate = limits.rate
+        self.burst = limits.burst
+        for bucket in list(self._buckets.values()):
+            bucket.rate, bucket.burst = limits.rate, limits.burst
+        # A raised limit admits queued requests right away
+        while self._waiters and self.active < self.max_concurrent:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+
+    # -------------------------------------------------------------- buckets
+    def _bucket(self, client_id: str) -> TokenBucket:
+        with self._buckets_lock:
+            now = time.monotonic()
+            if now - self._last_sweep > self.bucket_ttl:
+                self._last_sweep = now
+                for key, bucket in list(self._buckets.items()):
+                    if now - bucket.updated > self.bucket_ttl:
+                        del self._buckets[key]
+            bucket = self._buckets.get(client_id)
+            if bucket is None:
+                bucket = self._buckets[client_id] = TokenBucket(self.rate, self.burst)
+            return bucket
+
+    # ---------------------------------------------------------------- slots
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    def _retry_after_busy(self) -> float:
+        waves = (self.queue_depth + 1) / max(1, self.max_concurrent)
+        return waves * self._mean_hold
+
+    def _reject(self, status_code: int, reason: str, retry_after: float):
+        admission_rejections.labels(reason).inc()
+        return Rejected(status_code, reason, retry_after)
+
+    def limit(self, client_id: str) -> None:
+        """Charge one request to *client_id*'s bucket or raise a 429."""
+        if self.rate <= 0:  # rate limiting disabled
+            return
+        wait = self._bucket(client_id).take()
+        if wait:
+            self.rejected["rate_limited"] += 1
+            raise self._reject(429, "rate_limited", wait)
+
+    async def acquire(
+        self, priority: int = PRIORITIES["normal"], timeout: Optional[float] = None
+    ) -> "Slot":
+        """Wait for a generation slot or raise a 503 ``Rejected``."""
+        started = time.monotonic()
+        if self.active < self.max_concurrent and not self.queue_depth:
+            return self._admit(started)
+
+        if self.queue_depth >= self.queue_size:
+            self.rejected["queue_full"] += 1
+            raise self._reject(503, "queue_full", self._retry_after_busy())
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        self.queued += 1
+        admission_queue_depth.inc()
+        timeout = self.queue_timeout if timeout is None else timeout
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # A slot was handed over just as the deadline passed
+                return self._admitted(started)
+            future.cancel()
+            self.timed_out += 1
+            raise self._reject(503, "queue_timeout", self._retry_after_busy())
+        except asyncio.CancelledError:
+            # Client went away while queued; pass on a slot it was just given
+            if future.done() and not future.cancelled():
+                self._release_slot(0.0)
+            future.cancel()
+            raise
+        finally:
+            admission_queue_depth.dec()
+        return self._admitted(started)
+
+    def _admit(self, started: float) -> "Slot":
+        self.active += 1
+        return self._admitted(started)
+
+    def _admitted(self, started: float) -> "Slot":
+        self.admitted += 1
+        admission_wait.observe(time.monotonic() - started)
+        return Slot(self)
+
+    def _release_slot(self, held: float) -> None:
+        # Exponential moving average of how long answers hold a slot
+        self._mean_hold = 0.9 * self._mean_hold + 0.1 * held
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # The slot passes straight to the waiter; active is unchanged
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active": self.active,
+            "max_concurrent": self.max_concurrent,
+            "queue_depth": self.queue_depth,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rate_limited": self.rejected["rate_limited"],
+            "queue_full": self.rejected["queue_full"],
+            "queue_timeout": self.timed_out,
+            "clients": len(self._buckets),
+        }
+
+
+class Slot:
+    """A held admission slot; release exactly once when the answer ends."""
+
+    __slots__ = ("_controller", "_started", "_released")
+
+    def __init__(self, controller: AdmissionController):
+        self._controller = controller
+        self._started = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release_slot(time.monotonic() - self._started)
+
+
+async def holding(slot: Slot, events):
+    """Pass *events* through and release *slot* when the stream ends."""
+    try:
+        async for event in events:
+            yield event
+    finally:
+        slot.release()
+
+
+async def admitted(priority: int, factory):
+    """Acquire a slot, then pass the events of ``factory()`` through."""
+    slot = await admission.acquire(priority)
+    async for event in holding(slot, factory()):
+        yield event
+
+
+admission = AdmissionController(settings.current().limits)
+settings.on_reload(lambda new: admission.configure(new.limits))
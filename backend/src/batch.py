@@ -0,0 +1,350 @@
+"""Bulk question answering for evaluation runs.
+
+A batch is JSONL, one question per line::
+
+    {"id": "tariff-1", "prompt": "Hansı tariflər var?"}
+    {"prompt": "What is the price of roaming?", "modelName": "amazon.nova-pro-v1:0"}
+
+``modelName``, ``routing`` and ``pipeline`` default to the batch's own
+values; ``id`` defaults to the line number; ``maxTokens`` and
+``temperature`` are optional. Questions run through the same pipelines,
+router, budgets and admission control as ``/generate``, at most
+*concurrency* at a time and at low priority, so interactive users are served
+first. Results are produced in completion order, followed by one summary
+with latency, token and cost statistics.
+
+The response cache is bypassed: an evaluation run after the documents
+change must not be answered from answers to the old ones.
+
+With a checkpoint every result is appended to a JSONL file as it completes.
+Running the same batch with the same checkpoint again skips the questions
+already answered there (failed ones are retried) and the summary covers
+both runs. A question counts as answered only if its id and its
+``fingerprint`` (prompt, model, routing, pipeline and generation
+parameters) both match, so an edited question is asked again. Checkpoints
+named through /generate/batch are kept per client.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import statistics
+import time
+from collections import Counter
+from functools import partial
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from src import settings
+from src.admission import PRIORITIES, Rejected, admission
+from src.metrics import error_code
+from src.retrieval import DEFAULT_PIPELINE, PIPELINES, generate_from_passages_stream
+from src.router import POLICIES, router
+from src.streaming import aiter_blocking
+from src.usage import account, usage_ledger
+from src.utils import inference_config, retrieve_and_generate_stream
+
+# Questions per batch, and questions of one batch answered at once
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "5000"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+BATCH_DEFAULT_CONCURRENCY = int(os.getenv("BATCH_DEFAULT_CONCURRENCY", "4"))
+# How long one question may wait for an admission slot before it fails
+BATCH_QUEUE_TIMEOUT = float(os.getenv("BATCH_QUEUE_TIMEOUT", "300"))
+# Where /generate/batch keeps named checkpoints
+BATCH_CHECKPOINT_DIR = os.getenv("BATCH_CHECKPOINT_DIR", "data/batches")
+
+_CHECKPOINT_NAME = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]{0,99}$")
+
+
+class BatchError(ValueError):
+    """The batch is invalid; lists every problem found."""
+
+    def __init__(self, problems: List[str]):
+        super().__init__("Invalid batch: " + "; ".join(problems[:20]))
+        self.problems = problems
+
+
+class BatchItem:
+    __slots__ = ("id", "prompt", "model_name", "routing", "pipeline", "inference")
+
+    def __init__(
+        self,
+        id: str,
+        prompt: str,
+        model_name: Optional[str],
+        routing: Optional[str],
+        pipeline: str,
+        inference: Optional[Dict[str, Any]] = None,
+    ):
+        self.id = id
+        self.prompt = prompt
+        self.model_name = model_name
+        self.routing = routing
+        self.pipeline = pipeline
+        self.inference = inference
+
+    def fingerprint(self) -> str:
+        """Hash of everything that shapes the answer; the id is not part of it."""
+        raw = json.dumps(
+            [self.prompt, self.model_name, self.routing, self.pipeline, self.inference],
+            sort_keys=True,
+        )
+        return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+
+def parse_items(
+    lines: Iterable[str],
+    model_name: Optional[str] = None,
+    routing: Optional[str] = None,
+    pipeline: Optional[str] = None,
+) -> List[BatchItem]:
+    """Parse JSONL questions; raises BatchError listing every bad line."""
+    items: List[BatchItem] = []
+    problems: List[str] = []
+    seen = set()
+    models = settings.current().model_by_id
+    for n, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            raw = json.loads(line)
+        except ValueError as exc:
+            problems.append(f"line {n}: {exc}")
+            continue
+        if not isinstance(raw, dict) or not str(raw.get("prompt", "")).strip():
+            problems.append(f"line {n}: needs an object with a prompt")
+            continue
+        try:
+            inference = inference_config(
+                int(raw["maxTokens"]) if "maxTokens" in raw else None,
+                float(raw["temperature"]) if "temperature" in raw else None,
+            )
+        except (TypeError, ValueError):
+            problems.append(f"line {n}: maxTokens and temperature must be numbers")
+            continue
+        item = BatchItem(
+            id=str(raw.get("id", n)),
+            prompt=str(raw["prompt"]),
+            model_name=raw.get("modelName") or model_name,
+            routing=raw.get("routing") or routing,
+            pipeline=raw.get("pipeline") or pipeline or DEFAULT_PIPELINE,
+            inference=inference,
+        )
+        if item.id in seen:
+            problems.append(f"line {n}: id {item.id!r} is used twice")
+        if item.routing and item.routing not in POLICIES:
+            problems.append(f"line {n}: unknown routing policy {item.routing!r}")
+        elif not item.routing and not item.model_name:
+            problems.append(f"line {n}: needs a modelName or a routing policy")
+        elif not item.routing and item.model_name not in models:
+            problems.append(f"line {n}: unknown model {item.model_name!r}")
+        if item.pipeline not in PIPELINES:
+            problems.append(f"line {n}: unknown pipeline {item.pipeline!r}")
+        seen.add(item.id)
+        items.append(item)
+    if len(items) > BATCH_MAX_ITEMS:
+        problems.append(f"{len(items)} questions, at most {BATCH_MAX_ITEMS} allowed")
+    if not items and not problems:
+        problems.append("no questions")
+    if problems:
+        raise BatchError(problems)
+    return items
+
+
+class Checkpoint:
+    """Append-only JSONL of results, read back to resume a batch."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    @classmethod
+    def named(
+        cls, name: str, client_id: str, directory: str = BATCH_CHECKPOINT_DIR
+    ) -> "Checkpoint":
+        """Checkpoint *name* of *client_id*, kept in that client's directory."""
+        if not _CHECKPOINT_NAME.match(name):
+            raise BatchError([f"checkpoint name {name!r} is not allowed"])
+        client = hashlib.sha256(client_id.encode()).hexdigest()[:16]
+        return cls(os.path.join(directory, client, name + ".jsonl"))
+
+    def completed(self) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """Successful results by (id, fingerprint); a truncated line is ignored."""
+        done: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        result = json.loads(line)
+                    except ValueError:
+                        continue
+                    if not result.get("error") and "fingerprint" in result:
+                        done[str(result["id"]), result["fingerprint"]] = result
+        except FileNotFoundError:
+            pass
+        return done
+
+    def append(self, result: Dict[str, Any]) -> None:
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps(result, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _answer_stream(item: BatchItem, model_name: Optional[str]):
+    stream_fn = retrieve_and_generate_stream
+    if item.pipeline == "decoupled":
+        stream_fn = generate_from_passages_stream
+    if item.inference:
+        stream_fn = partial(stream_fn, inference=item.inference)
+    if item.routing:
+        return router.stream(item.prompt, item.routing, stream_fn=stream_fn)
+    return stream_fn(user_query=item.prompt, model_name=model_name)
+
+
+async def _acquire(priority: int):
+    """An admission slot, waiting out full queues for BATCH_QUEUE_TIMEOUT."""
+    deadline = time.monotonic() + BATCH_QUEUE_TIMEOUT
+    while True:
+        remaining = deadline - time.monotonic()
+        try:
+            return await admission.acquire(priority, timeout=max(remaining, 0.0))
+        except Rejected as exc:
+            if exc.reason != "queue_full" or remaining < exc.retry_after:
+                raise
+            await asyncio.sleep(exc.retry_after)
+
+
+async def answer(item: BatchItem, priority: int, user: str) -> Dict[str, Any]:
+    """Answer one question; failures are reported in the result, not raised."""
+    result: Dict[str, Any] = {
+        "type": "result",
+        "id": item.id,
+        "prompt": item.prompt,
+        "model": item.model_name,
+        "pipeline": item.pipeline,
+        "fingerprint": item.fingerprint(),
+    }
+    parts: List[str] = []
+    queued = time.perf_counter()
+    started = ttft = None
+    try:
+        # Over-budget models are swapped for a cheaper one, as in /generate
+        model_name = usage_ledger.check(user, None if item.routing else item.model_name)
+        slot = await _acquire(priority)
+        started = time.perf_counter()
+        try:
+            stream = aiter_blocking(_answer_stream(item, model_name))
+            async for event in account(stream, item.prompt, user, model_name or ""):
+                if event["type"] == "text":
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                    parts.append(event["text"])
+                elif event["type"] == "citations":
+                    result["citations"] = event["citations"]
+                elif event["type"] == "model":
+                    result["model"] = event["model"]
+                elif event["type"] == "usage":
+                    result["model"] = event["model"]
+                    result["input_tokens"] = event["input_tokens"]
+                    result["output_tokens"] = event["output_tokens"]
+                    result["cost"] = event["cost"]
+        finally:
+            slot.release()
+    except Rejected as exc:
+        result["error"] = exc.reason
+    except Exception as exc:
+        result["error"] = f"{error_code(exc)}: {exc}"
+    answer_text = "".join(parts)
+    result["answer"] = answer_text
+    result["queued"] = round((started or time.perf_counter()) - queued, 4)
+    if started is not None:
+        result["latency"] = round(time.perf_counter() - started, 4)
+    result["ttft"] = round(ttft, 4) if ttft is not None else None
+    return result
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 4)
+
+
+def summarize(
+    results: List[Dict[str, Any]], resumed: int, elapsed: float
+) -> Dict[str, Any]:
+    ok = [r for r in results if not r.get("error")]
+    latencies = [r["latency"] for r in ok if r.get("latency") is not None]
+    ttfts = [r["ttft"] for r in ok if r.get("ttft") is not None]
+    output_tokens = sum(r.get("output_tokens", 0) for r in ok)
+    return {
+        "type": "summary",
+        "questions": len(results),
+        "answered": len(ok),
+        "errors": len(results) - len(ok),
+        "resumed": resumed,
+        "elapsed": round(elapsed, 3),
+        "latency_p50": _percentile(latencies, 0.50),
+        "latency_p95": _percentile(latencies, 0.95),
+        "latency_mean": round(statistics.mean(latencies), 4) if latencies else None,
+        "ttft_p50": _percentile(ttfts, 0.50),
+        "ttft_p95": _percentile(ttfts, 0.95),
+        "input_tokens": sum(r.get("input_tokens", 0) for r in ok),
+        "output_tokens": output_tokens,
+        "output_tokens_mean": round(output_tokens / len(ok), 1) if ok else None,
+        "cost": round(sum(r.get("cost", 0.0) for r in ok), 6),
+        "models": dict(Counter(r.get("model") for r in ok)),
+        "error_reasons": dict(Counter(r["error"] for r in results if r.get("error"))),
+    }
+
+
+async def run_batch(
+    items: List[BatchItem],
+    concurrency: int = BATCH_DEFAULT_CONCURRENCY,
+    checkpoint: Optional[Checkpoint] = None,
+    priority: int = PRIORITIES["low"],
+    user: str = "batch",
+) -> AsyncIterator[Dict[str, Any]]:
+    """Yield results in completion order, then a summary.
+
+    Tokens and cost are charged to *user*, whose daily budget applies.
+    """
+    concurrency = max(1, min(concurrency, BATCH_MAX_CONCURRENCY))
+    started = time.perf_counter()
+    done = checkpoint.completed() if checkpoint is not None else {}
+    keys = [(item.id, item.fingerprint()) for item in items]
+    previous = [done[key] for key in keys if key in done]
+    pending = iter([item for item, key in zip(items, keys) if key not in done])
+    finished: asyncio.Queue = asyncio.Queue()
+
+    async def worker():
+        for item in pending:
+            await finished.put(await answer(item, priority, user))
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    remaining = len(items) - len(previous)
+    results = list(previous)
+    try:
+        while remaining:
+            result = await finished.get()
+            remaining -= 1
+            results.append(result)
+            if checkpoint is not None:
+                checkpoint.append(result)
+            yield result
+    finally:
+        # Client gone or batch done: stop the workers and their streams
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        if checkpoint is not None:
+            checkpoint.close()
+    yield summarize(results, len(previous), time.perf_counter() - started)
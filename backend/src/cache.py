@@ -0,0 +1,296 @@
+"""Response cache in front of retrieve_and_generate_stream.
+
+Answers are stored as the list of events Bedrock produced so a hit is
+replayed through the same text/event-stream response at the original chunk
+boundaries. Entries live in an in-memory LRU bounded by TTL and a byte
+budget, with an optional SQLite tier behind it that survives restarts. The
+SQLite file is opened on first use; on the event loop use ``aget``/``aput``,
+which read and write it on a thread.
+
+The prompt is passed through a pluggable normalizer before keying. A
+normalizer is any ``str -> str`` callable, so a near-duplicate matcher (for
+example one mapping a prompt to the closest previously seen prompt by
+embedding similarity) can be dropped in later without touching callers.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 << 20)))
+# Empty disables the on-disk tier
+RESPONSE_CACHE_SQLITE_PATH = os.getenv("RESPONSE_CACHE_SQLITE_PATH", "")
+
+Normalizer = Callable[[str], str]
+Event = Dict[str, Any]
+
+_WHITESPACE = re.compile(r"\s+")
+# Sentence punctuation, quotes and brackets. They are only stripped from the
+# ends of a word, so "10.5", "c++" and "e-sim" keep theirs.
+_EDGE_PUNCTUATION = ".,;:!?¿¡…–—\"'“”‘’«»()[]{}"
+
+
+def casefold(text: str) -> str:
+    return text.casefold()
+
+
+def collapse_whitespace(text: str) -> str:
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def strip_punctuation(text: str) -> str:
+    words = (word.strip(_EDGE_PUNCTUATION) for word in text.split())
+    return " ".join(word for word in words if word)
+
+
+def compose(*rules: Normalizer) -> Normalizer:
+    """Chain normalization rules left to right."""
+
+    def normalize(text: str) -> str:
+        for rule in rules:
+            text = rule(text)
+        return text
+
+    return normalize
+
+
+default_normalizer = compose(casefold, strip_punctuation, collapse_whitespace)
+
+
+class _Entry:
+    __slots__ = ("chunks", "created_at", "size")
+
+    def __init__(self, chunks: List[Event], created_at: float):
+        self.chunks = chunks
+        self.created_at = created_at
+        self.size = len(json.dumps(chunks).encode())
+
+
+class _SQLiteTier:
+    def __init__(self, path: str, ttl: float):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        # One connection, used from the request threads and the event loop's
+        # worker threads
+        self._lock = threading.Lock()
+        self._connect()
+        # A forked worker must not share its parent's connection
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._connect)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, chunks TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        # Drop rows that expired while the process was down
+        self._conn.execute(
+            "DELETE FROM responses WHERE created_at < ?", (time.time() - ttl,)
+        )
+        self._conn.commit()
+
+    def _connect(self) -> None:
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT chunks, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def put(self, key: str, chunks: List[Event], created_at: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, chunks, created_at) "
+                "VALUES (?, ?, ?)",
+                (key, json.dumps(chunks), created_at),
+            )
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        ttl: float = RESPONSE_CACHE_TTL,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+        sqlite_path: str = RESPONSE_CACHE_SQLITE_PATH,
+        normalizer: Normalizer = default_normalizer,
+    ):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.normalizer = normalizer
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._disk_path = sqlite_path
+        self._disk: Optional[_SQLiteTier] = None
+        self._disk_lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, prompt: str, model_name: str, kb_id: str) -> str:
+        raw = "\x1f".join((kb_id, model_name, self.normalizer(prompt)))
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _database(self) -> Optional[_SQLiteTier]:
+        if self._disk is None and self._disk_path:
+            with self._disk_lock:
+                if self._disk is None:
+                    self._disk = _SQLiteTier(self._disk_path, self.ttl)
+        return self._disk
+
+    def get(self, key: str) -> Optional[List[Event]]:
+        chunks = self._get_memory(key)
+        if chunks is None:
+            chunks = self._load(key)
+        return chunks
+
+    async def aget(self, key: str) -> Optional[List[Event]]:
+        """``get`` for the event loop: a memory miss reads SQLite on a thread."""
+        chunks = self._get_memory(key)
+        if chunks is None:
+            if self._disk_path:
+                chunks = await asyncio.to_thread(self._load, key)
+            else:
+                chunks = self._load(key)
+        return chunks
+
+    def _get_memory(self, key: str) -> Optional[List[Event]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry.created_at < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.chunks
+            self._remove(key)
+            return None
+
+    def _load(self, key: str) -> Optional[List[Event]]:
+        """The SQLite tier's entry for a memory miss; counts the miss if none."""
+        disk = self._database()
+        found = disk.get(key) if disk is not None else None
+        if found is not None:
+            chunks, created_at = found
+            if time.time() - created_at < self.ttl:
+                with self._lock:
+                    self._insert(key, _Entry(chunks, created_at))
+                    self.disk_hits += 1
+                return chunks
+            disk.delete(key)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, chunks: List[Event]) -> None:
+        entry = self._put_memory(key, chunks)
+        if entry is not None and self._disk_path:
+            self._save(key, entry)
+
+    async def aput(self, key: str, chunks: List[Event]) -> None:
+        """``put`` for the event loop: SQLite is written on a thread."""
+        entry = self._put_memory(key, chunks)
+        if entry is not None and self._disk_path:
+            await asyncio.to_thread(self._save, key, entry)
+
+    def _put_memory(self, key: str, chunks: List[Event]) -> Optional[_Entry]:
+        entry = _Entry(list(chunks), time.time())
+        if entry.size > self.max_bytes:
+            return None
+        with self._lock:
+            self._insert(key, entry)
+        return entry
+
+    def _save(self, key: str, entry: _Entry) -> None:
+        self._database().put(key, entry.chunks, entry.created_at)
+
+    def _insert(self, key: str, entry: _Entry) -> None:
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def clear(self) -> None:
+        """Drop every entry, including the on-disk ones."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self._disk_path:
+            self._database().clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        if self._disk is not None:
+            self._disk.close()
+
+
+async def replay(chunks: List[Event]) -> AsyncIterator[Event]:
+    for chunk in chunks:
+        yield chunk
+
+
+async def record(
+    cache: ResponseCache, key: str, stream: AsyncIterator[Event]
+) -> AsyncIterator[Event]:
+    """Pass *stream* through, storing it only if it completes successfully.
+
+    Session events are not stored: a Bedrock session belongs to the user who
+    started it and must not be replayed to others.
+    """
+    chunks = []
+    async for chunk in stream:
+        if chunk["type"] != "session":
+            chunks.append(chunk)
+        yield chunk
+    if chunks:
+        await cache.aput(key, chunks)
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,173 @@
+"""Process-wide registry of pooled Bedrock clients.
+
+Building a boto3 client resolves credentials, loads the service model and
+opens a fresh TLS connection pool, so it is done once per
+(service, region, credentials) and the client is shared across requests.
+botocore clients are thread-safe, which makes this safe for the threadpool
+Starlette runs blocking generators on.
+
+Importing boto3/botocore is the largest part of the backend's import time,
+so the SDK is imported on first use rather than at module import, and
+clients are built with botocore directly (boto3 adds nothing for them). Parsed
+service models are kept in one loader shared by every client; ``preload``
+fills it ahead of time, either in a pre-fork master (gunicorn --preload,
+see gunicorn.conf.py) so all workers inherit it, or from the startup
+warm-up. A forked child drops the clients it inherited: their connection
+pools belong to the parent.
+"""
+
+import hashlib
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+# Connection pool tuning, overridable per deployment
+BEDROCK_MAX_POOL_CONNECTIONS = int(os.getenv("BEDROCK_MAX_POOL_CONNECTIONS", "50"))
+BEDROCK_TCP_KEEPALIVE = os.getenv("BEDROCK_TCP_KEEPALIVE", "true").lower() == "true"
+BEDROCK_CONNECT_TIMEOUT = float(os.getenv("BEDROCK_CONNECT_TIMEOUT", "5"))
+BEDROCK_READ_TIMEOUT = float(os.getenv("BEDROCK_READ_TIMEOUT", "120"))
+
+# Services whose models ``preload`` parses
+BEDROCK_SERVICES = ("bedrock-agent-runtime", "bedrock-runtime")
+
+ClientKey = Tuple[str, str, str, str]
+ClientFactory = Callable[..., Any]
+
+_loader = None
+_loader_lock = threading.Lock()
+
+
+def _shared_loader():
+    """botocore data loader whose parsed JSON is reused by every client."""
+    global _loader
+    with _loader_lock:
+        if _loader is None:
+            from botocore.loaders import create_loader
+
+            _loader = create_loader()
+    return _loader
+
+
+def preload(services: Iterable[str] = BEDROCK_SERVICES) -> None:
+    """Import the AWS SDK and parse the service models clients will need."""
+    import botocore.session  # noqa: F401 - the client machinery itself
+    from botocore.exceptions import DataNotFoundError
+
+    loader = _shared_loader()
+    loader.load_data("endpoints")
+    loader.load_data("partitions")
+    for service in services:
+        loader.load_service_model(service, "service-2")
+        try:
+            loader.load_service_model(service, "endpoint-rule-set-1")
+        except DataNotFoundError:
+            pass
+
+
+def _fingerprint(secret: Optional[str]) -> str:
+    """Hash a secret so raw credentials never sit in the registry keys."""
+    return hashlib.sha256((secret or "").encode()).hexdigest()[:16]
+
+
+def botocore_factory(
+    service: str,
+    region: str,
+    access_key: Optional[str],
+    secret_key: Optional[str],
+    options: Dict[str, Any],
+):
+    import botocore.session
+    from botocore.config import Config
+
+    # A dedicated session per client avoids sharing boto3's global default
+    # session, which is not thread-safe to create clients from. The sessions
+    # share one loader so service models are parsed once. The client is the
+    # one boto3's Session.client would return, minus importing boto3.
+    session = botocore.session.Session()
+    session.register_component("data_loader", _shared_loader())
+    return session.create_client(
+        service,
+        region_name=region,
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key,
+        config=Config(**options),
+    )
+
+
+class ClientRegistry:
+    """Lazily creates and caches one client per service, region and credentials."""
+
+    def __init__(
+        self,
+        max_pool_connections: int = BEDROCK_MAX_POOL_CONNECTIONS,
+        tcp_keepalive: bool = BEDROCK_TCP_KEEPALIVE,
+        connect_timeout: float = BEDROCK_CONNECT_TIMEOUT,
+        read_timeout: float = BEDROCK_READ_TIMEOUT,
+        factory: ClientFactory = botocore_factory,
+    ):
+        # botocore Config arguments; built by the factory, so a fake needs
+        # no SDK import
+        self.options = {
+            "max_pool_connections": max_pool_connections,
+            "tcp_keepalive": tcp_keepalive,
+            "connect_timeout": connect_timeout,
+            "read_timeout": read_timeout,
+        }
+        self._factory = factory
+        self._clients: Dict[ClientKey, Any] = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self) -> None:
+        # Never close the inherited clients: their sockets are the parent's
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        service: str,
+        region: str,
+        access_key: Optional[str] = None,
+        secret_key: Optional[str] = None,
+    ):
+        key = (service, region, access_key or "", _fingerprint(secret_key))
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._factory(
+                    service, region, access_key, secret_key, self.options
+                )
+                self._clients[key] = client
+                self.created += 1
+            else:
+                self.reused += 1
+        return client
+
+    def set_factory(self, factory: ClientFactory) -> None:
+        """Swap the client factory (e.g. for a fake Bedrock) and drop cached clients."""
+        self.close()
+        with self._lock:
+            self._factory = factory
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "clients": len(self._clients),
+            "created": self.created,
+            "reused": self.reused,
+        }
+
+    def close(self) -> None:
+        """Close every pooled client; called on application shutdown."""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            close = getattr(client, "close", None)
+            if close is not None:
+                close()
+
+
+registry = ClientRegistry()
@@ -1,5 +1,34 @@
+"""Build or update the local hybrid retrieval index.
+
+Usage (from backend/):
+    uv run python -m src.features.build_features --corpus export/ --index data/index
+
+Re-running against the same index only embeds documents that are new or
+changed since the last build; removed documents are dropped.
+"""
+
+import argparse
+import time
+
+from src.features.hybrid_index import HashingEmbedder, build_index, load_corpus
+
+
 def main():
-    print("Create features here")
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--corpus", required=True, help="JSONL file or directory of documents"
+    )
+    parser.add_argument("--index", required=True, help="index directory")
+    parser.add_argument("--dim", type=int, default=256, help="embedding size")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    docs = load_corpus(args.corpus)
+    stats = build_index(docs, args.index, HashingEmbedder(args.dim))
+    stats["seconds"] = round(time.perf_counter() - started, 2)
+    print(" ".join(f"{key}={value}" for key, value in stats.items()))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,371 @@
+"""Local hybrid retrieval index: BM25 + dense vectors, fused by RRF.
+
+An index is a directory built from an exported document corpus:
+
+* ``meta.json``: format version, embedder, BM25 parameters, corpus stats;
+* ``docs.jsonl``: one ``{"id", "text", "uri", "hash"}`` object per line;
+* ``terms.json``: term -> [offset, document frequency] into the postings;
+* ``postings.i32`` / ``tfs.u16``: document ids and term frequencies of every
+  term, concatenated term by term (a compact inverted index);
+* ``doclen.u32``: token count per document;
+* ``vectors.f16``: L2-normalized document embeddings, one row per document.
+
+The array files are raw little-endian data opened with ``numpy.memmap``, so
+loading an index costs almost nothing and the OS pages in only what queries
+touch. Dense search multiplies the query (or a batch of queries) against
+the matrix in blocks and keeps a running top-k, so memory stays flat
+however large the corpus is. NumPy has no fast half-precision matmul, and
+upcasting a block costs far more than multiplying it, so a matrix that fits
+in INDEX_VECTOR_CACHE_BYTES as float32 is upcast once and kept in memory.
+Larger ones are upcast block by block per call, a cost that batching
+queries amortizes.
+
+Results of both searches are combined by reciprocal-rank fusion and returned
+as passages (``{"text", "uri", "score", "similarity"}``), the same shape the
+remote knowledge base produces, so the index can stand in front of or
+instead of it (see src/retrieval.py).
+
+Rebuilding is incremental: documents whose content hash did not change keep
+their stored embedding, and only new or edited documents are embedded.
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import tempfile
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+FORMAT_VERSION = 1
+RRF_K = 60
+VECTOR_BLOCK_ROWS = 65536
+# float32 copy of the vectors kept in memory when it fits in this many bytes
+INDEX_VECTOR_CACHE_BYTES = int(os.getenv("INDEX_VECTOR_CACHE_BYTES", str(256 << 20)))
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+Doc = Dict[str, str]
+Passage = Dict[str, object]
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN.findall(text.casefold()) if len(t) > 1]
+
+
+def content_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+
+class HashingEmbedder:
+    """Dependency-free embedder: signed feature hashing of words and trigrams.
+
+    Not a semantic model, but it tolerates inflections and typos that BM25
+    misses and needs no network, which is what an offline tier requires.
+    Any object with ``name``, ``dim`` and ``embed(texts) -> float32 array``
+    can replace it.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> Counter:
+        features: Counter = Counter()
+        for token in tokenize(text):
+            features["w:" + token] += 1
+            padded = f"#{token}#"
+            for i in range(len(padded) - 2):
+                features["c:" + padded[i : i + 3]] += 1
+        return features
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in self._features(text).items():
+                h = zlib.crc32(feature.encode())
+                sign = 1.0 if h & 0x80000000 else -1.0
+                matrix[row, h % self.dim] += sign * (1.0 + math.log(count))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+
+def make_embedder(name: str) -> HashingEmbedder:
+    kind, _, dim = name.partition("-")
+    if kind != "hashing":
+        raise ValueError(f"Unknown embedder {name!r}")
+    return HashingEmbedder(int(dim or 256))
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the *k* largest scores, best first."""
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def rrf(rankings: Iterable[Sequence[int]], k: int = RRF_K) -> List[Tuple[int, float]]:
+    """Reciprocal-rank fusion of several best-first rankings of doc ids."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            fused[doc] = fused.get(doc, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+class HybridIndex:
+    def __init__(self, path, vector_cache_bytes: int = INDEX_VECTOR_CACHE_BYTES):
+        self.path = Path(path)
+        self.vector_cache_bytes = vector_cache_bytes
+        self._vectors32: Optional[np.ndarray] = None
+        with open(self.path / "meta.json", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta["version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported index version {self.meta['version']}")
+        with open(self.path / "docs.jsonl", encoding="utf-8") as f:
+            self.docs: List[Doc] = [json.loads(line) for line in f]
+        with open(self.path / "terms.json", encoding="utf-8") as f:
+            self.terms: Dict[str, List[int]] = json.load(f)
+        self.embedder = make_embedder(self.meta["embedder"])
+        n = len(self.docs)
+        self.postings = _open_array(self.path / "postings.i32", np.int32)
+        self.tfs = _open_array(self.path / "tfs.u16", np.uint16)
+        self.doclen = _open_array(self.path / "doclen.u32", np.uint32)
+        self.vectors = _open_array(
+            self.path / "vectors.f16", np.float16, (n, self.meta["dim"])
+        )
+        # BM25 length normalization depends only on the document
+        k1, b = self.meta["k1"], self.meta["b"]
+        avgdl = self.meta["avgdl"] or 1.0
+        self._length_norm = k1 * (1 - b + b * self.doclen.astype(np.float32) / avgdl)
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    # ---------------------------------------------------------------- BM25
+    def bm25(self, query: str, k: int = 20) -> Tuple[np.ndarray, np.ndarray]:
+        """Best-first doc ids and BM25 scores for *query*."""
+        k1, n = self.meta["k1"], len(self.docs)
+        scores = np.zeros(n, dtype=np.float32)
+        for term in set(tokenize(query)):
+            entry = self.terms.get(term)
+            if entry is None:
+                continue
+            offset, df = entry
+            ids = self.postings[offset : offset + df]
+            tf = self.tfs[offset : offset + df].astype(np.float32)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            scores[ids] += idf * tf * (k1 + 1) / (tf + self._length_norm[ids])
+        top = _top_k(scores, k)
+        top = top[scores[top] > 0]
+        return top, scores[top]
+
+    # -------------------------------------------------------------- vectors
+    def dense(
+        self, queries: Sequence[str], k: int = 20
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Cosine top-k for a batch of queries, scanning the matrix in blocks."""
+        q = self.embedder.embed(queries)  # (m, dim), unit rows
+        m = len(queries)
+        best_ids = np.empty((m, 0), dtype=np.int64)
+        best_scores = np.empty((m, 0), dtype=np.float32)
+        for start, block in self._float_blocks():
+            sims = q @ block.T  # (m, rows)
+            ids = np.broadcast_to(
+                np.arange(start, start + block.shape[0]), sims.shape
+            )
+            best_ids = np.concatenate([best_ids, ids], axis=1)
+            best_scores = np.concatenate([best_scores, sims], axis=1)
+            if best_scores.shape[1] > k:
+                keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_ids = np.take_along_axis(best_ids, keep, axis=1)
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+        results = []
+        for row in range(m):
+            order = np.argsort(-best_scores[row], kind="stable")
+            results.append((best_ids[row][order], best_scores[row][order]))
+        return results
+
+    def _float_blocks(self) -> Iterator[Tuple[int, np.ndarray]]:
+        if self._vectors32 is None and self.vectors.size * 4 <= self.vector_cache_bytes:
+            self._vectors32 = np.asarray(self.vectors, dtype=np.float32)
+        if self._vectors32 is not None:
+            yield 0, self._vectors32
+            return
+        for start in range(0, len(self.docs), VECTOR_BLOCK_ROWS):
+            block = self.vectors[start : start + VECTOR_BLOCK_ROWS]
+            yield start, np.asarray(block, dtype=np.float32)
+
+    # --------------------------------------------------------------- hybrid
+    def search(self, query: str, k: int = 8, candidates: int = 50) -> List[Passage]:
+        return self.search_batch([query], k, candidates)[0]
+
+    def search_batch(
+        self, queries: Sequence[str], k: int = 8, candidates: int = 50
+    ) -> List[List[Passage]]:
+        """Hybrid top-*k* passages per query, fused from both rankings."""
+        dense = self.dense(queries, candidates)
+        results = []
+        for query, (vec_ids, vec_scores) in zip(queries, dense):
+            bm25_ids, _ = self.bm25(query, candidates)
+            similarity = dict(zip(vec_ids.tolist(), vec_scores.tolist()))
+            fused = rrf([bm25_ids.tolist(), vec_ids.tolist()])[:k]
+            results.append(
+                [
+                    {
+                        "text": self.docs[doc]["text"],
+                        "uri": self.docs[doc].get("uri", ""),
+                        "score": score,
+                        "similarity": similarity.get(doc, 0.0),
+                    }
+                    for doc, score in fused
+                ]
+            )
+        return results
+
+
+def _open_array(path: Path, dtype, shape=None) -> np.ndarray:
+    # np.memmap refuses empty files, which an empty corpus produces
+    if path.stat().st_size == 0:
+        return np.zeros(shape or (0,), dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+# ------------------------------------------------------------------ building
+def load_corpus(path) -> List[Doc]:
+    """Read ``{"id", "text", "uri"}`` objects from JSONL file(s) or text files.
+
+    *path* may be a ``.jsonl`` file or a directory; in a directory every
+    ``.jsonl`` file is read and every ``.txt``/``.md`` file becomes one
+    document whose id is its relative path.
+    """
+    path = Path(path)
+    files = [path] if path.is_file() else sorted(p for p in path.rglob("*"))
+    docs: List[Doc] = []
+    for file in files:
+        if file.suffix == ".jsonl":
+            with open(file, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        item = json.loads(line)
+                        docs.append(
+                            {
+                                "id": str(item["id"]),
+                                "text": item["text"],
+                                "uri": item.get("uri", ""),
+                            }
+                        )
+        elif file.suffix in (".txt", ".md"):
+            rel = file.relative_to(path) if path.is_dir() else file.name
+            docs.append(
+                {
+                    "id": str(rel),
+                    "text": file.read_text(encoding="utf-8"),
+                    "uri": file.resolve().as_uri(),
+                }
+            )
+    return docs
+
+
+def build_index(
+    docs: Sequence[Doc],
+    path,
+    embedder: Optional[HashingEmbedder] = None,
+    k1: float = 1.2,
+    b: float = 0.75,
+    batch_size: int = 256,
+) -> Dict[str, int]:
+    """Write an index for *docs* to *path*, reusing embeddings already there.
+
+    The new index is written to a temporary directory next to *path* and
+    swapped in at the end, so readers never see a half-written index.
+    """
+    path = Path(path)
+    embedder = embedder or HashingEmbedder()
+    previous: Dict[str, int] = {}
+    if (path / "meta.json").exists():
+        old = HybridIndex(path)
+        if old.meta["embedder"] == embedder.name:
+            for row, doc in enumerate(old.docs):
+                previous[doc["hash"]] = row
+        old_vectors = old.vectors
+
+    unique: Dict[str, Doc] = {}
+    for doc in docs:  # later duplicates of an id win
+        unique[doc["id"]] = {**doc, "hash": content_hash(doc["text"])}
+    docs = list(unique.values())
+
+    vectors = np.zeros((len(docs), embedder.dim), dtype=np.float16)
+    to_embed = []
+    for row, doc in enumerate(docs):
+        old_row = previous.get(doc["hash"])
+        if old_row is not None:
+            vectors[row] = old_vectors[old_row]
+        else:
+            to_embed.append(row)
+    for start in range(0, len(to_embed), batch_size):
+        rows = to_embed[start : start + batch_size]
+        vectors[rows] = embedder.embed([docs[r]["text"] for r in rows])
+
+    postings: Dict[str, List[Tuple[int, int]]] = {}
+    doclen = np.zeros(len(docs), dtype=np.uint32)
+    for row, doc in enumerate(docs):
+        counts = Counter(tokenize(doc["text"]))
+        doclen[row] = sum(counts.values())
+        for term, tf in counts.items():
+            postings.setdefault(term, []).append((row, min(tf, 65535)))
+
+    terms: Dict[str, List[int]] = {}
+    ids, tfs = [], []
+    for term in sorted(postings):
+        terms[term] = [len(ids), len(postings[term])]
+        for row, tf in postings[term]:
+            ids.append(row)
+            tfs.append(tf)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(prefix=path.name + ".", dir=path.parent))
+    np.asarray(ids, dtype="<i4").tofile(tmp / "postings.i32")
+    np.asarray(tfs, dtype="<u2").tofile(tmp / "tfs.u16")
+    doclen.astype("<u4").tofile(tmp / "doclen.u32")
+    vectors.astype("<f2").tofile(tmp / "vectors.f16")
+    with open(tmp / "terms.json", "w", encoding="utf-8") as f:
+        json.dump(terms, f, ensure_ascii=False)
+    with open(tmp / "docs.jsonl", "w", encoding="utf-8") as f:
+        for doc in docs:
+            f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+    meta = {
+        "version": FORMAT_VERSION,
+        "embedder": embedder.name,
+        "dim": embedder.dim,
+        "k1": k1,
+        "b": b,
+        "docs": len(docs),
+        "avgdl": float(doclen.mean()) if len(docs) else 0.0,
+    }
+    with open(tmp / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+    if path.exists():
+        retired = path.with_name(path.name + ".old")
+        shutil.rmtree(retired, ignore_errors=True)
+        os.replace(path, retired)
+        os.replace(tmp, path)
+        shutil.rmtree(retired, ignore_errors=True)
+    else:
+        os.replace(tmp, path)
+    return {
+        "docs": len(docs),
+        "embedded": len(to_embed),
+        "reused": len(docs) - len(to_embed),
+        "terms": len(terms),
+    }
@@ -0,0 +1,437 @@
+"""Server-side conversation memory per chat.
+
+A request with a ``chatId`` is answered with the chat's earlier turns as
+context, so the frontend sends only the new question. The context is a
+running summary of older turns plus the most recent turns verbatim, cut to
+MEMORY_TOKEN_BUDGET tokens. Prompt size therefore stays flat no matter how
+long the chat gets.
+
+After an answer completes, the question and answer are appended to the
+chat. Once more than MEMORY_WINDOW_TURNS turns are unsummarized, or they
+no longer fit the budget, the oldest turns are folded into the summary by
+MEMORY_SUMMARY_MODEL on a background thread. Requests never wait for
+that: until the summary is ready, turns that do not fit are left out of
+the prompt. Summarization tokens are charged to the chat's user.
+
+Chats are kept in an in-memory LRU of MEMORY_MAX_CHATS and written
+through to SQLite by one writer thread after every turn and summary, so a
+crash loses at most the writes still queued. Each worker process has its
+own LRU and they share the SQLite file: ``history`` re-reads a chat that
+another worker has updated since, so the next turn can land on any worker.
+The database is opened on first use. Chats idle for MEMORY_TTL are
+dropped. Chats are keyed by the client id and the chat id, so one user
+cannot read another's chat.
+
+For a chat with memory the history takes the place of the Bedrock session:
+the request's sessionId is not used and no session is handed back.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from src.usage import estimate_tokens, usage_ledger
+from src.utils import create_runtime
+
+MEMORY_ENABLED = os.getenv("MEMORY_ENABLED", "true").lower() == "true"
+MEMORY_MAX_CHATS = int(os.getenv("MEMORY_MAX_CHATS", "5000"))
+# Empty keeps chats in this process's LRU only
+MEMORY_DB_PATH = os.getenv("MEMORY_DB_PATH", "data/memory.sqlite3")
+MEMORY_TTL = float(os.getenv("MEMORY_TTL", str(7 * 86400)))
+# History tokens per prompt: the summary plus as many recent turns as fit
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "1500"))
+# Unsummarized turns kept before the oldest are folded into the summary
+MEMORY_WINDOW_TURNS = int(os.getenv("MEMORY_WINDOW_TURNS", "6"))
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "300"))
+MEMORY_SUMMARY_MODEL = os.getenv(
+    "MEMORY_SUMMARY_MODEL", "anthropic.claude-3-haiku-20240307-v1:0"
+)
+MEMORY_SUMMARY_WORKERS = int(os.getenv("MEMORY_SUMMARY_WORKERS", "2"))
+# Longer questions or answers are stored cut to this many characters
+MEMORY_MESSAGE_MAX_CHARS = int(os.getenv("MEMORY_MESSAGE_MAX_CHARS", "4000"))
+
+logger = logging.getLogger(__name__)
+
+Event = Dict[str, Any]
+# (question, answer, estimated tokens of both)
+Turn = Tuple[str, str, int]
+
+SUMMARY_PROMPT = (
+    "You keep the running summary of a customer's conversation with Azercell's "
+    "assistant. Merge the new turns into the summary. Keep the facts, names, "
+    "numbers and open questions later turns may refer to; drop greetings and "
+    "repetition. Write at most {words} words in the language of the "
+    "conversation and reply with the summary only."
+)
+
+
+def _clip(text: str) -> str:
+    if len(text) <= MEMORY_MESSAGE_MAX_CHARS:
+        return text
+    return text[:MEMORY_MESSAGE_MAX_CHARS].rsplit(" ", 1)[0] + " …"
+
+
+class History:
+    """The context sent with a new question: summary, then recent turns."""
+
+    __slots__ = ("summary", "turns")
+
+    def __init__(self, summary: str, turns: List[Tuple[str, str]]):
+        self.summary = summary
+        self.turns = turns
+
+    def transcript(self) -> str:
+        """The history as plain text, for prompt templates."""
+        parts = []
+        if self.summary:
+            parts.append(f"Summary of the earlier conversation: {self.summary}")
+        for question, answer in self.turns:
+            parts.append(f"User: {question}\nAssistant: {answer}")
+        return "\n\n".join(parts)
+
+    def messages(self) -> List[Dict[str, Any]]:
+        """The recent turns as alternating ``converse`` messages."""
+        messages = []
+        for question, answer in self.turns:
+            messages.append({"role": "user", "content": [{"text": question}]})
+            messages.append({"role": "assistant", "content": [{"text": answer}]})
+        return messages
+
+
+class _Chat:
+    __slots__ = ("user", "summary", "summary_tokens", "turns", "updated_at", "deleted")
+
+    def __init__(
+        self,
+        user: str,
+        summary: str = "",
+        turns: Optional[List[Turn]] = None,
+        updated_at: Optional[float] = None,
+    ):
+        self.user = user
+        self.summary = summary
+        self.summary_tokens = estimate_tokens(summary)
+        self.turns: List[Turn] = turns or []
+        self.updated_at = updated_at or time.time()
+        # Set when the chat is forgotten while a summary is being written
+        self.deleted = False
+
+    def unsummarized_tokens(self) -> int:
+        return sum(turn[2] for turn in self.turns)
+
+    def needs_summary(self) -> bool:
+        return len(self.turns) > 1 and (
+            len(self.turns) > MEMORY_WINDOW_TURNS
+            or self.summary_tokens + self.unsummarized_tokens() > MEMORY_TOKEN_BUDGET
+        )
+
+
+class _MemoryDB:
+    def __init__(self, path: str, ttl: float):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._connect()
+        # A forked worker must not share its parent's connection
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._connect)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chats ("
+            "key TEXT PRIMARY KEY, user TEXT NOT NULL, summary TEXT NOT NULL, "
+            "turns TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        # Drop chats that went idle while the process was down
+        self._conn.execute(
+            "DELETE FROM chats WHERE updated_at < ?", (time.time() - ttl,)
+        )
+        self._conn.commit()
+
+    def _connect(self) -> None:
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+
+    def get(self, key: str) -> Optional[_Chat]:
+        row = self._conn.execute(
+            "SELECT user, summary, turns, updated_at FROM chats WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        user, summary, turns, updated_at = row
+        return _Chat(user, summary, [tuple(t) for t in json.loads(turns)], updated_at)
+
+    def put(self, items: List[Tuple[str, _Chat]]) -> None:
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO chats VALUES (?, ?, ?, ?, ?)",
+            [
+                (key, chat.user, chat.summary, json.dumps(chat.turns), chat.updated_at)
+                for key, chat in items
+            ],
+        )
+        self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        self._conn.execute("DELETE FROM chats WHERE key = ?", (key,))
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class ConversationMemory:
+    def __init__(
+        self,
+        max_chats: int = MEMORY_MAX_CHATS,
+        db_path: str = MEMORY_DB_PATH,
+        ttl: float = MEMORY_TTL,
+    ):
+        self.max_chats = max_chats
+        self.ttl = ttl
+        self._chats: "OrderedDict[str, _Chat]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db_path = db_path
+        self._db: Optional[_MemoryDB] = None
+        self._db_lock = threading.Lock()
+        self._summary_pool = ThreadPoolExecutor(
+            max_workers=MEMORY_SUMMARY_WORKERS, thread_name_prefix="memory-summary"
+        )
+        # One writer, so a chat's writes reach the database in order
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-db")
+        self._summarizing: set = set()
+        self.disk_loads = 0
+        self.writes = 0
+        self.write_errors = 0
+        self.summaries = 0
+        self.summary_errors = 0
+
+    @staticmethod
+    def key(user: str, chat_id: str) -> str:
+        return f"{user}\x1f{chat_id}"
+
+    def _database(self) -> Optional[_MemoryDB]:
+        if self._db is None and self._db_path:
+            with self._db_lock:
+                if self._db is None:
+                    self._db = _MemoryDB(self._db_path, self.ttl)
+        return self._db
+
+    def _write(self, key: str, chat: Optional[_Chat]) -> None:
+        """Queue *chat* (None: its deletion) for the database."""
+        if not self._db_path:
+            return
+        if chat is not None:
+            # A snapshot: the chat may change before the writer gets to it
+            chat = _Chat(chat.user, chat.summary, list(chat.turns), chat.updated_at)
+        self._writer.submit(self._store, key, chat)
+
+    def _store(self, key: str, chat: Optional[_Chat]) -> None:
+        try:
+            db = self._database()
+            if chat is None:
+                db.delete(key)
+            else:
+                db.put([(key, chat)])
+            self.writes += 1
+        except sqlite3.Error:
+            logger.exception("Writing chat memory failed")
+            self.write_errors += 1
+
+    def _get(self, key: str, refresh: bool = False) -> Optional[_Chat]:
+        """The chat for *key*; with *refresh*, newer writes of other workers win."""
+        chat = self._chats.get(key)
+        if (chat is None or refresh) and self._db_path:
+            stored = self._database().get(key)
+            if stored is not None and (
+                chat is None or stored.updated_at > chat.updated_at
+            ):
+                if chat is not None:
+                    chat.deleted = True  # a summary of the old copy is stale
+                chat = stored
+                self.disk_loads += 1
+                self._insert(key, chat)
+        if chat is not None and time.time() - chat.updated_at > self.ttl:
+            self._forget(key)
+            return None
+        if chat is not None:
+            self._chats.move_to_end(key)
+        return chat
+
+    def _insert(self, key: str, chat: _Chat) -> None:
+        self._chats[key] = chat
+        self._chats.move_to_end(key)
+        # Evicted chats are already in the database
+        while len(self._chats) > self.max_chats:
+            self._chats.popitem(last=False)
+
+    def _forget(self, key: str) -> bool:
+        chat = self._chats.pop(key, None)
+        if chat is not None:
+            chat.deleted = True
+        self._write(key, None)
+        return chat is not None
+
+    def history(self, key: str) -> Optional[History]:
+        """Context for the next question in the chat; None for a new chat.
+
+        The summary always goes in; recent turns are added newest first
+        while they fit the token budget. May read the database, so call it
+        off the event loop.
+        """
+        with self._lock:
+            chat = self._get(key, refresh=True)
+            if chat is None or not (chat.summary or chat.turns):
+                return None
+            budget = MEMORY_TOKEN_BUDGET - chat.summary_tokens
+            recent: List[Tuple[str, str]] = []
+            for question, answer, tokens in reversed(chat.turns):
+                if tokens > budget:
+                    break
+                budget -= tokens
+                recent.append((question, answer))
+            return History(chat.summary, recent[::-1])
+
+    def add_turn(self, key: str, user: str, question: str, answer: str) -> None:
+        """Append a completed turn; starts a summary in the background if due."""
+        question, answer = _clip(question), _clip(answer)
+        turn = (question, answer, estimate_tokens(question) + estimate_tokens(answer))
+        with self._lock:
+            chat = self._get(key)
+            if chat is None:
+                chat = _Chat(user)
+                self._insert(key, chat)
+            chat.turns.append(turn)
+            chat.updated_at = time.time()
+            self._write(key, chat)
+            self._schedule(key, chat)
+
+    def _schedule(self, key: str, chat: _Chat) -> None:
+        # Called with the lock held; one summary per chat at a time
+        if key not in self._summarizing and chat.needs_summary():
+            self._summarizing.add(key)
+            self._summary_pool.submit(self._summarize, key, chat)
+
+    def _summarize(self, key: str, chat: _Chat) -> None:
+        done = False
+        try:
+            with self._lock:
+                # Keep half the window verbatim, fold the rest; more if the
+                # kept turns alone do not fit the budget
+                keep = min(len(chat.turns) - 1, max(1, MEMORY_WINDOW_TURNS // 2))
+                kept = chat.turns[len(chat.turns) - keep :]
+                while keep > 1 and (
+                    sum(turn[2] for turn in kept) + MEMORY_SUMMARY_TOKENS
+                    > MEMORY_TOKEN_BUDGET
+                ):
+                    keep -= 1
+                    kept = kept[1:]
+                folded = chat.turns[: len(chat.turns) - keep]
+                summary, user = chat.summary, chat.user
+            updated = summarize(summary, folded, user)
+            with self._lock:
+                if chat.deleted:
+                    return
+                # Turns are only appended, so the folded ones are still first
+                chat.turns = chat.turns[len(folded) :]
+                chat.summary = updated
+                chat.summary_tokens = estimate_tokens(updated)
+                self.summaries += 1
+                done = True
+                self._write(key, chat)
+        except Exception as exc:
+            logger.warning("Summarizing chat failed: %s", exc)
+            self.summary_errors += 1
+        finally:
+            with self._lock:
+                self._summarizing.discard(key)
+                # More turns may have arrived while this one was written; after
+                # a failure the next turn tries again
+                if done:
+                    self._schedule(key, chat)
+
+    def view(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            chat = self._get(key)
+            if chat is None:
+                return None
+            return {
+                "summary": chat.summary,
+                "turns": [{"user": q, "assistant": a} for q, a, _ in chat.turns],
+                "summary_tokens": chat.summary_tokens,
+                "turn_tokens": chat.unsummarized_tokens(),
+                "updated_at": chat.updated_at,
+                "summarizing": key in self._summarizing,
+            }
+
+    def forget(self, key: str) -> bool:
+        with self._lock:
+            return self._forget(key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "chats": len(self._chats),
+                "summarizing": len(self._summarizing),
+                "summaries": self.summaries,
+                "summary_errors": self.summary_errors,
+                "disk_loads": self.disk_loads,
+                "writes": self.writes,
+                "write_errors": self.write_errors,
+            }
+
+    def close(self) -> None:
+        self._summary_pool.shutdown(wait=False, cancel_futures=True)
+        # Every turn was queued for the database; let the writer finish
+        self._writer.shutdown(wait=True)
+        if self._db is not None:
+            self._db.close()
+
+
+def summarize(summary: str, turns: List[Turn], user: str) -> str:
+    """Fold *turns* into *summary* with one ``converse`` call."""
+    new_turns = "\n\n".join(f"User: {q}\nAssistant: {a}" for q, a, _ in turns)
+    text = f"Summary so far: {summary or '(none)'}\n\nNew turns:\n\n{new_turns}"
+    response = create_runtime().converse(
+        modelId=MEMORY_SUMMARY_MODEL,
+        system=[{"text": SUMMARY_PROMPT.format(words=MEMORY_SUMMARY_TOKENS * 3 // 4)}],
+        messages=[{"role": "user", "content": [{"text": text}]}],
+        inferenceConfig={"maxTokens": MEMORY_SUMMARY_TOKENS, "temperature": 0.0},
+    )
+    usage = response.get("usage", {})
+    usage_ledger.record(
+        user,
+        MEMORY_SUMMARY_MODEL,
+        usage.get("inputTokens", 0),
+        usage.get("outputTokens", 0),
+    )
+    content = response["output"]["message"]["content"]
+    return "".join(block.get("text", "") for block in content).strip()
+
+
+async def remember(
+    events: AsyncIterator[Event],
+    key: str,
+    user: str,
+    question: str,
+    memory: Optional[ConversationMemory] = None,
+) -> AsyncIterator[Event]:
+    """Pass an answer through; add it to the chat once it completes.
+
+    Bedrock session events are dropped: the chat's memory is its context.
+    """
+    memory = memory or conversations
+    parts: List[str] = []
+    async for event in events:
+        if event["type"] == "session":
+            continue
+        if event["type"] == "text":
+            parts.append(event["text"])
+        yield event
+    if parts:
+        memory.add_turn(key, user, question, "".join(parts))
+
+
+conversations = ConversationMemory()
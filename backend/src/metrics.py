@@ -0,0 +1,406 @@
+"""Prometheus-format metrics without a client-library dependency.
+
+Recording is lock-light: counters and gauges are plain float updates on
+per-label children, and histogram observations are appended to a deque
+(atomic in CPython) and only folded into bucket counts when the deque grows
+large or when /metrics is scraped. The hot path therefore never waits on a
+lock, even from the executor threads that read Bedrock streams.
+
+Label values that come from requests are bounded: a model id outside the
+configured models is recorded as "other" (``model_label``), and so is an
+unusual HTTP method.
+"""
+
+import bisect
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from src import settings
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+_FOLD_THRESHOLD = 10_000
+HTTP_METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[LabelValues, object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            # Only the first use of a label set takes the lock
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def header(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+
+class _Value:
+    """A float updated from many threads without read-modify-write races."""
+
+    __slots__ = ("_value", "_pending", "_lock")
+
+    def __init__(self):
+        self._value = 0.0
+        self._pending: deque = deque()
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._pending.append(amount)
+        if len(self._pending) > _FOLD_THRESHOLD:
+            self._fold()
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.inc(-amount)
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self._pending.clear()
+            self._value = value
+
+    def _fold(self) -> None:
+        with self._lock:
+            pending = self._pending
+            while pending:
+                self._value += pending.popleft()
+
+    @property
+    def value(self) -> float:
+        self._fold()
+        return self._value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for values, child in list(self._children.items()):
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_total{labels} {child.value}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.labels().dec(amount)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for values, child in list(self._children.items()):
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}{labels} {child.value}")
+        return lines
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._pending: deque = deque()
+        self._fold_lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        self._pending.append(value)
+        if len(self._pending) > _FOLD_THRESHOLD:
+            self.fold()
+
+    def fold(self) -> None:
+        with self._fold_lock:
+            pending = self._pending
+            while pending:
+                value = pending.popleft()
+                self.counts[bisect.bisect_left(self.buckets, value)] += 1
+                self.sum += value
+                self.count += 1
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        names = self.labelnames + ("le",)
+        for values, child in list(self._children.items()):
+            child.fold()
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                labels = _format_labels(names, values + (le,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {child.sum}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        # Callbacks refreshing gauges from other components right before a scrape
+        self._collectors: List[Callable[[], None]] = []
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+# --------------------------------------------------------------- HTTP layer
+http_requests = metrics.counter(
+    "http_requests", "HTTP requests by route and status", ("method", "route", "status")
+)
+http_request_duration = metrics.histogram(
+    "http_request_duration_seconds",
+    "Time until the response started, by route",
+    ("method", "route"),
+)
+
+
+
+def model_label(model: str) -> str:
+    """*model* as a label value; ids outside the configured models are "other"."""
+    return model if model in settings.current().model_by_id else "other"
+
+
+class RequestMetrics:
+    """ASGI middleware counting requests and timing them by route template.
+
+    The time recorded is until the response starts. Unlike
+    ``@app.middleware("http")`` it does not wrap the response body, so
+    streamed answers reach the client without an extra hop per chunk.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        method = scope["method"] if scope["method"] in HTTP_METHODS else "other"
+
+        def record(status: int) -> None:
+            # The router sets the matched route on the scope
+            route = scope.get("route")
+            route_path = route.path if route is not None else "unmatched"
+            http_requests.labels(method, route_path, str(status)).inc()
+            http_request_duration.labels(method, route_path).observe(
+                time.perf_counter() - started
+            )
+
+        async def send_started(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                record(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_started)
+        except Exception:
+            record(500)
+            raise
+
+
+# ------------------------------------------------------------ Bedrock layer
+ttft = metrics.histogram(
+    "bedrock_time_to_first_token_seconds",
+    "Time from the upstream call to the first generated text",
+    ("model",),
+)
+inter_chunk = metrics.histogram(
+    "bedrock_inter_chunk_seconds",
+    "Gap between consecutive generated chunks",
+    ("model",),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+stream_duration = metrics.histogram(
+    "bedrock_stream_duration_seconds", "Total upstream stream duration", ("model",)
+)
+stream_bytes = metrics.counter(
+    "bedrock_stream_bytes", "UTF-8 bytes of generated text", ("model",)
+)
+stream_chunks = metrics.counter(
+    "bedrock_stream_chunks", "Generated text chunks", ("model",)
+)
+upstream_errors = metrics.counter(
+    "bedrock_upstream_errors", "Upstream failures by error code", ("model", "error")
+)
+active_streams = metrics.gauge(
+    "bedrock_active_streams", "Upstream streams currently open", ("model",)
+)
+
+
+def error_code(exc: BaseException) -> str:
+    """botocore ClientError code, or the exception class name."""
+    response = getattr(exc, "response", None)
+    if isinstance(response, dict):
+        code = response.get("Error", {}).get("Code")
+        if code:
+            return code
+    return type(exc).__name__
+
+
+class StreamObserver:
+    """Records one upstream stream; created inside retrieve_and_generate_stream."""
+
+    __slots__ = ("model", "started", "last_chunk", "_active")
+
+    def __init__(self, model: str):
+        self.model = model_label(model)
+        self.started = time.perf_counter()
+        self.last_chunk: Optional[float] = None
+        self._active = active_streams.labels(self.model)
+        self._active.inc()
+
+    def chunk(self, text: str) -> None:
+        now = time.perf_counter()
+        if self.last_chunk is None:
+            ttft.labels(self.model).observe(now - self.started)
+        else:
+            inter_chunk.labels(self.model).observe(now - self.last_chunk)
+        self.last_chunk = now
+        stream_chunks.labels(self.model).inc()
+        stream_bytes.labels(self.model).inc(len(text.encode()))
+
+    def error(self, exc: BaseException) -> None:
+        upstream_errors.labels(self.model, error_code(exc)).inc()
+
+    def finish(self) -> None:
+        stream_duration.labels(self.model).observe(time.perf_counter() - self.started)
+        self._active.dec()
+
+# ---------------------------------------------------------- Admission layer
+admission_queue_depth = metrics.gauge(
+    "admission_queue_depth", "Requests waiting for a generation slot"
+)
+admission_wait = metrics.histogram(
+    "admission_wait_seconds", "Time a request waited for a generation slot"
+)
+admission_rejections = metrics.counter(
+    "admission_rejections", "Requests turned away by admission control", ("reason",)
+)
+upstream_retries = metrics.counter(
+    "bedrock_upstream_retries",
+    "Upstream calls retried after throttling, before any text was sent",
+    ("model",),
+)
+
+# ------------------------------------------------------------ Routing layer
+router_choices = metrics.counter(
+    "router_choices", "Answers served per routing policy and model", ("policy", "model")
+)
+router_failovers = metrics.counter(
+    "router_failovers",
+    "Models abandoned before their first token, by error",
+    ("model", "error"),
+)
+router_model_ttft = metrics.gauge(
+    "router_model_ttft_seconds", "Rolling median TTFT seen by the router", ("model",)
+)
+router_model_error_rate = metrics.gauge(
+    "router_model_error_rate", "Recent error rate seen by the router", ("model",)
+)
+
+# ------------------------------------------------------------- Usage layer
+usage_tokens = metrics.counter(
+    "bedrock_tokens",
+    "Tokens sent to and generated by Bedrock; source is usage or estimate",
+    ("model", "direction", "source"),
+)
+usage_cost = metrics.counter(
+    "bedrock_cost_usd", "Bedrock spend estimated from token prices", ("model",)
+)
+budget_actions = metrics.counter(
+    "budget_actions",
+    "Requests rejected or downgraded by daily budgets",
+    ("scope", "action"),
+)
+
+# -------------------------------------------------- Knowledge-base fan-out
+kb_retrieve_duration = metrics.histogram(
+    "kb_retrieve_seconds", "Duration of one knowledge base's retrieve call", ("kb",)
+)
+kb_dropped = metrics.counter(
+    "kb_dropped",
+    "Knowledge bases left out of a fan-out, by reason (deadline, error, busy)",
+    ("kb", "reason"),
+)
+kb_passages_used = metrics.counter(
+    "kb_passages_used", "Merged passages contributed by each knowledge base", ("kb",)
+)
@@ -0,0 +1,194 @@
+"""Resumable SSE streams.
+
+Each /generate response is produced by a background task that encodes the
+answer and appends its frames to a bounded ring buffer. The HTTP response
+only follows that buffer, so when a client's connection drops the answer
+keeps streaming into the buffer, and a reconnect carrying ``Last-Event-ID``
+(``<stream_id>:<n>``) resumes after frame *n* without a new upstream call.
+
+While a client is reading, the producer waits for it whenever the buffer
+is full of frames it has not read yet, so a slow reader slows the upstream
+down (and gets larger, coalesced frames) instead of falling behind. With
+no reader attached the buffer keeps the newest frames.
+
+A stream nobody is reading is cancelled after RESUME_IDLE_TTL, and finished
+streams are kept for RESUME_TTL before their buffer is dropped. Both are
+checked every RESUME_SWEEP_INTERVAL seconds by ``run_sweeper``.
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Dict, Optional, Tuple
+
+from src.sse import HEARTBEAT, SSEEncoder, frame
+
+RESUME_BUFFER_FRAMES = int(os.getenv("RESUME_BUFFER_FRAMES", "512"))
+RESUME_TTL = float(os.getenv("RESUME_TTL", "300"))
+RESUME_IDLE_TTL = float(os.getenv("RESUME_IDLE_TTL", "30"))
+RESUME_SWEEP_INTERVAL = float(os.getenv("RESUME_SWEEP_INTERVAL", "5"))
+
+EventsFactory = Callable[[], AsyncIterator[dict]]
+
+
+class ResumeError(Exception):
+    """The requested position is unknown or has left the ring buffer."""
+
+
+class _Stream:
+    def __init__(self, stream_id: str, max_frames: int):
+        self.stream_id = stream_id
+        # (sequence number, frame); heartbeats are not buffered
+        self.frames: Deque[Tuple[int, bytes]] = deque(maxlen=max_frames)
+        self.done = False
+        # Reader -> sequence number of the last frame it has taken
+        self.readers: Dict[object, int] = {}
+        self.last_active = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+        self._read = asyncio.Event()
+
+    @property
+    def subscribers(self) -> int:
+        return len(self.readers)
+
+    def publish(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def advance(self, reader: object, after: Optional[int]) -> None:
+        """Record how far *reader* has read; None when it leaves."""
+        if after is None:
+            self.readers.pop(reader, None)
+        else:
+            self.readers[reader] = after
+        read, self._read = self._read, asyncio.Event()
+        read.set()
+
+    def full(self) -> bool:
+        """Whether appending would drop a frame an attached reader still needs."""
+        if len(self.frames) < self.frames.maxlen or not self.readers:
+            return False
+        oldest = self.frames[0][0]
+        return any(after < oldest for after in self.readers.values())
+
+    async def wait_for_readers(self) -> None:
+        while self.full():
+            await self._read.wait()
+
+
+class ResumableStreams:
+    def __init__(
+        self,
+        max_frames: int = RESUME_BUFFER_FRAMES,
+        ttl: float = RESUME_TTL,
+        idle_ttl: float = RESUME_IDLE_TTL,
+    ):
+        self.max_frames = max_frames
+        self.ttl = ttl
+        self.idle_ttl = idle_ttl
+        self._streams: Dict[str, _Stream] = {}
+        self.resumed = 0
+
+    async def _run(self, stream: _Stream, encoder: SSEEncoder, events) -> None:
+        try:
+            async for data in encoder.encode(events):
+                if data is not HEARTBEAT:
+                    await stream.wait_for_readers()
+                    stream.frames.append((encoder.last_id, data))
+                    stream.publish()
+        finally:
+            stream.done = True
+            stream.last_active = time.monotonic()
+            stream.publish()
+
+    def start(self, factory: EventsFactory) -> AsyncIterator[bytes]:
+        """Start a new resumable stream and follow it from the beginning."""
+        self._evict()
+        stream = _Stream(uuid.uuid4().hex, self.max_frames)
+        encoder = SSEEncoder(stream_id=stream.stream_id)
+        stream.task = asyncio.create_task(self._run(stream, encoder, factory()))
+        self._streams[stream.stream_id] = stream
+        return self._follow(stream, 0, encoder.heartbeat_interval)
+
+    def resume(self, last_event_id: str) -> AsyncIterator[bytes]:
+        """Follow an existing stream from just after *last_event_id*."""
+        self._evict()
+        stream_id, _, seq = last_event_id.partition(":")
+        stream = self._streams.get(stream_id)
+        if stream is None or not seq.isdigit():
+            raise ResumeError(f"Unknown stream {last_event_id!r}")
+        after = int(seq)
+        if stream.frames and stream.frames[0][0] > after + 1:
+            raise ResumeError("Requested frames have left the resume buffer")
+        self.resumed += 1
+        return self._follow(stream, after, SSEEncoder().heartbeat_interval)
+
+    async def _follow(
+        self, stream: _Stream, after: int, heartbeat_interval: float
+    ) -> AsyncIterator[bytes]:
+        reader = object()
+        stream.advance(reader, after)
+        try:
+            while True:
+                if stream.frames and stream.frames[0][0] > after + 1:
+                    # This reader fell so far behind that frames were dropped
+                    yield frame("error", {"detail": "Stream reader fell behind"})
+                    return
+                # Snapshot: the producer may append while we are yielding
+                pending = [data for seq, data in stream.frames if seq > after]
+                if pending:
+                    after = stream.frames[-1][0]
+                    # Taken: the producer may drop them from the buffer now
+                    stream.advance(reader, after)
+                    for data in pending:
+                        yield data
+                    continue
+                if stream.done:
+                    return
+                if not await stream.wait(heartbeat_interval):
+                    yield HEARTBEAT
+        finally:
+            stream.advance(reader, None)
+            stream.last_active = time.monotonic()
+
+    async def run_sweeper(self, interval: float = RESUME_SWEEP_INTERVAL) -> None:
+        """Evict every *interval* seconds; run as a task for the app's lifetime.
+
+        Without it an abandoned stream would hold its upstream call and
+        admission slot until the next request happened to evict it.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            self._evict()
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        for stream_id, stream in list(self._streams.items()):
+            if stream.subscribers:
+                continue
+            idle = now - stream.last_active
+            if stream.done and idle > self.ttl:
+                del self._streams[stream_id]
+            elif not stream.done and idle > self.idle_ttl:
+                stream.task.cancel()
+                del self._streams[stream_id]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "streams": len(self._streams),
+            "active": sum(not s.done for s in self._streams.values()),
+            "resumed": self.resumed,
+        }
+
+
+streams = ResumableStreams()
@@ -0,0 +1,510 @@
+"""Decoupled pipeline: retrieve passages, then generate from them.
+
+The managed ``retrieve_and_generate_stream`` API runs the knowledge-base
+search again on every turn. In the decoupled pipeline the search is a
+separate ``retrieve`` call whose passages are cached on the normalized
+query, so repeated and paraphrased questions skip it. The passages are
+deduplicated, trimmed to a token budget and sent with the question to
+``converse_stream`` on the chosen model.
+
+The knowledge-base search runs on its own thread while the generation
+client is looked up and the static parts of the prompt are prepared, so
+on a cache miss those steps overlap with retrieval.
+
+This pipeline has no Bedrock session: each turn is answered from the
+retrieved passages and, for chats with server-side memory (src/memory.py),
+the chat's summary and recent turns.
+
+A local hybrid index (src/features/hybrid_index.py) can serve retrieval
+instead of the knowledge base (LOCAL_INDEX_MODE=only) or in front of it
+(``first``: local passages are used when the best one is similar enough to
+the question, otherwise the knowledge base is asked).
+
+With several knowledge bases configured (see src/settings.py) a question
+is searched in all of them at once, whichever pipeline the request named
+(``effective_pipeline``). Each knowledge base has a deadline;
+one that misses it is left out of the answer rather than waited for. The
+passages that did arrive are merged, deduplicated and reranked by score.
+Per-knowledge-base latency and how many merged passages each contributed
+are kept in ``stats()`` and the kb_* metrics.
+"""
+
+import logging
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Deque,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from src import settings
+from src.cache import ResponseCache, default_normalizer
+from src.metrics import (
+    StreamObserver,
+    error_code,
+    kb_dropped,
+    kb_passages_used,
+    kb_retrieve_duration,
+)
+from src.usage import usage_event
+from src.utils import (
+    citations_event,
+    create_agent,
+    create_runtime,
+    location_uri,
+    model_inference,
+    observed_stream,
+    text_event,
+)
+
+if TYPE_CHECKING:  # numpy is only imported when the local index is used
+    from src.features.hybrid_index import HybridIndex
+
+PIPELINES = ("managed", "decoupled")
+DEFAULT_PIPELINE = os.getenv("DEFAULT_PIPELINE", "managed")
+
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "8"))
+# Passage tokens sent to the model; estimated at RETRIEVAL_CHARS_PER_TOKEN
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "2000"))
+RETRIEVAL_CHARS_PER_TOKEN = float(os.getenv("RETRIEVAL_CHARS_PER_TOKEN", "4"))
+PASSAGE_CACHE_TTL = float(os.getenv("PASSAGE_CACHE_TTL", "900"))
+PASSAGE_CACHE_MAX_BYTES = int(os.getenv("PASSAGE_CACHE_MAX_BYTES", str(16 << 20)))
+GENERATION_MAX_TOKENS = int(os.getenv("GENERATION_MAX_TOKENS", "2048"))
+
+# Local retrieval tier: off, first (fall back to the knowledge base) or only
+LOCAL_INDEX_MODE = os.getenv("LOCAL_INDEX_MODE", "off")
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH", "data/index")
+# Cosine similarity the best local passage needs in "first" mode
+LOCAL_INDEX_MIN_SIMILARITY = float(os.getenv("LOCAL_INDEX_MIN_SIMILARITY", "0.3"))
+
+# Threads for the decoupled pipeline's retrieval, which runs while the
+# request waits; each one may wait on a fan-out below
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "32"))
+# Threads for the per-knowledge-base searches of a fan-out; a search that
+# missed its deadline keeps its thread until Bedrock answers
+KB_FANOUT_WORKERS = int(os.getenv("KB_FANOUT_WORKERS", "64"))
+# Recent searches per knowledge base behind the latency percentiles
+KB_STATS_WINDOW = int(os.getenv("KB_STATS_WINDOW", "200"))
+# Searches one knowledge base may have running at once. A slow one is
+# skipped once it has this many, so its late searches cannot take up all the
+# fan-out threads and make the other knowledge bases miss their deadlines.
+KB_MAX_IN_FLIGHT = int(os.getenv("KB_MAX_IN_FLIGHT", "32"))
+# Seconds past the longest deadline a fan-out waits for a first answer when
+# no knowledge base made its deadline, before giving up
+KB_FANOUT_GRACE = float(os.getenv("KB_FANOUT_GRACE", "5"))
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = (
+    "You answer questions about Azercell using only the numbered passages "
+    "provided with the question. If they do not contain the answer, say so. "
+    "Answer in the language of the question."
+)
+
+Passage = Dict[str, Any]
+
+passage_cache = ResponseCache(
+    ttl=PASSAGE_CACHE_TTL, max_bytes=PASSAGE_CACHE_MAX_BYTES, sqlite_path=""
+)
+_retrieval_pool = ThreadPoolExecutor(
+    max_workers=RETRIEVAL_WORKERS, thread_name_prefix="kb-retrieve"
+)
+# Separate from _retrieval_pool, whose threads wait on these searches
+_fanout_pool = ThreadPoolExecutor(
+    max_workers=KB_FANOUT_WORKERS, thread_name_prefix="kb-fanout"
+)
+
+
+class KnowledgeBaseStats:
+    """Searches of one knowledge base and its share of merged passages.
+
+    Updated from the fan-out threads and the request threads at once, so the
+    counters only change under the lock.
+    """
+
+    def __init__(
+        self, window: int = KB_STATS_WINDOW, max_in_flight: int = KB_MAX_IN_FLIGHT
+    ):
+        self._lock = threading.Lock()
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.searches = 0
+        self.cache_hits = 0
+        self.dropped = 0
+        self.errors = 0
+        self.passages_used = 0
+
+    def count(self, counter: str, amount: int = 1) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def latency(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = sorted(self._latencies)
+            counters = {
+                "searches": self.searches,
+                "cache_hits": self.cache_hits,
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "passages_used": self.passages_used,
+            }
+        p95 = samples[int(0.95 * (len(samples) - 1))] if samples else None
+        return {
+            **counters,
+            "latency_p50": round(statistics.median(samples), 3) if samples else None,
+            "latency_p95": round(p95, 3) if p95 is not None else None,
+        }
+
+
+_kb_stats: Dict[str, KnowledgeBaseStats] = {}
+_kb_stats_lock = threading.Lock()
+
+
+def kb_stats(kb_id: str) -> KnowledgeBaseStats:
+    stats = _kb_stats.get(kb_id)
+    if stats is None:
+        with _kb_stats_lock:
+            stats = _kb_stats.setdefault(kb_id, KnowledgeBaseStats())
+    return stats
+
+
+_local_index: Optional["HybridIndex"] = None
+_local_index_lock = threading.Lock()
+_local_index_failed = False
+
+
+def local_index() -> Optional["HybridIndex"]:
+    """The local hybrid index, loaded on first use; None if unavailable."""
+    global _local_index, _local_index_failed
+    if LOCAL_INDEX_MODE == "off" or _local_index_failed:
+        return None
+    with _local_index_lock:
+        if _local_index is None and not _local_index_failed:
+            from src.features.hybrid_index import HybridIndex
+
+            try:
+                _local_index = HybridIndex(LOCAL_INDEX_PATH)
+            except (OSError, ValueError) as exc:
+                logger.warning("Local index %s unavailable: %s", LOCAL_INDEX_PATH, exc)
+                _local_index_failed = True
+    return _local_index
+
+
+def retrieve_passages(
+    query: str,
+    top_k: int = RETRIEVAL_TOP_K,
+    kb_ids: Optional[Iterable[str]] = None,
+) -> List[Passage]:
+    """Passages for *query*, best first, cached by query.
+
+    *kb_ids* picks among the configured knowledge bases (all by default);
+    several are searched concurrently, see ``fan_out``.
+    """
+    config = settings.current()
+    kbs = config.select_knowledge_bases(kb_ids)
+    key = passage_cache.key(query, f"retrieve:{top_k}", kb_key(kbs))
+    cached = passage_cache.get(key)
+    if cached is not None:
+        return cached
+    index = local_index()
+    if index is not None:
+        passages = index.search(query, top_k)
+        best = max((p["similarity"] for p in passages), default=0.0)
+        if LOCAL_INDEX_MODE == "only" or best >= LOCAL_INDEX_MIN_SIMILARITY:
+            passage_cache.put(key, passages)
+            return passages
+    if len(kbs) == 1:
+        passages = search(config, kbs[0], query, top_k)
+    else:
+        passages, complete = fan_out(config, kbs, query, top_k)
+        if not complete:
+            # Not cached: the next question asks the slow ones again
+            return passages
+    passage_cache.put(key, passages)
+    return passages
+
+
+def effective_pipeline(pipeline: str, kbs: Sequence[settings.KnowledgeBase]) -> str:
+    """The pipeline that answers a question for *kbs*.
+
+    Bedrock's retrieve_and_generate searches a single knowledge base, so a
+    question for several always goes through the decoupled pipeline.
+    """
+    return "decoupled" if len(kbs) > 1 else pipeline
+
+
+def kb_key(kbs: Sequence[settings.KnowledgeBase]) -> str:
+    """Cache-key part naming a set of knowledge bases."""
+    return "+".join(kb.id for kb in kbs)
+
+
+def search(
+    config: settings.Settings, kb: settings.KnowledgeBase, query: str, top_k: int
+) -> List[Passage]:
+    """One knowledge base's passages for *query*, best first."""
+    stats = kb_stats(kb.id)
+    stats.count("searches")
+    started = time.perf_counter()
+    try:
+        response = create_agent(config).retrieve(
+            knowledgeBaseId=kb.id,
+            retrievalQuery={"text": query},
+            retrievalConfiguration={
+                "vectorSearchConfiguration": {"numberOfResults": top_k}
+            },
+        )
+    except Exception:
+        stats.count("errors")
+        raise
+    elapsed = time.perf_counter() - started
+    stats.latency(elapsed)
+    kb_retrieve_duration.labels(kb.id).observe(elapsed)
+    passages = [
+        {
+            "text": result.get("content", {}).get("text", ""),
+            "uri": location_uri(result.get("location", {})),
+            "score": result.get("score", 0.0),
+            "kb": kb.id,
+        }
+        for result in response.get("retrievalResults", [])
+    ]
+    passages.sort(key=lambda p: p["score"], reverse=True)
+    return passages
+
+
+def _search_and_cache(
+    config: settings.Settings, kb: settings.KnowledgeBase, query: str, top_k: int
+) -> List[Passage]:
+    try:
+        passages = search(config, kb, query, top_k)
+    finally:
+        kb_stats(kb.id).slots.release()
+    passage_cache.put(passage_cache.key(query, f"retrieve:{top_k}", kb.id), passages)
+    return passages
+
+
+def fan_out(
+    config: settings.Settings,
+    kbs: Sequence[settings.KnowledgeBase],
+    query: str,
+    top_k: int,
+) -> Tuple[List[Passage], bool]:
+    """Search *kbs* concurrently and merge what arrives within the deadlines.
+
+    Returns the merged passages and whether every knowledge base answered.
+    A knowledge base that misses its deadline is left out; its search
+    finishes in the background and is cached for the next question. One
+    with KB_MAX_IN_FLIGHT searches still running is not asked. If none
+    answers in time, the first one to answer is waited for, up to
+    KB_FANOUT_GRACE seconds past the longest deadline; if all fail, the last
+    error is raised, and TimeoutError if none answers by then.
+    """
+    started = time.monotonic()
+    results: Dict[str, List[Passage]] = {}
+    pending: Dict[Future, settings.KnowledgeBase] = {}
+    for kb in kbs:
+        cached = passage_cache.get(passage_cache.key(query, f"retrieve:{top_k}", kb.id))
+        if cached is not None:
+            kb_stats(kb.id).count("cache_hits")
+            results[kb.id] = cached
+        elif not kb_stats(kb.id).slots.acquire(blocking=False):
+            _drop(kb, "busy")
+        else:
+            future = _fanout_pool.submit(_search_and_cache, config, kb, query, top_k)
+            pending[future] = kb
+
+    failure: Optional[BaseException] = None
+
+    def collect(future: Future) -> None:
+        nonlocal failure
+        kb = pending.pop(future)
+        try:
+            results[kb.id] = future.result()
+        except Exception as exc:
+            failure = exc
+            _drop(kb, "error")
+            logger.warning("Knowledge base %s failed: %s", kb.id, error_code(exc))
+
+    for future, kb in sorted(pending.items(), key=lambda item: item[1].deadline):
+        remaining = started + kb.deadline - time.monotonic()
+        # Failures are recorded by collect(), missed deadlines below
+        wait([future], timeout=max(0.0, remaining))
+        if future.done():
+            collect(future)
+    longest = max((kb.deadline for kb in pending.values()), default=0.0)
+    give_up = started + longest + KB_FANOUT_GRACE
+    while not results and pending:
+        remaining = give_up - time.monotonic()
+        if remaining <= 0:
+            break
+        done, _ = wait(list(pending), timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            collect(future)
+    for kb in pending.values():
+        _drop(kb, "deadline")
+        logger.info("Knowledge base %s missed its %s s deadline", kb.id, kb.deadline)
+    if not results and failure is not None:
+        raise failure
+    if not results and pending:
+        waited = time.monotonic() - started
+        raise TimeoutError(f"no knowledge base answered within {waited:.1f} s")
+    return merge(results.values(), top_k), len(results) == len(kbs)
+
+
+def _drop(kb: settings.KnowledgeBase, reason: str) -> None:
+    kb_stats(kb.id).count("dropped")
+    kb_dropped.labels(kb.id, reason).inc()
+
+
+def merge(results: Iterable[List[Passage]], top_k: int) -> List[Passage]:
+    """Rerank passages from several knowledge bases by score; keep *top_k*.
+
+    Scores of knowledge bases that share an embedding model are comparable,
+    so the best passages win whichever knowledge base they came from.
+    """
+    merged = [passage for passages in results for passage in passages]
+    merged.sort(key=lambda p: p["score"], reverse=True)
+    merged = dedupe(merged)[:top_k]
+    for passage in merged:
+        kb_stats(passage["kb"]).count("passages_used")
+        kb_passages_used.labels(passage["kb"]).inc()
+    return merged
+
+
+def dedupe(passages: List[Passage]) -> List[Passage]:
+    """Drop passages whose normalized text repeats or is inside a better one."""
+    kept: List[Passage] = []
+    seen: List[str] = []
+    for passage in passages:
+        text = default_normalizer(passage["text"])
+        if not text or any(text in other for other in seen):
+            continue
+        kept.append(passage)
+        seen.append(text)
+    return kept
+
+
+def trim_to_budget(
+    passages: List[Passage], budget: int = RETRIEVAL_TOKEN_BUDGET
+) -> List[Passage]:
+    """Keep passages in order until *budget* tokens; cut the last one short."""
+    chars = int(budget * RETRIEVAL_CHARS_PER_TOKEN)
+    trimmed = []
+    for passage in passages:
+        if chars <= 0:
+            break
+        text = passage["text"]
+        if len(text) > chars:
+            # The budget ends inside this passage: nothing fits after it
+            trimmed.append({**passage, "text": text[:chars].rsplit(" ", 1)[0]})
+            break
+        trimmed.append(passage)
+        chars -= len(text)
+    return trimmed
+
+
+def build_prompt(query: str, passages: List[Passage]) -> str:
+    numbered = "\n\n".join(
+        f"[{n}] {passage['text']}" for n, passage in enumerate(passages, 1)
+    )
+    return f"Passages:\n\n{numbered}\n\nQuestion: {query}"
+
+
+def generate_from_passages_stream(
+    user_query: str,
+    model_name: str,
+    session_id: Optional[str] = None,
+    inference: Optional[Dict[str, Any]] = None,
+    history=None,
+    kb_ids: Optional[Sequence[str]] = None,
+) -> Generator[Dict[str, Any], None, None]:
+    """Yield text events generated from retrieved passages, then citations.
+
+    Same signature as ``retrieve_and_generate_stream`` so the router can use
+    either; *session_id* is ignored. *history* turns are sent as earlier
+    messages and its summary with the system prompt. *kb_ids* picks the
+    knowledge bases searched (all configured ones by default). Bedrock's
+    token usage is reported with a ``usage`` event at the end.
+    """
+    return observed_stream(
+        model_name,
+        lambda observer: _decoupled_events(
+            user_query, model_name, inference, history, kb_ids, observer
+        ),
+    )
+
+
+def _decoupled_events(
+    user_query: str,
+    model_name: str,
+    inference: Optional[Dict[str, Any]],
+    history,
+    kb_ids: Optional[Sequence[str]],
+    observer: StreamObserver,
+) -> Generator[Dict[str, Any], None, None]:
+    retrieval = _retrieval_pool.submit(
+        retrieve_passages, user_query, RETRIEVAL_TOP_K, kb_ids
+    )
+    runtime = create_runtime()
+    system = [{"text": SYSTEM_PROMPT}]
+    messages = []
+    if history is not None:
+        if history.summary:
+            system.append(
+                {"text": f"Summary of the earlier conversation: {history.summary}"}
+            )
+        messages = history.messages()
+    request = {
+        "modelId": model_name,
+        "system": system,
+        "inferenceConfig": {
+            "maxTokens": GENERATION_MAX_TOKENS,
+            **(model_inference(inference, model_name) or {}),
+        },
+    }
+    passages = trim_to_budget(dedupe(retrieval.result()))
+    request["messages"] = messages + [
+        {"role": "user", "content": [{"text": build_prompt(user_query, passages)}]}
+    ]
+    event_stream = runtime.converse_stream(**request)["stream"]
+    try:
+        for event in event_stream:
+            delta = event.get("contentBlockDelta", {}).get("delta", {})
+            if "text" in delta:
+                observer.chunk(delta["text"])
+                yield text_event(delta["text"])
+            usage = event.get("metadata", {}).get("usage")
+            if usage:
+                yield usage_event(usage["inputTokens"], usage["outputTokens"])
+        yield citations_event(
+            [{"text": passage["text"], "uri": passage["uri"]} for passage in passages]
+        )
+    finally:
+        close = getattr(event_stream, "close", None)
+        if close is not None:
+            close()
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    return {kb: stats.snapshot() for kb, stats in list(_kb_stats.items())}
+
+
+def shutdown() -> None:
+    _retrieval_pool.shutdown(wait=False, cancel_futures=True)
+    _fanout_pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,228 @@
+"""Route a question to one of several Bedrock models.
+
+Instead of a fixed ``modelName`` a request may name a routing policy:
+
+* ``cheapest``: lowest price per token first;
+* ``fastest``: lowest observed time to first token first; a model not yet
+  measured counts as ROUTER_TTFT_PRIOR seconds, lower tiers first;
+* ``auto``: short, simple questions go to the cheapest model, long or
+  multi-part ones to the most capable.
+
+Whatever the policy, models whose recent calls mostly failed are tried last
+and models over their daily budget (src/usage.py) are not tried at all;
+with every model over budget the request gets the budget's 429.
+If the chosen model fails before its first token, the next one is tried;
+once text has been sent the error is raised as before. The model that
+answered is reported with a ``model`` event ahead of the first text.
+
+Each model keeps a rolling window of recent calls (TTFT and success) that
+feeds the ``fastest`` policy and the error penalty. Candidates, prices and
+capability tiers come from the current settings (src/settings.py), so a
+reloaded model list applies to the next request.
+"""
+
+import logging
+import os
+import re
+import statistics
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Generator, List, Optional, Tuple
+
+from src import settings
+from src.metrics import error_code, router_choices, router_failovers
+from src.usage import usage_ledger
+from src.utils import retrieve_and_generate_stream
+
+logger = logging.getLogger(__name__)
+
+# Calls remembered per model, and how long an error keeps counting against it
+ROUTER_WINDOW = int(os.getenv("ROUTER_WINDOW", "50"))
+ROUTER_ERROR_TTL = float(os.getenv("ROUTER_ERROR_TTL", "60"))
+# Recent error rate above which a model is only used as a last resort
+ROUTER_ERROR_THRESHOLD = float(os.getenv("ROUTER_ERROR_THRESHOLD", "0.5"))
+# Prompts at least this long (or with several questions) count as complex
+ROUTER_COMPLEX_CHARS = int(os.getenv("ROUTER_COMPLEX_CHARS", "400"))
+# Seconds to first token assumed for a model before it has been measured
+ROUTER_TTFT_PRIOR = float(os.getenv("ROUTER_TTFT_PRIOR", "1.5"))
+
+POLICIES = ("cheapest", "fastest", "auto")
+
+Event = Dict[str, Any]
+StreamFn = Callable[..., Generator[Event, None, None]]
+
+_COMPLEX_HINTS = re.compile(
+    r"\b(compare|difference|explain|why|step by step|müqayisə|fərq|niyə|izah)\b",
+    re.IGNORECASE,
+)
+
+
+def model_event(model_id: str) -> Event:
+    return {"type": "model", "model": model_id}
+
+
+def is_complex(prompt: str) -> bool:
+    return (
+        len(prompt) >= ROUTER_COMPLEX_CHARS
+        or prompt.count("?") > 1
+        or bool(_COMPLEX_HINTS.search(prompt))
+    )
+
+
+class ModelStats:
+    """Rolling window of (finished at, TTFT or None, succeeded) for one model."""
+
+    def __init__(self, window: int = ROUTER_WINDOW):
+        self._calls: Deque[Tuple[float, Optional[float], bool]] = deque(maxlen=window)
+
+    def success(self, ttft: Optional[float]) -> None:
+        self._calls.append((time.monotonic(), ttft, True))
+
+    def failure(self) -> None:
+        self._calls.append((time.monotonic(), None, False))
+
+    def ttft(self) -> Optional[float]:
+        """Median TTFT of recent successful calls, None before the first one."""
+        samples = [t for _, t, ok in list(self._calls) if ok and t is not None]
+        return statistics.median(samples) if samples else None
+
+    def error_rate(self, ttl: float = ROUTER_ERROR_TTL) -> float:
+        cutoff = time.monotonic() - ttl
+        recent = [ok for at, _, ok in list(self._calls) if at >= cutoff]
+        if not recent:
+            return 0.0
+        return recent.count(False) / len(recent)
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+
+def _cost(model: settings.ModelInfo) -> float:
+    return model.input_cost + model.output_cost
+
+
+def _tier(model: settings.ModelInfo) -> int:
+    return model.tier
+
+
+class ModelRouter:
+    def __init__(
+        self,
+        window: int = ROUTER_WINDOW,
+        error_threshold: float = ROUTER_ERROR_THRESHOLD,
+        ttft_prior: float = ROUTER_TTFT_PRIOR,
+        stream_fn: StreamFn = retrieve_and_generate_stream,
+    ):
+        self.window = window
+        self.error_threshold = error_threshold
+        self.ttft_prior = ttft_prior
+        self.stream_fn = stream_fn
+        self._stats: Dict[str, ModelStats] = {}
+        self.failovers = 0
+
+    def _model_stats(self, model: str) -> ModelStats:
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = self._stats.setdefault(model, ModelStats(self.window))
+        return stats
+
+    def _expected_ttft(self, model: settings.ModelInfo) -> Tuple[float, int]:
+        ttft = self._model_stats(model.id).ttft()
+        # Stronger models tend to be slower, so unmeasured ties go low tier first
+        return (self.ttft_prior if ttft is None else ttft, model.tier)
+
+    def rank(self, policy: str, prompt: str) -> List[str]:
+        """Models in the order they should be tried for *prompt*."""
+        config = settings.current()
+        exhausted = usage_ledger.exhausted_models(config)
+        models = [m for m in config.models if m.id not in exhausted]
+        if policy == "cheapest":
+            ordered = sorted(models, key=_cost)
+        elif policy == "fastest":
+            ordered = sorted(models, key=self._expected_ttft)
+        elif policy == "auto":
+            if is_complex(prompt):
+                ordered = sorted(models, key=_tier, reverse=True)
+            else:
+                ordered = sorted(models, key=_cost)
+        else:
+            raise ValueError(f"Unknown routing policy {policy!r}")
+        # Stable sort: healthy models keep the policy order, failing ones go last
+        return sorted(
+            (m.id for m in ordered),
+            key=lambda m: self._model_stats(m).error_rate() > self.error_threshold,
+        )
+
+    def stream(
+        self,
+        user_query: str,
+        policy: str,
+        session_id: Optional[str] = None,
+        stream_fn: Optional[StreamFn] = None,
+    ) -> Generator[Event, None, None]:
+        """Yield the answer from the first model that starts answering.
+
+        Events a model yields before its first text (its session) are held
+        back, so a model that fails over leaves nothing behind in the stream.
+        *stream_fn* overrides the pipeline used for each model.
+        """
+        stream_fn = stream_fn or self.stream_fn
+        ranked = self.rank(policy, user_query)
+        if not ranked and settings.current().models:
+            # Every model spent its budget since the request was checked
+            raise usage_ledger.reject("model")
+        last_exc: Optional[Exception] = None
+        for model in ranked:
+            stats = self._model_stats(model)
+            started = time.perf_counter()
+            held: List[Event] = []
+            sent_text = False
+            try:
+                for event in stream_fn(
+                    user_query=user_query, model_name=model, session_id=session_id
+                ):
+                    if sent_text:
+                        yield event
+                    elif event["type"] == "text":
+                        sent_text = True
+                        stats.success(time.perf_counter() - started)
+                        router_choices.labels(policy, model).inc()
+                        yield model_event(model)
+                        yield from held
+                        yield event
+                    else:
+                        held.append(event)
+            except Exception as exc:
+                stats.failure()
+                if sent_text:
+                    raise
+                self.failovers += 1
+                router_failovers.labels(model, error_code(exc)).inc()
+                logger.warning("Model %s failed before answering: %r", model, exc)
+                last_exc = exc
+                continue
+            if not sent_text:  # finished without text
+                stats.success(None)
+                router_choices.labels(policy, model).inc()
+                yield model_event(model)
+                yield from held
+            return
+        if last_exc is None:
+            raise RuntimeError("No models configured for routing")
+        raise last_exc
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "failovers": self.failovers,
+            "models": {
+                model: {
+                    "calls": len(stats),
+                    "ttft_p50": stats.ttft(),
+                    "error_rate": round(stats.error_rate(), 3),
+                }
+                for model, stats in list(self._stats.items())
+            },
+        }
+
+
+router = ModelRouter()
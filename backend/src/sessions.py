@@ -0,0 +1,62 @@
+"""Bedrock conversation sessions handed out to clients.
+
+RetrieveAndGenerateStream returns a ``sessionId``; passing it on the next
+turn lets Bedrock reuse the conversation context instead of starting over.
+Only sessions this process has seen recently are forwarded upstream, so a
+stale id from an old client (or one that Bedrock has already expired)
+simply starts a new conversation.
+"""
+
+import os
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Optional
+
+BEDROCK_SESSION_TTL = float(os.getenv("BEDROCK_SESSION_TTL", "1800"))
+BEDROCK_SESSION_MAX = int(os.getenv("BEDROCK_SESSION_MAX", "10000"))
+
+
+class SessionRegistry:
+    def __init__(
+        self, ttl: float = BEDROCK_SESSION_TTL, max_sessions: int = BEDROCK_SESSION_MAX
+    ):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._last_used: "OrderedDict[str, float]" = OrderedDict()
+
+    def touch(self, session_id: str) -> None:
+        now = time.monotonic()
+        self._last_used[session_id] = now
+        self._last_used.move_to_end(session_id)
+        # Ordered by last use, so expired sessions are always at the front
+        while self._last_used and (
+            len(self._last_used) > self.max_sessions
+            or now - next(iter(self._last_used.values())) > self.ttl
+        ):
+            self._last_used.popitem(last=False)
+
+    def resolve(self, session_id: Optional[str]) -> Optional[str]:
+        """Return *session_id* if it is known and fresh, otherwise None."""
+        if not session_id:
+            return None
+        last_used = self._last_used.get(session_id)
+        if last_used is None:
+            return None
+        if time.monotonic() - last_used > self.ttl:
+            del self._last_used[session_id]
+            return None
+        return session_id
+
+    def __len__(self) -> int:
+        return len(self._last_used)
+
+
+sessions = SessionRegistry()
+
+
+async def track(events: AsyncIterator[dict]) -> AsyncIterator[dict]:
+    """Register the sessions Bedrock hands out as they pass through."""
+    async for event in events:
+        if event["type"] == "session":
+            sessions.touch(event["session_id"])
+        yield event
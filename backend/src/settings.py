@@ -0,0 +1,410 @@
+"""Typed, immutable backend settings with hot reload.
+
+Settings are read once from the environment and an optional JSON file
+(SETTINGS_FILE, values there win), validated, and frozen into dataclasses.
+The hot path reads ``current()`` and plain attributes; nothing is parsed or
+looked up in the environment per request.
+
+The knowledge bases, region, model list (with prices and daily budgets),
+admission limits and the per-user daily budget can be changed without a
+restart by editing the settings file (polled every SETTINGS_WATCH_INTERVAL
+seconds) or sending SIGHUP. A reload builds a new Settings object and
+swaps the reference; requests already streaming keep the object they
+started with, so nothing in flight is dropped. An invalid file is logged
+and the previous settings stay active.
+
+Example settings file::
+
+    {
+      "kb_id": "JGMPKF6VEI",
+      "knowledge_bases": [
+        {"id": "JGMPKF6VEI", "name": "tariffs"},
+        {"id": "Q7T2ZK1MNB", "name": "roaming", "deadline": 3}
+      ],
+      "region": "us-east-1",
+      "models": [
+        {"id": "anthropic.claude-3-haiku-20240307-v1:0", "name": "Claude 3 Haiku",
+         "input_cost": 0.00025, "output_cost": 0.00125, "tier": 1,
+         "daily_budget": 50, "max_output_tokens": 4096}
+      ],
+      "limits": {"max_concurrent": 200, "rate": 1, "burst": 5},
+      "user_daily_budget": 2.5
+    }
+
+``knowledge_bases`` (or KB_IDS, comma-separated) lists every knowledge
+base a question is searched in; without it only ``kb_id`` is searched. The
+first one is the primary knowledge base. ``deadline`` is how many seconds a
+search across several knowledge bases waits for that one
+(KB_FANOUT_DEADLINE by default) before answering without it.
+
+A request's ``maxTokens`` is capped at the model's ``max_output_tokens``
+(4096 unless set), so a larger value does not fail at Bedrock.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import signal
+import threading
+import time
+from dataclasses import dataclass, fields
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SETTINGS_FILE = os.getenv(
+    "SETTINGS_FILE", str(Path(__file__).resolve().parent.parent / "settings.json")
+)
+SETTINGS_WATCH_INTERVAL = float(os.getenv("SETTINGS_WATCH_INTERVAL", "5"))
+KB_FANOUT_DEADLINE = float(os.getenv("KB_FANOUT_DEADLINE", "2"))
+
+_REGION = re.compile(r"^[a-z]{2}(-[a-z]+)+-\d$")
+_KB_ID = re.compile(r"^[A-Za-z0-9]{1,64}$")
+
+DEFAULT_MODELS = (
+    {
+        "id": "anthropic.claude-3-haiku-20240307-v1:0",
+        "name": "Claude 3 Haiku",
+        "input_cost": 0.00025,
+        "output_cost": 0.00125,
+        "tier": 1,
+        "max_output_tokens": 4096,
+    },
+    {
+        "id": "anthropic.claude-3-5-sonnet-20240620-v1:0",
+        "name": "Claude 3.5 Sonnet",
+        "input_cost": 0.003,
+        "output_cost": 0.015,
+        "tier": 3,
+        "max_output_tokens": 8192,
+    },
+    {
+        "id": "amazon.nova-pro-v1:0",
+        "name": "Nova pro",
+        "input_cost": 0.0008,
+        "output_cost": 0.0032,
+        "tier": 2,
+        "max_output_tokens": 5000,
+    },
+)
+
+
+class SettingsError(ValueError):
+    """The configuration is invalid; lists every problem found."""
+
+    def __init__(self, problems: List[str]):
+        super().__init__("Invalid settings: " + "; ".join(problems))
+        self.problems = problems
+
+
+@dataclass(frozen=True)
+class ModelInfo:
+    id: str
+    name: str
+    arn: str
+    # USD per 1K tokens
+    input_cost: float
+    output_cost: float
+    # Rough capability rank, higher is stronger
+    tier: int
+    # USD the model may spend per day across all users; 0 means no limit
+    daily_budget: float = 0.0
+    # Most tokens one answer may have; larger maxTokens requests are capped
+    max_output_tokens: int = 4096
+
+    def public(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "input_cost": self.input_cost,
+            "output_cost": self.output_cost,
+            "tier": self.tier,
+            "daily_budget": self.daily_budget,
+            "max_output_tokens": self.max_output_tokens,
+        }
+
+
+@dataclass(frozen=True)
+class KnowledgeBase:
+    id: str
+    name: str
+    # Seconds a fan-out across several knowledge bases waits for this one
+    deadline: float
+
+
+@dataclass(frozen=True)
+class Limits:
+    max_concurrent: int
+    queue_size: int
+    queue_timeout: float
+    rate: float
+    burst: float
+
+
+@dataclass(frozen=True)
+class Settings:
+    # The primary knowledge base, first of knowledge_bases
+    kb_id: str
+    knowledge_bases: Tuple[KnowledgeBase, ...]
+    kb_by_id: Mapping[str, KnowledgeBase]
+    region: str
+    model_arn_prefix: str
+    access_key: Optional[str]
+    secret_key: Optional[str]
+    models: Tuple[ModelInfo, ...]
+    model_by_id: Mapping[str, ModelInfo]
+    limits: Limits
+    # USD one user may spend per day; 0 means no limit
+    user_daily_budget: float
+    version: int
+    source: str
+
+    def model_arn(self, model_id: str) -> str:
+        model = self.model_by_id.get(model_id)
+        return model.arn if model is not None else self.model_arn_prefix + model_id
+
+    def select_knowledge_bases(
+        self, kb_ids: Optional[Iterable[str]] = None
+    ) -> Tuple[KnowledgeBase, ...]:
+        """The configured knowledge bases among *kb_ids*; all of them for None.
+
+        Raises KeyError for an id that is not configured.
+        """
+        if kb_ids is None:
+            return self.knowledge_bases
+        wanted = set(kb_ids)
+        unknown = wanted - set(self.kb_by_id)
+        if unknown:
+            raise KeyError(", ".join(sorted(unknown)))
+        return tuple(kb for kb in self.knowledge_bases if kb.id in wanted)
+
+
+def _env_limits() -> Dict[str, Any]:
+    max_concurrent = os.getenv(
+        "ADMISSION_MAX_CONCURRENT", os.getenv("STREAM_MAX_CONCURRENCY", "500")
+    )
+    return {
+        "max_concurrent": int(max_concurrent),
+        "queue_size": int(os.getenv("ADMISSION_QUEUE_SIZE", "1000")),
+        "queue_timeout": float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10")),
+        # Per-client token bucket: requests per second (0 disables) and burst
+        "rate": float(os.getenv("ADMISSION_RATE", "2")),
+        "burst": float(os.getenv("ADMISSION_BURST", "10")),
+    }
+
+
+def _raw_settings(path: Optional[str]) -> Tuple[Dict[str, Any], str]:
+    raw: Dict[str, Any] = {
+        "kb_id": os.getenv("KB_ID", "JGMPKF6VEI"),
+        "knowledge_bases": [
+            kb.strip() for kb in os.getenv("KB_IDS", "").split(",") if kb.strip()
+        ],
+        "region": os.getenv("BEDROCK_REGION", "us-east-1"),
+        "models": list(DEFAULT_MODELS),
+        "limits": _env_limits(),
+        "user_daily_budget": float(os.getenv("USER_DAILY_BUDGET", "0")),
+    }
+    source = "environment"
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            overrides = json.load(f)
+        if not isinstance(overrides, dict):
+            raise SettingsError([f"{path} must contain a JSON object"])
+        limits = {**raw["limits"], **overrides.pop("limits", {})}
+        if "kb_id" in overrides and "knowledge_bases" not in overrides:
+            # The file's kb_id wins over a KB_IDS list from the environment
+            raw["knowledge_bases"] = []
+        raw.update(overrides)
+        raw["limits"] = limits
+        source = path
+    return raw, source
+
+
+def build(raw: Dict[str, Any], version: int = 1, source: str = "") -> Settings:
+    """Validate *raw* values and freeze them; raises SettingsError."""
+    problems = []
+    kb_id, region = str(raw.get("kb_id", "")), str(raw.get("region", ""))
+    knowledge_bases = []
+    for n, item in enumerate(raw.get("knowledge_bases") or [kb_id]):
+        if isinstance(item, str):
+            item = {"id": item}
+        try:
+            kb = KnowledgeBase(
+                id=str(item["id"]),
+                name=str(item.get("name") or item["id"]),
+                deadline=float(item.get("deadline", KB_FANOUT_DEADLINE)),
+            )
+        except (KeyError, TypeError, ValueError) as exc:
+            problems.append(f"knowledge_bases[{n}] is invalid: {exc!r}")
+            continue
+        if not _KB_ID.match(kb.id):
+            problems.append(f"kb_id {kb.id!r} is not a knowledge base id")
+        if any(other.id == kb.id for other in knowledge_bases):
+            problems.append(f"knowledge base {kb.id!r} is listed twice")
+        if kb.deadline <= 0:
+            problems.append(f"knowledge base {kb.id!r} needs a deadline > 0")
+        knowledge_bases.append(kb)
+    if not _REGION.match(region):
+        problems.append(f"region {region!r} is not an AWS region")
+    prefix = f"arn:aws:bedrock:{region}::foundation-model/"
+
+    models = []
+    seen = set()
+    for n, item in enumerate(raw.get("models") or []):
+        try:
+            model = ModelInfo(
+                id=str(item["id"]),
+                name=str(item.get("name") or item["id"]),
+                arn=prefix + str(item["id"]),
+                input_cost=float(item.get("input_cost", 0)),
+                output_cost=float(item.get("output_cost", 0)),
+                tier=int(item.get("tier", 0)),
+                daily_budget=float(item.get("daily_budget", 0)),
+                max_output_tokens=int(item.get("max_output_tokens", 4096)),
+            )
+        except (KeyError, TypeError, ValueError) as exc:
+            problems.append(f"models[{n}] is invalid: {exc!r}")
+            continue
+        if model.id in seen:
+            problems.append(f"model {model.id!r} is listed twice")
+        if model.input_cost < 0 or model.output_cost < 0 or model.daily_budget < 0:
+            problems.append(f"model {model.id!r} has a negative cost or budget")
+        if model.max_output_tokens < 1:
+            problems.append(f"model {model.id!r} needs max_output_tokens >= 1")
+        seen.add(model.id)
+        models.append(model)
+    if not models and not problems:
+        problems.append("at least one model is required")
+
+    limits = None
+    try:
+        values = raw.get("limits") or {}
+        limits = Limits(**{f.name: f.type(values[f.name]) for f in fields(Limits)})
+    except (KeyError, TypeError, ValueError) as exc:
+        problems.append(f"limits are invalid: {exc!r}")
+    if limits is not None:
+        if limits.max_concurrent < 1 or limits.queue_size < 0:
+            problems.append("limits.max_concurrent must be >= 1, queue_size >= 0")
+        if limits.queue_timeout < 0 or limits.rate < 0 or limits.burst < 1:
+            problems.append("limits need queue_timeout >= 0, rate >= 0, burst >= 1")
+
+    user_daily_budget = 0.0
+    try:
+        user_daily_budget = float(raw.get("user_daily_budget") or 0)
+    except (TypeError, ValueError) as exc:
+        problems.append(f"user_daily_budget is invalid: {exc!r}")
+    if user_daily_budget < 0:
+        problems.append("user_daily_budget must be >= 0")
+
+    if problems:
+        raise SettingsError(problems)
+    return Settings(
+        kb_id=knowledge_bases[0].id,
+        knowledge_bases=tuple(knowledge_bases),
+        kb_by_id=MappingProxyType({kb.id: kb for kb in knowledge_bases}),
+        region=region,
+        model_arn_prefix=prefix,
+        access_key=os.getenv("ACCESS_KEY"),
+        secret_key=os.getenv("SECRET_KEY"),
+        models=tuple(models),
+        model_by_id=MappingProxyType({m.id: m for m in models}),
+        limits=limits,
+        user_daily_budget=user_daily_budget,
+        version=version,
+        source=source,
+    )
+
+
+def load(path: Optional[str] = SETTINGS_FILE, version: int = 1) -> Settings:
+    raw, source = _raw_settings(path)
+    return build(raw, version, source)
+
+
+_current = load()
+_listeners: List[Callable[[Settings], None]] = []
+_reload_lock = threading.Lock()
+loaded_at = time.time()
+
+
+def current() -> Settings:
+    return _current
+
+
+def on_reload(listener: Callable[[Settings], None]) -> None:
+    """Call *listener* with the new settings after every successful reload."""
+    _listeners.append(listener)
+
+
+def reload(path: Optional[str] = SETTINGS_FILE) -> bool:
+    """Re-read the settings; keep the current ones if the new ones are invalid."""
+    global _current, loaded_at
+    with _reload_lock:
+        try:
+            new = load(path, _current.version + 1)
+        except (OSError, ValueError) as exc:  # SettingsError and bad JSON
+            logger.error(
+                "Settings reload failed, keeping version %s: %s", _current.version, exc
+            )
+            return False
+        _current = new
+        loaded_at = time.time()
+        logger.info("Settings version %s loaded from %s", new.version, new.source)
+        for listener in _listeners:
+            try:
+                listener(new)
+            except Exception:
+                logger.exception("Settings listener %r failed", listener)
+    return True
+
+
+def install_sighup_handler() -> bool:
+    """Reload on SIGHUP; returns whether the handler was installed.
+
+    Only an event loop in the main thread can handle signals, and Windows
+    has no SIGHUP. Elsewhere (an app run by a test client, say) this logs a
+    warning and the file watcher still picks up changes.
+    """
+    if not hasattr(signal, "SIGHUP"):
+        return False
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload)
+    except (NotImplementedError, RuntimeError, ValueError) as exc:
+        logger.warning("Settings are not reloaded on SIGHUP: %s", exc)
+        return False
+    return True
+
+
+async def watch(
+    path: Optional[str] = SETTINGS_FILE, interval: float = SETTINGS_WATCH_INTERVAL
+) -> None:
+    """Reload whenever the settings file's modification time changes."""
+
+    def stamp():
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    last = stamp()
+    while True:
+        await asyncio.sleep(interval)
+        now = stamp()
+        if now != last:
+            last = now
+            reload(path)
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "version": _current.version,
+        "source": _current.source,
+        "kb_id": _current.kb_id,
+        "knowledge_bases": len(_current.knowledge_bases),
+        "region": _current.region,
+        "models": len(_current.models),
+        "loaded_at": loaded_at,
+    }
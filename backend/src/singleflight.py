@@ -0,0 +1,135 @@
+"""Coalesce identical in-flight /generate requests onto one upstream stream.
+
+The first request for a key starts the upstream stream in a background task;
+every chunk is appended to a shared buffer. Concurrent requests for the same
+key subscribe to that buffer: late joiners first replay the chunks already
+buffered and then follow the live tail, so every subscriber sees the full
+sequence. The upstream is cancelled and the buffer dropped once the last
+subscriber disconnects.
+
+Event types listed in ``leader_only`` (the Bedrock session by default) are
+delivered only to the request that started the flight, so coalesced users
+never continue someone else's conversation.
+
+A ``release`` callback passed along with the factory belongs to whatever the
+upstream call holds (an admission slot): it runs when the flight started by
+that request ends, or right away when the request joins an existing flight.
+"""
+
+import asyncio
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Collection,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+)
+
+Event = Dict[str, Any]
+StreamFactory = Callable[[], AsyncIterator[Event]]
+
+
+class _Flight:
+    def __init__(self):
+        self.chunks: List[Event] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def publish(self, chunk: Optional[Event] = None) -> None:
+        if chunk is not None:
+            self.chunks.append(chunk)
+        # Wake everyone waiting on the current event and arm a fresh one
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait(self) -> None:
+        await self._changed.wait()
+
+
+class SingleFlight:
+    def __init__(self, leader_only: Collection[str] = ("session",)):
+        self.leader_only = frozenset(leader_only)
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def _run(self, key: Hashable, flight: _Flight, factory: StreamFactory):
+        stream = factory()
+        try:
+            async for chunk in stream:
+                flight.publish(chunk)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            flight.error = exc
+        finally:
+            flight.done = True
+            # New requests start a fresh flight; current subscribers keep
+            # their reference until they have drained the buffer.
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.publish()
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._flights
+
+    async def subscribe(
+        self,
+        key: Hashable,
+        factory: StreamFactory,
+        release: Optional[Callable[[], None]] = None,
+    ) -> AsyncIterator[Event]:
+        """Yield the full chunk sequence of the shared stream for *key*."""
+        flight = self._flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._run(key, flight, factory))
+            if release is not None:
+                # Also runs when the task is cancelled before it started
+                flight.task.add_done_callback(lambda _: release())
+            self.started += 1
+        else:
+            self.coalesced += 1
+            if release is not None:
+                release()
+
+        flight.subscribers += 1
+        position = 0
+        try:
+            while True:
+                if position < len(flight.chunks):
+                    chunk = flight.chunks[position]
+                    position += 1
+                    if leader or chunk["type"] not in self.leader_only:
+                        yield chunk
+                    continue
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await flight.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0:
+                if not flight.done:
+                    flight.task.cancel()
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._flights),
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
+
+
+flights = SingleFlight()
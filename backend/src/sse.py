@@ -0,0 +1,162 @@
+"""Server-sent events encoder for /generate.
+
+Pipeline events become SSE frames:
+
+* an ``event: session`` frame with the Bedrock session id, when there is one;
+* an ``event: model`` frame naming the model a routing policy picked;
+* ``event: text`` frames with ``{"text": ...}`` data;
+* a final ``event: done`` frame carrying the citations Bedrock returned;
+* ``event: error`` if the upstream fails after the response has started;
+* ``: heartbeat`` comments while the upstream is silent, so proxies keep the
+  connection open.
+
+Every frame except heartbeats carries ``id: <stream_id>:<n>`` so a client can
+resume with ``Last-Event-ID`` (see src/resumable.py).
+
+Text is coalesced before it is written: tokens are buffered until
+SSE_FLUSH_BYTES have accumulated or SSE_FLUSH_INTERVAL has passed since the
+first buffered token. Whatever is already queued when the client catches
+up is sent in one frame, so a slow reader gets fewer, larger writes instead
+of a backlog of tiny ones.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+SSE_FLUSH_BYTES = int(os.getenv("SSE_FLUSH_BYTES", "512"))
+SSE_FLUSH_INTERVAL = float(os.getenv("SSE_FLUSH_INTERVAL", "0.02"))
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", "15"))
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "256"))
+
+logger = logging.getLogger(__name__)
+
+Event = Dict[str, Any]
+
+HEARTBEAT = b": heartbeat\n\n"
+_END = object()
+
+
+def frame(event: str, data: Any, event_id: Optional[str] = None) -> bytes:
+    """Encode one SSE frame; JSON data never contains raw newlines."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False))
+    return ("\n".join(lines) + "\n\n").encode()
+
+
+async def _pump(events: AsyncIterator[Event], queue: asyncio.Queue) -> None:
+    try:
+        async for event in events:
+            await queue.put(event)
+    except Exception as exc:
+        await queue.put(exc)
+        return
+    await queue.put(_END)
+
+
+class SSEEncoder:
+    def __init__(
+        self,
+        flush_bytes: int = SSE_FLUSH_BYTES,
+        flush_interval: float = SSE_FLUSH_INTERVAL,
+        heartbeat_interval: float = SSE_HEARTBEAT_INTERVAL,
+        stream_id: str = "",
+    ):
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.stream_id = stream_id
+        # Sequence number of the last frame yielded
+        self.last_id = 0
+
+    def next_id(self) -> str:
+        self.last_id += 1
+        if self.stream_id:
+            return f"{self.stream_id}:{self.last_id}"
+        return str(self.last_id)
+
+    def text_frame(self, parts: List[str]) -> bytes:
+        return frame("text", {"text": "".join(parts)}, self.next_id())
+
+    def done_frame(self, citations: List[Event]) -> bytes:
+        return frame("done", {"citations": citations}, self.next_id())
+
+    def session_frame(self, session_id: str) -> bytes:
+        return frame("session", {"session_id": session_id}, self.next_id())
+
+    def model_frame(self, model: str) -> bytes:
+        return frame("model", {"model": model}, self.next_id())
+
+    def error_frame(self, detail: str) -> bytes:
+        return frame("error", {"detail": detail}, self.next_id())
+
+    async def encode(self, events: AsyncIterator[Event]) -> AsyncIterator[bytes]:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+        producer = asyncio.create_task(_pump(events, queue))
+        pending: List[str] = []
+        pending_bytes = 0
+        deadline = None
+        citations: List[Event] = []
+        try:
+            while True:
+                if pending:
+                    timeout = max(0.0, deadline - time.monotonic())
+                else:
+                    timeout = self.heartbeat_interval
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    if pending:
+                        yield self.text_frame(pending)
+                        pending, pending_bytes = [], 0
+                    else:
+                        yield HEARTBEAT
+                    continue
+
+                if item is _END:
+                    break
+                if isinstance(item, Exception):
+                    if pending:
+                        yield self.text_frame(pending)
+                    logger.exception("Upstream stream failed", exc_info=item)
+                    yield self.error_frame(str(item) or type(item).__name__)
+                    return
+
+                if item["type"] == "text":
+                    if not pending:
+                        deadline = time.monotonic() + self.flush_interval
+                    pending.append(item["text"])
+                    pending_bytes += len(item["text"].encode())
+                    if (
+                        pending_bytes >= self.flush_bytes
+                        or time.monotonic() >= deadline
+                    ):
+                        yield self.text_frame(pending)
+                        pending, pending_bytes = [], 0
+                elif item["type"] == "citations":
+                    citations.extend(item["citations"])
+                elif item["type"] == "session":
+                    yield self.session_frame(item["session_id"])
+                elif item["type"] == "model":
+                    yield self.model_frame(item["model"])
+
+            if pending:
+                yield self.text_frame(pending)
+            yield self.done_frame(citations)
+        finally:
+            if not producer.done():
+                producer.cancel()
+                try:
+                    await producer
+                except asyncio.CancelledError:
+                    pass
+
+
+def encode_sse(events: AsyncIterator[Event]) -> AsyncIterator[bytes]:
+    return SSEEncoder().encode(events)
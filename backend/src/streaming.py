@@ -0,0 +1,128 @@
+"""Async bridge for blocking Bedrock event streams.
+
+boto3 event streams are plain blocking iterators. Handing them straight to
+StreamingResponse makes Starlette run every iteration on its shared default
+threadpool, so the number of live answers is capped by that pool. Here the
+blocking reads run on a dedicated, bounded executor and feed an
+asyncio.Queue, and the response consumes the queue without ever blocking the
+event loop.
+"""
+
+import asyncio
+import logging
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import AsyncGenerator, Iterator, Optional, TypeVar
+
+# Streams allowed to run at once; further requests wait for a free slot
+STREAM_MAX_CONCURRENCY = int(os.getenv("STREAM_MAX_CONCURRENCY", "500"))
+# Threads blocking on upstream reads; one per active stream at most
+STREAM_EXECUTOR_WORKERS = int(
+    os.getenv("STREAM_EXECUTOR_WORKERS", str(STREAM_MAX_CONCURRENCY))
+)
+# Chunks read ahead of a slow client before the reader pauses
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "64"))
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+# Streams currently holding a concurrency slot
+active = 0
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=STREAM_EXECUTOR_WORKERS, thread_name_prefix="bedrock-stream"
+        )
+    return _executor
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(STREAM_MAX_CONCURRENCY)
+    return _semaphore
+
+
+def shutdown() -> None:
+    """Stop the reader threads; called on application shutdown."""
+    global _executor, _semaphore
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
+    _semaphore = None
+
+
+def _close_quietly(iterator: Iterator) -> None:
+    close = getattr(iterator, "close", None)
+    if close is not None:
+        try:
+            close()
+        except Exception:
+            # The answer is already over; a connection that will not close
+            # cleanly is dropped by botocore's pool
+            logger.debug("Closing an upstream stream failed", exc_info=True)
+
+
+async def _pump(iterator: Iterator[T], queue: asyncio.Queue) -> None:
+    """Read *iterator* on the stream executor and push items onto *queue*."""
+    executor = get_executor()
+    future: Optional[Future] = None
+    try:
+        while True:
+            future = executor.submit(next, iterator, _DONE)
+            try:
+                item = await asyncio.wrap_future(future)
+            except Exception as exc:
+                await queue.put(_Failure(exc))
+                return
+            await queue.put(item)
+            if item is _DONE:
+                return
+    except asyncio.CancelledError:
+        # A read may still be running in its thread; close the generator once
+        # it returns (immediately if it already has) to release the upstream
+        # connection.
+        if future is not None:
+            future.add_done_callback(lambda _: _close_quietly(iterator))
+        raise
+
+
+async def aiter_blocking(
+    iterator: Iterator[T], queue_size: int = STREAM_QUEUE_SIZE
+) -> AsyncGenerator[T, None]:
+    """Consume a blocking iterator from async code without blocking the loop."""
+    global active
+    async with _get_semaphore():
+        queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        producer = asyncio.create_task(_pump(iterator, queue))
+        active += 1
+        try:
+            while True:
+                item = await queue.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, _Failure):
+                    raise item.exc
+                yield item
+        finally:
+            active -= 1
+            if not producer.done():
+                producer.cancel()
+                try:
+                    await producer
+                except asyncio.CancelledError:
+                    pass
@@ -0,0 +1,434 @@
+"""Token and cost accounting per user and model, with daily budgets.
+
+Every upstream answer is wrapped in ``account``. It counts input and output
+tokens, using the usage Bedrock reports when it does (``converse_stream``)
+and a local estimate otherwise (``retrieve_and_generate_stream``: the
+question plus the retrieved passages in, the answer text out). It prices
+them with the per-1K-token costs in the settings and charges the result to
+the user and model; a model missing from the settings is charged at the
+highest configured rate. Answers served from the response cache or shared
+through single-flight cost nothing and are charged once.
+
+Totals are kept in memory and written to SQLite in batches: every
+USAGE_FLUSH_INTERVAL seconds, or sooner once USAGE_FLUSH_ROWS (day, user,
+model) rows are waiting. On startup and after each flush today's totals are
+read back, so a restart does not reset budgets and worker processes sharing
+the database see each other's spend. The database is opened on first use,
+not on import.
+
+Budgets are checked before the upstream call. A user over
+``user_daily_budget`` gets a 429 until midnight UTC. A model over its
+``daily_budget`` is skipped by the router; a request naming it directly is
+moved to a cheaper model still within budget (BUDGET_ACTION=downgrade) or
+rejected (``reject``). Answers already streaming finish, so a budget can be
+overshot by what was in flight.
+
+The user is whatever /generate identifies the client by: the X-Client-Id
+header, else the client address. Nothing authenticates either, so per-user
+budgets stop accidents (a runaway script, a chatty tab) but not a client
+that changes its id on purpose; put the backend behind an authenticating
+proxy that sets X-Client-Id if they must hold.
+"""
+
+import asyncio
+import calendar
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from src import settings
+from src.admission import Rejected
+from src.metrics import budget_actions, model_label, usage_cost, usage_tokens
+
+# Empty keeps usage in memory only
+USAGE_DB_PATH = os.getenv("USAGE_DB_PATH", "data/usage.sqlite3")
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "10"))
+USAGE_FLUSH_ROWS = int(os.getenv("USAGE_FLUSH_ROWS", "500"))
+# downgrade or reject a request for a model over its daily budget
+BUDGET_ACTION = os.getenv("BUDGET_ACTION", "downgrade")
+
+logger = logging.getLogger(__name__)
+
+Event = Dict[str, Any]
+
+# Words and single punctuation marks, close to how BPE vocabularies split
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate: one per punctuation mark, one per ~4 word chars."""
+    return sum(1 + (len(word) - 1) // 4 for word in _TOKEN.findall(text))
+
+
+def usage_event(input_tokens: int, output_tokens: int) -> Event:
+    return {
+        "type": "usage",
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+    }
+
+
+def today() -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime())
+
+
+def seconds_until_tomorrow() -> float:
+    now = time.time()
+    midnight = calendar.timegm(time.gmtime(now)[:3] + (0, 0, 0)) + 86400
+    return midnight - now
+
+
+class _UsageDB:
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._connect()
+        # Each worker process writes through its own connection
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._connect)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS usage ("
+            "day TEXT NOT NULL, user TEXT NOT NULL, model TEXT NOT NULL, "
+            "requests INTEGER NOT NULL, input_tokens INTEGER NOT NULL, "
+            "output_tokens INTEGER NOT NULL, cost REAL NOT NULL, "
+            "PRIMARY KEY (day, user, model))"
+        )
+        self._conn.commit()
+
+    def _connect(self) -> None:
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+
+    def add(self, rows: List[Tuple]) -> None:
+        self._conn.executemany(
+            "INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (day, user, model) DO UPDATE SET "
+            "requests = requests + excluded.requests, "
+            "input_tokens = input_tokens + excluded.input_tokens, "
+            "output_tokens = output_tokens + excluded.output_tokens, "
+            "cost = cost + excluded.cost",
+            rows,
+        )
+        self._conn.commit()
+
+    def day(self, day: str) -> List[Tuple]:
+        return self._conn.execute(
+            "SELECT user, model, requests, input_tokens, output_tokens, cost "
+            "FROM usage WHERE day = ?",
+            (day,),
+        ).fetchall()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def _add(totals: Dict, key, row) -> None:
+    current = totals.get(key)
+    if current is None:
+        totals[key] = list(row)
+    else:
+        for n, value in enumerate(row):
+            current[n] += value
+
+
+class UsageLedger:
+    """Today's usage per (user, model) plus deltas not yet written to SQLite."""
+
+    def __init__(
+        self, db_path: str = USAGE_DB_PATH, flush_rows: int = USAGE_FLUSH_ROWS
+    ):
+        self.flush_rows = flush_rows
+        self._lock = threading.Lock()
+        self._db_path = db_path
+        self._db: Optional[_UsageDB] = None
+        self._db_lock = threading.Lock()
+        # One writer thread, so flushes never overlap
+        self._flush_pool = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="usage-flush"
+        )
+        # (user, model) -> [requests, input tokens, output tokens, cost]
+        self._today: Dict[Tuple[str, str], List[float]] = {}
+        self._user_cost: Dict[str, float] = {}
+        self._model_cost: Dict[str, float] = {}
+        # (day, user, model) -> same row, waiting for the next flush
+        self._pending: Dict[Tuple[str, str, str], List[float]] = {}
+        self._flush_queued = False
+        self.flushes = 0
+        self.flush_errors = 0
+        self._day = today()
+
+    def _database(self) -> Optional[_UsageDB]:
+        """The SQLite store, opened on first use; today's totals are read back."""
+        if self._db is None and self._db_path:
+            with self._db_lock:
+                if self._db is None:
+                    db = _UsageDB(self._db_path)
+                    with self._lock:
+                        self._roll_day()
+                        for user, model, *row in db.day(self._day):
+                            self._charge_today(user, model, row)
+                    self._db = db
+        return self._db
+
+    def _charge_today(self, user: str, model: str, row) -> None:
+        _add(self._today, (user, model), row)
+        self._user_cost[user] = self._user_cost.get(user, 0.0) + row[3]
+        self._model_cost[model] = self._model_cost.get(model, 0.0) + row[3]
+
+    def _roll_day(self) -> None:
+        day = today()
+        if day != self._day:
+            self._day = day
+            self._today.clear()
+            self._user_cost.clear()
+            self._model_cost.clear()
+
+    # ----------------------------------------------------------- recording
+    def record(
+        self,
+        user: str,
+        model: str,
+        input_tokens: int,
+        output_tokens: int,
+        estimated: bool = False,
+    ) -> float:
+        """Charge one answer to *user* and *model*; returns its cost in USD."""
+        config = settings.current()
+        info = config.model_by_id.get(model)
+        if info is None:
+            # Unknown to the settings (removed by a reload, say): never free
+            info = max(config.models, key=lambda m: m.input_cost + m.output_cost)
+        cost = input_tokens * info.input_cost + output_tokens * info.output_cost
+        cost /= 1000
+        row = (1, input_tokens, output_tokens, cost)
+        with self._lock:
+            self._roll_day()
+            self._charge_today(user, model, row)
+            _add(self._pending, (self._day, user, model), row)
+            flush = (
+                bool(self._db_path)
+                and len(self._pending) >= self.flush_rows
+                and not self._flush_queued
+            )
+            if flush:
+                self._flush_queued = True
+        if flush:
+            self._flush_pool.submit(self.flush)
+        source = "estimate" if estimated else "usage"
+        label = model_label(model)
+        usage_tokens.labels(label, "input", source).inc(input_tokens)
+        usage_tokens.labels(label, "output", source).inc(output_tokens)
+        usage_cost.labels(label).inc(cost)
+        return cost
+
+    def flush(self) -> int:
+        """Write pending rows to SQLite; returns the number of rows written.
+
+        Today's totals are then re-read, so with several worker processes
+        sharing the database each one's budgets also count the others' spend
+        (up to their last flush).
+        """
+        db = self._database()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flush_queued = False
+        if db is None:
+            return 0
+        rows = [(*key, *row) for key, row in pending.items()]
+        try:
+            if rows:
+                db.add(rows)
+            day = self._day
+            stored = db.day(day)
+        except sqlite3.Error:
+            logger.exception("Writing %d usage rows failed; keeping them", len(rows))
+            self.flush_errors += 1
+            with self._lock:
+                for key, row in pending.items():
+                    _add(self._pending, key, row)
+            return 0
+        with self._lock:
+            if day == self._day:
+                self._today.clear()
+                self._user_cost.clear()
+                self._model_cost.clear()
+                for user, model, *row in stored:
+                    self._charge_today(user, model, row)
+                # Recorded while we were writing; not in the database yet
+                for (pending_day, user, model), row in self._pending.items():
+                    if pending_day == day:
+                        self._charge_today(user, model, row)
+        if rows:
+            self.flushes += 1
+        return len(rows)
+
+    async def run_flusher(self, interval: float = USAGE_FLUSH_INTERVAL) -> None:
+        """Flush every *interval* seconds; run as a task for the app's lifetime."""
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.wrap_future(self._flush_pool.submit(self.flush))
+
+    def close(self) -> None:
+        self._flush_pool.submit(self.flush).result()
+        self._flush_pool.shutdown()
+        if self._db is not None:
+            self._db.close()
+
+    # -------------------------------------------------------------- budgets
+    def exhausted_models(self, config: Optional[settings.Settings] = None) -> Set[str]:
+        """Models that spent their daily budget today."""
+        config = config or settings.current()
+        self._database()
+        with self._lock:
+            self._roll_day()
+            return {
+                m.id
+                for m in config.models
+                if m.daily_budget and self._model_cost.get(m.id, 0.0) >= m.daily_budget
+            }
+
+    def reject(self, scope: str) -> Rejected:
+        """The 429 for a *scope* ("user" or "model") over its daily budget."""
+        budget_actions.labels(scope, "reject").inc()
+        return Rejected(429, f"{scope}_budget_exceeded", seconds_until_tomorrow())
+
+    def check(self, user: str, model: Optional[str] = None) -> Optional[str]:
+        """Raise a 429 if *user* or every model is over budget.
+
+        Returns the model to call instead of *model* (the same one if it is
+        within budget). With no *model* (a routing policy picks it) only the
+        user and whether any model is left are checked.
+        """
+        config = settings.current()
+        budget = config.user_daily_budget
+        if budget:
+            self._database()
+            with self._lock:
+                self._roll_day()
+                spent = self._user_cost.get(user, 0.0)
+            if spent >= budget:
+                raise self.reject("user")
+        exhausted = self.exhausted_models(config)
+        if model is None:
+            if exhausted.issuperset(m.id for m in config.models):
+                raise self.reject("model")
+            return None
+        if model not in exhausted:
+            return model
+        requested = config.model_by_id.get(model)
+        if BUDGET_ACTION == "downgrade" and requested is not None:
+            price = requested.input_cost + requested.output_cost
+            cheaper = [
+                m
+                for m in config.models
+                if m.id not in exhausted and m.input_cost + m.output_cost < price
+            ]
+            if cheaper:
+                budget_actions.labels("model", "downgrade").inc()
+                # The most capable of the cheaper models
+                return max(cheaper, key=lambda m: m.tier).id
+        raise self.reject("model")
+
+    # ------------------------------------------------------------- reports
+    def report(self, day: Optional[str] = None) -> Dict[str, Any]:
+        """Totals per user and per model for *day* (default today, UTC)."""
+        day = day or today()
+        self._database()
+        with self._lock:
+            self._roll_day()
+            if day == self._day:
+                rows = [(*key, *row) for key, row in self._today.items()]
+            else:
+                rows = None
+        if rows is None:
+            self.flush()
+            db = self._database()
+            rows = db.day(day) if db is not None else []
+        users: Dict[str, List[float]] = {}
+        models: Dict[str, List[float]] = {}
+        for user, model, *row in rows:
+            _add(users, user, row)
+            _add(models, model, row)
+
+        def named(totals):
+            return {
+                key: {
+                    "requests": int(row[0]),
+                    "input_tokens": int(row[1]),
+                    "output_tokens": int(row[2]),
+                    "cost": round(row[3], 6),
+                }
+                for key, row in totals.items()
+            }
+
+        return {"day": day, "users": named(users), "models": named(models)}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "users_today": len(self._user_cost),
+                "cost_today": round(sum(self._model_cost.values()), 6),
+                "pending_rows": len(self._pending),
+                "flushes": self.flushes,
+                "flush_errors": self.flush_errors,
+            }
+
+
+async def account(
+    events: AsyncIterator[Event],
+    prompt: str,
+    user: str,
+    model: str,
+    ledger: Optional[UsageLedger] = None,
+) -> AsyncIterator[Event]:
+    """Pass one upstream answer through and charge its tokens to *user*.
+
+    Usage events from the pipeline are consumed; one ``usage`` event with
+    the final counts and cost is yielded after the answer. An answer cut
+    short is still charged for what was generated.
+    """
+    ledger = ledger or usage_ledger
+    output: List[str] = []
+    passages: List[str] = []
+    reported: Optional[Event] = None
+    completed = False
+    try:
+        async for event in events:
+            kind = event["type"]
+            if kind == "usage":
+                reported = event
+                continue
+            if kind == "text":
+                output.append(event["text"])
+            elif kind == "citations":
+                passages.extend(c.get("text", "") for c in event["citations"])
+            elif kind == "model":
+                model = event["model"]
+            yield event
+        completed = True
+    finally:
+        if reported is not None:
+            input_tokens = reported["input_tokens"]
+            output_tokens = reported["output_tokens"]
+        elif output:
+            input_tokens = estimate_tokens(prompt) + sum(map(estimate_tokens, passages))
+            output_tokens = estimate_tokens("".join(output))
+        else:  # failed before answering
+            input_tokens = output_tokens = 0
+        cost = 0.0
+        if input_tokens or output_tokens:
+            cost = ledger.record(
+                user, model, input_tokens, output_tokens, estimated=reported is None
+            )
+    if completed:
+        event = usage_event(input_tokens, output_tokens)
+        event.update(model=model, cost=round(cost, 8), estimated=reported is None)
+        yield event
+
+
+usage_ledger = UsageLedger()
@@ -1,46 +1,309 @@
+import logging
 import os
-from pathlib import Path
-from typing import Generator
+import random
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+)
 
-import boto3
-from dotenv import load_dotenv
+from src import settings
+from src.clients import preload, registry
+from src.metrics import StreamObserver, error_code, model_label, upstream_retries
 
-# Usually .env file is located at the root of the project so we load it from there
-env_path = Path(__file__).resolve().parent.parent / ".env"
-load_dotenv(dotenv_path=env_path)
+logger = logging.getLogger(__name__)
 
+# Startup warm-up: "connections" builds the clients and opens a connection to
+# the knowledge base, "clients" only builds them, "off" leaves it all to the
+# first request
+BEDROCK_PREWARM = os.getenv("BEDROCK_PREWARM", "connections")
+BEDROCK_PREWARM_TIMEOUT = float(os.getenv("BEDROCK_PREWARM_TIMEOUT", "10"))
 
-def create_agent():
+# Retries of a throttled call, only while no text has been sent yet
+BEDROCK_THROTTLE_RETRIES = int(os.getenv("BEDROCK_THROTTLE_RETRIES", "3"))
+BEDROCK_THROTTLE_BACKOFF = float(os.getenv("BEDROCK_THROTTLE_BACKOFF", "0.5"))
+BEDROCK_THROTTLE_MAX_BACKOFF = float(os.getenv("BEDROCK_THROTTLE_MAX_BACKOFF", "8"))
 
-    return boto3.client(
-        "bedrock-agent-runtime",
-        region_name="us-east-1",
-        aws_access_key_id=os.getenv("ACCESS_KEY"),
-        aws_secret_access_key=os.getenv("SECRET_KEY"),
+# Generation prompt of the managed pipeline when the chat has history (see
+# src/memory.py); Bedrock fills in the $...$ placeholders
+HISTORY_PROMPT_TEMPLATE = (
+    "You are a question answering agent. Answer the user's question using only "
+    "the search results below. If they do not contain the answer, say so. "
+    "Answer in the language of the question.\n\n"
+    "Conversation so far:\n<conversation>\n{conversation}\n</conversation>\n\n"
+    "Search results:\n<search_results>\n$search_results$\n</search_results>\n\n"
+    "$output_format_instructions$\n\n"
+    "Question: $query$"
+)
+
+
+def _client(service: str, config: Optional[settings.Settings] = None):
+    config = config or settings.current()
+    return registry.get(
+        service,
+        region=config.region,
+        access_key=config.access_key,
+        secret_key=config.secret_key,
     )
 
 
+def create_agent(config: Optional[settings.Settings] = None):
+    """Return the pooled bedrock-agent-runtime client, building it on first use."""
+    return _client("bedrock-agent-runtime", config)
+
+
+def create_runtime(config: Optional[settings.Settings] = None):
+    """Return the pooled bedrock-runtime client used for direct generation."""
+    return _client("bedrock-runtime", config)
+
+
+def prewarm(mode: str = BEDROCK_PREWARM) -> Dict[str, Any]:
+    """Do the first request's one-off work ahead of it; returns timings.
+
+    Parses the service models, builds both pooled clients for the current
+    settings and, in "connections" mode, makes a one-result knowledge-base
+    ``retrieve`` so the TLS connection is pooled and credentials are
+    checked. Failures are logged, never raised: the first request then
+    simply pays the cost itself.
+    """
+    timings: Dict[str, Any] = {"mode": mode}
+    if mode == "off":
+        return timings
+    started = time.perf_counter()
+    try:
+        preload()
+        config = settings.current()
+        agent = create_agent(config)
+        create_runtime(config)
+        timings["clients"] = round(time.perf_counter() - started, 3)
+        if mode == "connections":
+            agent.retrieve(
+                knowledgeBaseId=config.kb_id,
+                retrievalQuery={"text": "warm up"},
+                retrievalConfiguration={
+                    "vectorSearchConfiguration": {"numberOfResults": 1}
+                },
+            )
+            timings["connection"] = round(time.perf_counter() - started, 3)
+    except Exception as exc:
+        logger.warning("Bedrock warm-up failed: %s", exc)
+        timings["error"] = error_code(exc)
+    return timings
+
+
+def inference_config(
+    max_tokens: Optional[int] = None, temperature: Optional[float] = None
+) -> Optional[Dict[str, Any]]:
+    """Bedrock ``textInferenceConfig`` with the parameters that were given."""
+    config: Dict[str, Any] = {}
+    if max_tokens is not None:
+        config["maxTokens"] = max_tokens
+    if temperature is not None:
+        config["temperature"] = temperature
+    return config or None
+
+
+def model_inference(
+    inference: Optional[Dict[str, Any]], model_name: str
+) -> Optional[Dict[str, Any]]:
+    """*inference* with maxTokens capped at what *model_name* can generate."""
+    model = settings.current().model_by_id.get(model_name)
+    if not inference or "maxTokens" not in inference or model is None:
+        return inference
+    max_tokens = min(inference["maxTokens"], model.max_output_tokens)
+    return {**inference, "maxTokens": max_tokens}
+
+
+def text_event(text: str) -> Dict[str, Any]:
+    return {"type": "text", "text": text}
+
+
+def session_event(session_id: str) -> Dict[str, Any]:
+    return {"type": "session", "session_id": session_id}
+
+
+def citations_event(citations: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {"type": "citations", "citations": citations}
+
+
+def location_uri(location: Dict[str, Any]) -> str:
+    """Pick the URI out of any of Bedrock's per-source location shapes."""
+    for source in location.values():
+        if isinstance(source, dict):
+            for field in ("uri", "url"):
+                if field in source:
+                    return source[field]
+    return ""
+
+
+def parse_citation(citation: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Flatten a Bedrock citation event into {"text", "uri"} references."""
+    references = citation.get("retrievedReferences")
+    if references is None:
+        # Older responses nest everything under a deprecated "citation" key
+        references = citation.get("citation", {}).get("retrievedReferences", [])
+    return [
+        {
+            "text": ref.get("content", {}).get("text", ""),
+            "uri": location_uri(ref.get("location", {})),
+        }
+        for ref in references
+    ]
+
+
 def retrieve_and_generate_stream(
-    user_query: str, model_name: str
-) -> Generator[str, None, None]:
-    bedrock_agent = create_agent()
+    user_query: str,
+    model_name: str,
+    session_id: Optional[str] = None,
+    inference: Optional[Dict[str, Any]] = None,
+    history=None,
+    kb_ids: Optional[Sequence[str]] = None,
+) -> Generator[Dict[str, Any], None, None]:
+    """Yield the Bedrock session, text events as they stream, then citations.
+
+    Passing the *session_id* of an earlier turn lets Bedrock reuse that
+    conversation's context. *inference* (see ``inference_config``) sets the
+    generation parameters. *history* (a ``src.memory.History``) is given to
+    the model in the prompt; the knowledge base is searched with the
+    question alone.
+
+    *kb_ids* picks the knowledge bases to search, all configured ones by
+    default. Bedrock's retrieve_and_generate searches a single knowledge
+    base, so a question for several is answered by the decoupled pipeline
+    (src/retrieval.py), which searches them concurrently and generates one
+    answer from the merged passages.
+    """
+    kbs = settings.current().select_knowledge_bases(kb_ids)
+    if len(kbs) > 1:
+        from src.retrieval import generate_from_passages_stream
+
+        return generate_from_passages_stream(
+            user_query,
+            model_name,
+            inference=inference,
+            history=history,
+            kb_ids=[kb.id for kb in kbs],
+        )
+    return observed_stream(
+        model_name,
+        lambda observer: _retrieve_and_generate_events(
+            user_query, model_name, session_id, inference, history, kbs[0], observer
+        ),
+    )
+
+
+def observed_stream(
+    model_name: str, events: Callable[[StreamObserver], Iterator[Dict[str, Any]]]
+) -> Generator[Dict[str, Any], None, None]:
+    """Run an upstream stream with metrics and throttling retries.
 
-    KB_ID = "JGMPKF6VEI"
-    GEN_MODEL_ARN = "arn:aws:bedrock:us-east-1::foundation-model/" + model_name
+    *events* builds a fresh upstream stream for each attempt.
+    """
+    observer = StreamObserver(model_name)
+    try:
+        yield from _with_throttle_retries(model_name, lambda: events(observer))
+    except Exception as exc:
+        observer.error(exc)
+        raise
+    finally:
+        observer.finish()
 
-    stream_resp = bedrock_agent.retrieve_and_generate_stream(
-        input={"text": user_query},
-        retrieveAndGenerateConfiguration={
+
+def is_throttling(exc: BaseException) -> bool:
+    """Bedrock throttling, raised either by the call or inside the event stream."""
+    code = error_code(exc).lower()
+    return code in ("throttlingexception", "toomanyrequestsexception")
+
+
+def _with_throttle_retries(
+    model_name: str, attempt_events: Callable[[], Iterator[Dict[str, Any]]]
+) -> Generator[Dict[str, Any], None, None]:
+    """Retry throttled calls with full-jitter backoff until text starts flowing.
+
+    Once a text event has been yielded the client already shows part of the
+    answer, so a later throttle is raised instead of restarting the answer.
+    """
+    for attempt in range(BEDROCK_THROTTLE_RETRIES + 1):
+        sent_text = False
+        try:
+            for event in attempt_events():
+                sent_text = sent_text or event["type"] != "session"
+                yield event
+            return
+        except Exception as exc:
+            if sent_text or attempt == BEDROCK_THROTTLE_RETRIES:
+                raise
+            if not is_throttling(exc):
+                raise
+            upstream_retries.labels(model_label(model_name)).inc()
+            # Runs on a stream executor thread, so sleeping does not block
+            # the event loop
+            backoff = BEDROCK_THROTTLE_BACKOFF * 2**attempt
+            time.sleep(random.uniform(0, min(BEDROCK_THROTTLE_MAX_BACKOFF, backoff)))
+
+
+def _retrieve_and_generate_events(
+    user_query: str,
+    model_name: str,
+    session_id: Optional[str],
+    inference: Optional[Dict[str, Any]],
+    history,
+    kb: settings.KnowledgeBase,
+    observer: StreamObserver,
+) -> Generator[Dict[str, Any], None, None]:
+    # One snapshot per answer: a reload mid-stream does not mix settings
+    config = settings.current()
+    bedrock_agent = create_agent(config)
+
+    GEN_MODEL_ARN = config.model_arn(model_name)
+
+    request = {
+        "input": {"text": user_query},
+        "retrieveAndGenerateConfiguration": {
             "type": "KNOWLEDGE_BASE",
             "knowledgeBaseConfiguration": {
-                "knowledgeBaseId": KB_ID,
+                "knowledgeBaseId": kb.id,
                 "modelArn": GEN_MODEL_ARN,
             },
         },
-    )
+    }
+    generation: Dict[str, Any] = {}
+    inference = model_inference(inference, model_name)
+    if inference:
+        generation["inferenceConfig"] = {"textInferenceConfig": inference}
+    if history is not None:
+        template = HISTORY_PROMPT_TEMPLATE.format(conversation=history.transcript())
+        generation["promptTemplate"] = {"textPromptTemplate": template}
+    if generation:
+        request["retrieveAndGenerateConfiguration"]["knowledgeBaseConfiguration"][
+            "generationConfiguration"
+        ] = generation
+    if session_id:
+        request["sessionId"] = session_id
+    stream_resp = bedrock_agent.retrieve_and_generate_stream(**request)
 
-    for event in stream_resp["stream"]:
-        if "output" in event:
-            part = event["output"]["text"]
-            # print(f"Streaming part: {part}", flush=True)
-            yield part
+    event_stream = stream_resp["stream"]
+    if stream_resp.get("sessionId"):
+        yield session_event(stream_resp["sessionId"])
+    citations = []
+    try:
+        for event in event_stream:
+            if "output" in event:
+                part = event["output"]["text"]
+                # print(f"Streaming part: {part}", flush=True)
+                observer.chunk(part)
+                yield text_event(part)
+            elif "citation" in event:
+                citations.extend(parse_citation(event["citation"]))
+        yield citations_event(citations)
+    finally:
+        # Release the pooled connection if the client went away mid-answer
+        close = getattr(event_stream, "close", None)
+        if close is not None:
+            close()
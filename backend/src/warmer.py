@@ -0,0 +1,307 @@
+"""Precomputed answers to frequent questions, made while the backend is idle.
+
+Most traffic is a few hundred recurring questions. The warmer answers them
+ahead of time so that a live request for one is replayed at once instead of
+waiting for Bedrock.
+
+Questions come from FAQ_FILE (one per line, ``#`` for comments, or a JSON
+list) and, with FAQ_MINE_PROMPTS, from the first-turn prompts /generate
+receives: a prompt asked at least FAQ_MINE_MIN_COUNT times becomes a
+candidate. Up to FAQ_MAX_QUESTIONS questions are kept, configured ones
+first, then the most frequent mined ones.
+
+Every FAQ_INTERVAL seconds the warmer answers the questions that have no
+precomputed answer yet for each of FAQ_MODELS (the first configured model by
+default). It uses the default pipeline, as /generate does for a request
+without options. It only runs while the backend is idle: no request is
+queued and fewer than FAQ_IDLE_LOAD of the admission slots are in use. It
+stops as soon as that is no longer the case. It answers at most
+FAQ_CONCURRENCY questions at a time and FAQ_RATE per minute, each holding a
+normal admission slot. The cost is charged to the user FAQ_USER.
+
+Answers are stored as their events, like the response cache stores them,
+and replayed at once: the point is not to make the user wait. They are kept
+for FAQ_TTL seconds in memory and in FAQ_DB_PATH (shared by worker
+processes, opened on first use). They are keyed like the response cache on
+the knowledge bases, model and normalized question. When a settings reload
+changes the knowledge bases or the model list, all of them are dropped and
+warmed again.
+
+Nothing is mined, stored or replayed while FAQ_WARMER_ENABLED is false.
+
+``stats()`` reports the coverage: the share of live requests answered from
+precomputed answers.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from src import settings
+from src.admission import TokenBucket, admission
+from src.cache import Event, ResponseCache
+from src.metrics import error_code
+from src.retrieval import DEFAULT_PIPELINE, generate_from_passages_stream, kb_key
+from src.streaming import aiter_blocking
+from src.usage import account, usage_ledger
+from src.utils import retrieve_and_generate_stream
+
+FAQ_WARMER_ENABLED = os.getenv("FAQ_WARMER_ENABLED", "true").lower() == "true"
+FAQ_FILE = os.getenv(
+    "FAQ_FILE", str(Path(__file__).resolve().parent.parent / "faq.txt")
+)
+FAQ_MINE_PROMPTS = os.getenv("FAQ_MINE_PROMPTS", "true").lower() == "true"
+FAQ_MINE_MIN_COUNT = int(os.getenv("FAQ_MINE_MIN_COUNT", "3"))
+# Distinct prompts counted before the counts are halved and rare ones dropped
+FAQ_MINE_MAX_PROMPTS = int(os.getenv("FAQ_MINE_MAX_PROMPTS", "20000"))
+FAQ_MAX_QUESTIONS = int(os.getenv("FAQ_MAX_QUESTIONS", "300"))
+# Comma-separated model ids; empty means the first configured model
+FAQ_MODELS = [m.strip() for m in os.getenv("FAQ_MODELS", "").split(",") if m.strip()]
+FAQ_INTERVAL = float(os.getenv("FAQ_INTERVAL", "60"))
+# Share of admission slots in use above which the warmer waits
+FAQ_IDLE_LOAD = float(os.getenv("FAQ_IDLE_LOAD", "0.2"))
+FAQ_CONCURRENCY = int(os.getenv("FAQ_CONCURRENCY", "2"))
+# Answers per minute
+FAQ_RATE = float(os.getenv("FAQ_RATE", "30"))
+# A question that failed is not tried again for this many seconds
+FAQ_RETRY_AFTER = float(os.getenv("FAQ_RETRY_AFTER", "900"))
+FAQ_TTL = float(os.getenv("FAQ_TTL", "86400"))
+FAQ_MAX_BYTES = int(os.getenv("FAQ_MAX_BYTES", str(32 << 20)))
+# Empty keeps precomputed answers in memory only
+FAQ_DB_PATH = os.getenv("FAQ_DB_PATH", "data/faq.sqlite3")
+FAQ_USER = os.getenv("FAQ_USER", "faq-warmer")
+
+logger = logging.getLogger(__name__)
+
+
+def load_questions(path: str) -> List[str]:
+    """Questions from a JSON list or a text file with one per line."""
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if path.endswith(".json"):
+        return [str(q).strip() for q in json.loads(text) if str(q).strip()]
+    lines = (line.strip() for line in text.splitlines())
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+def variant(model: str) -> str:
+    """The response-cache variant /generate uses for a request without options."""
+    return f"{model}|{DEFAULT_PIPELINE}"
+
+
+class FAQWarmer:
+    def __init__(
+        self,
+        questions_file: str = FAQ_FILE,
+        db_path: str = FAQ_DB_PATH,
+        concurrency: int = FAQ_CONCURRENCY,
+        rate: float = FAQ_RATE,
+    ):
+        self.store = ResponseCache(
+            ttl=FAQ_TTL, max_bytes=FAQ_MAX_BYTES, sqlite_path=db_path
+        )
+        self.configured = load_questions(questions_file)
+        self.concurrency = concurrency
+        self._bucket = TokenBucket(rate / 60, max(1, concurrency))
+        # Normalized prompt -> times asked, and the first wording seen
+        self._asked: Counter = Counter()
+        self._wording: Dict[str, str] = {}
+        self._failed: Dict[Tuple[str, str], float] = {}
+        self._fingerprint = self._settings_fingerprint(settings.current())
+        self.requests = 0
+        self.served = 0
+        self.warmed = 0
+        self.failures = 0
+        self.paused = 0
+        self.invalidations = 0
+
+    # ----------------------------------------------------------- live side
+    def observe(self, prompt: str, mine: bool = True) -> None:
+        """Count one live request; first turns are mined for questions."""
+        self.requests += 1
+        if not (mine and FAQ_MINE_PROMPTS):
+            return
+        normalized = self.store.normalizer(prompt)
+        if not normalized:
+            return
+        self._asked[normalized] += 1
+        self._wording.setdefault(normalized, prompt)
+        if len(self._asked) > FAQ_MINE_MAX_PROMPTS:
+            self._decay()
+
+    def _decay(self) -> None:
+        for normalized, count in list(self._asked.items()):
+            if count // 2:
+                self._asked[normalized] = count // 2
+            else:
+                del self._asked[normalized]
+                self._wording.pop(normalized, None)
+
+    async def lookup(
+        self, prompt: str, variant: str, kbs: str
+    ) -> Optional[List[Event]]:
+        """The precomputed answer's events, ready to replay, or None."""
+        chunks = await self.store.aget(self.store.key(prompt, variant, kbs))
+        if chunks is not None:
+            self.served += 1
+        return chunks
+
+    # ---------------------------------------------------------- warm side
+    def questions(self) -> List[str]:
+        """Configured questions, then mined ones by frequency, deduplicated."""
+        seen = set()
+        questions = []
+        mined = [
+            self._wording[normalized]
+            for normalized, count in self._asked.most_common()
+            if count >= FAQ_MINE_MIN_COUNT
+        ]
+        for question in self.configured + mined:
+            normalized = self.store.normalizer(question)
+            if normalized and normalized not in seen:
+                seen.add(normalized)
+                questions.append(question)
+        return questions[:FAQ_MAX_QUESTIONS]
+
+    def models(self, config: settings.Settings) -> List[str]:
+        if FAQ_MODELS:
+            return [m for m in FAQ_MODELS if m in config.model_by_id]
+        return [config.models[0].id]
+
+    def missing(self, questions: List[str]) -> List[Tuple[str, str]]:
+        """(question, model) pairs without a precomputed answer."""
+        config = settings.current()
+        kbs = kb_key(config.knowledge_bases)
+        now = time.monotonic()
+        return [
+            (question, model)
+            for model in self.models(config)
+            for question in questions
+            if now - self._failed.get((question, model), float("-inf"))
+            >= FAQ_RETRY_AFTER
+            and self.store.get(self.store.key(question, variant(model), kbs)) is None
+        ]
+
+    @staticmethod
+    def idle() -> bool:
+        return (
+            admission.queue_depth == 0
+            and admission.active < FAQ_IDLE_LOAD * admission.max_concurrent
+        )
+
+    async def warm(self) -> int:
+        """Answer missing questions while the backend stays idle."""
+        running: set = set()
+        done = 0
+        # Mined counts change on the event loop, so they are read here; only
+        # the store lookups, which may hit SQLite, run on a thread
+        missing = await asyncio.to_thread(self.missing, self.questions())
+        for question, model in missing:
+            while len(running) >= self.concurrency:
+                finished, running = await asyncio.wait(
+                    running, return_when=asyncio.FIRST_COMPLETED
+                )
+                done += sum(task.result() for task in finished)
+            wait = self._bucket.take()
+            while wait:
+                await asyncio.sleep(wait)
+                wait = self._bucket.take()
+            if not self.idle():
+                self.paused += 1
+                break
+            # Taken right after the idle check, so it never queues
+            slot = await admission.acquire()
+            running.add(asyncio.create_task(self._precompute(question, model, slot)))
+        if running:
+            done += sum(t.result() for t in (await asyncio.wait(running))[0])
+        return done
+
+    async def _precompute(self, question: str, model: str, slot) -> bool:
+        config = settings.current()
+        key = self.store.key(question, variant(model), kb_key(config.knowledge_bases))
+        stream_fn = retrieve_and_generate_stream
+        if DEFAULT_PIPELINE == "decoupled":
+            stream_fn = generate_from_passages_stream
+        try:
+            if usage_ledger.check(FAQ_USER, model) != model:
+                raise RuntimeError(f"{model} is over its daily budget")
+            answer = aiter_blocking(stream_fn(user_query=question, model_name=model))
+            chunks = await _collect(account(answer, question, FAQ_USER, model))
+        except Exception as exc:
+            self.failures += 1
+            self._failed[(question, model)] = time.monotonic()
+            logger.warning("Precomputing %r failed: %s", question, error_code(exc))
+            return False
+        finally:
+            slot.release()
+        if not any(chunk["type"] == "text" for chunk in chunks):
+            return False
+        if self._fingerprint != self._settings_fingerprint(config):
+            return False  # the settings changed while it was generated
+        await self.store.aput(key, chunks)
+        self.warmed += 1
+        return True
+
+    async def run(self, interval: float = FAQ_INTERVAL) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            if not self.idle():
+                continue
+            try:
+                warmed = await self.warm()
+            except Exception:
+                logger.exception("FAQ warming failed")
+                continue
+            if warmed:
+                logger.info("Precomputed %s FAQ answers", warmed)
+
+    # ------------------------------------------------------- invalidation
+    @staticmethod
+    def _settings_fingerprint(config: settings.Settings) -> Tuple:
+        return kb_key(config.knowledge_bases), tuple(m.id for m in config.models)
+
+    def on_settings(self, config: settings.Settings) -> None:
+        """Drop every precomputed answer if the knowledge bases or models changed."""
+        fingerprint = self._settings_fingerprint(config)
+        if fingerprint == self._fingerprint:
+            return
+        self._fingerprint = fingerprint
+        self._failed.clear()
+        self.store.clear()
+        self.invalidations += 1
+        logger.info("Knowledge bases or models changed, FAQ answers dropped")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "questions": len(self.questions()),
+            "answers": self.store.stats()["entries"],
+            "requests": self.requests,
+            "served": self.served,
+            "coverage": round(self.served / self.requests, 4) if self.requests else 0.0,
+            "warmed": self.warmed,
+            "failures": self.failures,
+            "paused": self.paused,
+            "invalidations": self.invalidations,
+        }
+
+    def close(self) -> None:
+        self.store.close()
+
+
+async def _collect(events: AsyncIterator[Event]) -> List[Event]:
+    """An answer's events, to store.
+
+    Session events are left out: a Bedrock session belongs to one user.
+    """
+    return [event async for event in events if event["type"] != "session"]
+
+
+faq_warmer = FAQWarmer(db_path=FAQ_DB_PATH if FAQ_WARMER_ENABLED else "")
+settings.on_reload(faq_warmer.on_settings)
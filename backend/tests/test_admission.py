@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+from src import admission as admission_module
+from src.admission import (
+    AdmissionController,
+    Rejected,
+    TokenBucket,
+    parse_priority,
+)
+from src.settings import Limits
+from src.singleflight import SingleFlight
+
+
+def limits(**overrides):
+    values = dict(max_concurrent=1, queue_size=2, queue_timeout=5, rate=1, burst=2)
+    values.update(overrides)
+    return Limits(**values)
+
+
+def run(main):
+    asyncio.run(asyncio.wait_for(main(), 5))
+
+
+@pytest.mark.parametrize(
+    "header, priority",
+    [(None, 1), ("high", 0), (" LOW ", 2), ("0", 0), ("-100", 0), ("99", 2), ("x", 1)],
+)
+def test_parse_priority_stays_in_the_named_range(header, priority):
+    assert parse_priority(header) == priority
+
+
+def test_token_bucket_refills_at_its_rate(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(admission_module.time, "monotonic", lambda: now[0])
+    bucket = TokenBucket(rate=2, burst=2)
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert bucket.take() == pytest.approx(0.5)
+    now[0] += 0.5
+    assert bucket.take() == 0
+
+
+def test_empty_bucket_is_a_429_with_retry_after():
+    controller = AdmissionController(limits(rate=0.1, burst=1))
+    controller.limit("alice")
+    with pytest.raises(Rejected) as rejected:
+        controller.limit("alice")
+    assert rejected.value.status_code == 429
+    assert rejected.value.reason == "rate_limited"
+    assert rejected.value.retry_after == 10
+    # Buckets are per client
+    controller.limit("bob")
+
+
+def test_full_queue_is_a_503():
+    async def main():
+        controller = AdmissionController(limits(queue_size=1))
+        slot = await controller.acquire()
+        waiter = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(Rejected) as rejected:
+            await controller.acquire()
+        assert (rejected.value.status_code, rejected.value.reason) == (
+            503,
+            "queue_full",
+        )
+        assert rejected.value.retry_after >= 1
+
+        # The slot passes straight to the queued request
+        slot.release()
+        (await waiter).release()
+        assert controller.active == 0
+
+    run(main)
+
+
+def test_queue_deadline_is_a_503():
+    async def main():
+        controller = AdmissionController(limits())
+        slot = await controller.acquire()
+        with pytest.raises(Rejected) as rejected:
+            await controller.acquire(timeout=0.01)
+        assert (rejected.value.status_code, rejected.value.reason) == (
+            503,
+            "queue_timeout",
+        )
+        assert controller.queue_depth == 0
+        slot.release()
+        assert controller.active == 0
+
+    run(main)
+
+
+def test_higher_priority_is_served_first():
+    async def main():
+        controller = AdmissionController(limits(queue_size=3))
+        slot = await controller.acquire()
+        order = []
+
+        async def wait(name, priority):
+            (await controller.acquire(priority)).release()
+            order.append(name)
+
+        waiters = [
+            asyncio.create_task(wait("low", 2)),
+            asyncio.create_task(wait("normal", 1)),
+            asyncio.create_task(wait("high", 0)),
+        ]
+        await asyncio.sleep(0)
+        slot.release()
+        await asyncio.gather(*waiters)
+        assert order == ["high", "normal", "low"]
+
+    run(main)
+
+
+def test_joining_a_flight_releases_the_slot_right_away():
+    async def main():
+        controller = AdmissionController(limits(max_concurrent=2))
+        flights = SingleFlight()
+        finish = asyncio.Event()
+
+        async def upstream():
+            await finish.wait()
+            yield {"type": "text", "text": "answer"}
+
+        first = await controller.acquire()
+        leader = flights.subscribe("key", upstream, release=first.release)
+        second = await controller.acquire()
+        joiner = flights.subscribe("key", upstream, release=second.release)
+        pending = asyncio.gather(anext(leader), anext(joiner))
+        await asyncio.sleep(0)
+        # Only the request that started the upstream holds a slot
+        assert controller.active == 1
+
+        finish.set()
+        await pending
+        await asyncio.sleep(0)
+        assert controller.active == 0
+
+    run(main)
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from src import batch, settings
+from src.batch import BatchError, Checkpoint, parse_items, run_batch
+
+MODEL = settings.current().models[0].id
+
+
+def lines(*questions):
+    return [json.dumps(question) for question in questions]
+
+
+def test_parse_items_applies_the_batch_defaults():
+    items = parse_items(
+        lines(
+            {"id": "a", "prompt": "Roaming?"},
+            {"prompt": "Tariffs?", "routing": "cheapest", "temperature": 0.2},
+        ),
+        model_name=MODEL,
+    )
+    assert [item.id for item in items] == ["a", "2"]
+    assert items[0].model_name == MODEL
+    assert items[0].pipeline == batch.DEFAULT_PIPELINE
+    assert items[1].routing == "cheapest"
+    assert items[1].inference == {"temperature": 0.2}
+
+
+def test_parse_items_reports_every_bad_line():
+    with pytest.raises(BatchError) as error:
+        parse_items(
+            [
+                "{not json",
+                json.dumps({"id": "x"}),
+                json.dumps({"id": "y", "prompt": "p"}),
+                json.dumps({"id": "z", "prompt": "p", "modelName": "nope"}),
+                json.dumps({"id": "z", "prompt": "p", "routing": "random"}),
+                json.dumps({"prompt": "p", "modelName": MODEL, "pipeline": "x"}),
+            ]
+        )
+    problems = error.value.problems
+    assert problems[0].startswith("line 1:")
+    assert "line 2: needs an object with a prompt" in problems
+    assert "line 3: needs a modelName or a routing policy" in problems
+    assert "line 4: unknown model 'nope'" in problems
+    assert "line 5: id 'z' is used twice" in problems
+    assert "line 5: unknown routing policy 'random'" in problems
+    assert "line 6: unknown pipeline 'x'" in problems
+
+
+def test_named_checkpoints_are_kept_per_client(tmp_path):
+    mine = Checkpoint.named("eval", "alice", str(tmp_path))
+    theirs = Checkpoint.named("eval", "bob", str(tmp_path))
+    assert mine.path != theirs.path
+    assert os.path.dirname(mine.path) != str(tmp_path)
+    with pytest.raises(BatchError):
+        Checkpoint.named("../eval", "alice", str(tmp_path))
+
+
+def run(items, checkpoint):
+    async def collect():
+        return [result async for result in run_batch(items, 2, checkpoint)]
+
+    return asyncio.run(asyncio.wait_for(collect(), 5))
+
+
+def test_resume_skips_only_unchanged_answered_questions(tmp_path, monkeypatch):
+    asked = []
+    failing = {"b"}
+
+    async def answer(item, priority, user):
+        asked.append(item.id)
+        result = {"type": "result", "id": item.id, "fingerprint": item.fingerprint()}
+        if item.id in failing:
+            failing.discard(item.id)
+            result["error"] = "ThrottlingException: slow down"
+        return result
+
+    monkeypatch.setattr(batch, "answer", answer)
+    checkpoint = Checkpoint(str(tmp_path / "run.jsonl"))
+    questions = [
+        {"id": "a", "prompt": "Roaming?"},
+        {"id": "b", "prompt": "Tariffs?"},
+        {"id": "c", "prompt": "Coverage?"},
+    ]
+    first = run(parse_items(lines(*questions), MODEL), checkpoint)
+    assert first[-1]["answered"] == 2
+    assert sorted(asked) == ["a", "b", "c"]
+
+    # c is edited under the same id: asked again, like the failed b
+    questions[2]["prompt"] = "Coverage in Baku?"
+    asked.clear()
+    second = run(parse_items(lines(*questions), MODEL), checkpoint)
+    assert sorted(asked) == ["b", "c"]
+    summary = second[-1]
+    assert (summary["questions"], summary["answered"], summary["resumed"]) == (
+        3,
+        3,
+        1,
+    )
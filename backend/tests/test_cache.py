@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from src.cache import ResponseCache, default_normalizer
+
+
+@pytest.mark.parametrize(
+    "prompt, normalized",
+    [
+        ("  What is  Azercell?", "what is azercell"),
+        ("Hello, world!", "hello world"),
+        ("«Roaming» (Turkey) …", "roaming turkey"),
+        ("Is 10.5 AZN enough?", "is 10.5 azn enough"),
+        ("Do you teach c++?", "do you teach c++"),
+        ("e-SIM price: 5%", "e-sim price 5%"),
+    ],
+)
+def test_default_normalizer(prompt, normalized):
+    assert default_normalizer(prompt) == normalized
+
+
+@pytest.mark.parametrize(
+    "first, second",
+    [("10.5 AZN", "105 AZN"), ("c++", "c"), ("5.5G", "55G"), ("a/b", "ab")],
+)
+def test_punctuation_inside_words_keeps_keys_apart(first, second):
+    cache = ResponseCache()
+    assert cache.key(first, "model", "kb") != cache.key(second, "model", "kb")
+
+
+def test_near_duplicates_share_a_key():
+    cache = ResponseCache()
+    assert cache.key("What is roaming?", "m", "kb") == cache.key(
+        "what is ROAMING", "m", "kb"
+    )
+
+
+def test_put_get_and_expiry(tmp_path):
+    cache = ResponseCache(ttl=60, sqlite_path=str(tmp_path / "cache.sqlite3"))
+    key = cache.key("question", "m", "kb")
+    chunks = [{"type": "text", "text": "answer"}]
+    assert cache.get(key) is None
+    cache.put(key, chunks)
+    assert cache.get(key) == chunks
+
+    # A new process finds it on disk
+    again = ResponseCache(ttl=60, sqlite_path=str(tmp_path / "cache.sqlite3"))
+    assert again.get(key) == chunks
+    assert again.stats()["disk_hits"] == 1
+
+    expired = ResponseCache(ttl=0, sqlite_path=str(tmp_path / "cache.sqlite3"))
+    assert expired.get(key) is None
+    for store in (cache, again, expired):
+        store.close()
+
+
+def test_sqlite_tier_opens_on_first_use_and_async_access(tmp_path):
+    path = tmp_path / "data" / "cache.sqlite3"
+    cache = ResponseCache(ttl=60, sqlite_path=str(path))
+    assert not path.exists()
+    key = cache.key("question", "m", "kb")
+    chunks = [{"type": "text", "text": "answer"}]
+
+    async def main():
+        assert await cache.aget(key) is None
+        await cache.aput(key, chunks)
+
+    asyncio.run(asyncio.wait_for(main(), 5))
+    assert path.exists()
+
+    again = ResponseCache(ttl=60, sqlite_path=str(path))
+    assert asyncio.run(asyncio.wait_for(again.aget(key), 5)) == chunks
+    assert again.stats()["disk_hits"] == 1
+    for store in (cache, again):
+        store.close()
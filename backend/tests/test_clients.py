@@ -0,0 +1,65 @@
+from src.clients import ClientRegistry
+
+
+class StubClient:
+    """Stands in for a botocore client; records how it was built."""
+
+    def __init__(self, service, region, access_key, secret_key, config):
+        self.service = service
+        self.region = region
+        self.access_key = access_key
+        self.config = config
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def make_registry():
+    built = []
+
+    def factory(*args):
+        client = StubClient(*args)
+        built.append(client)
+        return client
+
+    return ClientRegistry(factory=factory), built
+
+
+def test_client_reused_per_service_region_and_credentials():
+    registry, built = make_registry()
+    agent = "bedrock-agent-runtime"
+    first = registry.get(agent, "us-east-1", "AK", "SK")
+
+    assert registry.get(agent, "us-east-1", "AK", "SK") is first
+    assert registry.get("bedrock-runtime", "us-east-1", "AK", "SK") is not first
+    assert registry.get(agent, "eu-west-1", "AK", "SK") is not first
+    assert registry.get(agent, "us-east-1", "AK", "other") is not first
+    assert [client.service for client in built] == [
+        agent,
+        "bedrock-runtime",
+        agent,
+        agent,
+    ]
+    assert registry.stats() == {"clients": 4, "created": 4, "reused": 1}
+
+
+def test_secret_not_kept_in_keys():
+    registry, _ = make_registry()
+    registry.get("bedrock-agent-runtime", "us-east-1", "AK", "very-secret")
+
+    assert all("very-secret" not in key for key in registry._clients)
+
+
+def test_close_closes_clients_and_next_get_builds_anew():
+    registry, built = make_registry()
+    registry.get("bedrock-agent-runtime", "us-east-1")
+    registry.get("bedrock-runtime", "us-east-1")
+
+    registry.close()
+
+    assert all(client.closed for client in built)
+    assert registry.stats()["clients"] == 0
+    again = registry.get("bedrock-agent-runtime", "us-east-1")
+    assert again is built[-1] and not again.closed
+    assert registry.stats() == {"clients": 1, "created": 3, "reused": 0}
@@ -0,0 +1,72 @@
+import asyncio
+
+from src.memory import ConversationMemory, remember
+
+
+def wait_for_writes(memory):
+    memory._writer.submit(lambda: None).result()
+
+
+def test_database_is_opened_on_first_write(tmp_path):
+    path = tmp_path / "memory.sqlite3"
+    memory = ConversationMemory(db_path=str(path))
+    assert not path.exists()
+    memory.add_turn("k", "alice", "Roaming?", "Roaming works in 30 countries.")
+    wait_for_writes(memory)
+    assert path.exists()
+    memory.close()
+
+
+def test_turns_are_written_through_for_other_workers(tmp_path):
+    path = str(tmp_path / "memory.sqlite3")
+    first = ConversationMemory(db_path=path)
+    second = ConversationMemory(db_path=path)
+    first.add_turn("k", "alice", "Roaming?", "In 30 countries.")
+    wait_for_writes(first)
+    assert second.history("k").turns == [("Roaming?", "In 30 countries.")]
+
+    # The next turn lands on the other worker; the first one catches up
+    second.add_turn("k", "alice", "And the price?", "10 AZN a day.")
+    wait_for_writes(second)
+    assert first.history("k").turns == [
+        ("Roaming?", "In 30 countries."),
+        ("And the price?", "10 AZN a day."),
+    ]
+    first.close()
+    second.close()
+
+
+def test_forgotten_chats_are_deleted_from_the_database(tmp_path):
+    path = str(tmp_path / "memory.sqlite3")
+    memory = ConversationMemory(db_path=path)
+    memory.add_turn("k", "alice", "Roaming?", "In 30 countries.")
+    assert memory.forget("k")
+    memory.close()
+    assert ConversationMemory(db_path=path).history("k") is None
+
+
+def test_evicted_chats_are_read_back(tmp_path):
+    memory = ConversationMemory(max_chats=1, db_path=str(tmp_path / "m.sqlite3"))
+    memory.add_turn("a", "alice", "Roaming?", "In 30 countries.")
+    memory.add_turn("b", "bob", "Tariffs?", "From 10 AZN.")
+    wait_for_writes(memory)
+    assert memory.history("a").turns == [("Roaming?", "In 30 countries.")]
+    assert memory.stats()["chats"] == 1
+    memory.close()
+
+
+def test_remember_adds_the_turn_and_drops_the_session():
+    memory = ConversationMemory(db_path="")
+
+    async def answer():
+        yield {"type": "session", "session_id": "s"}
+        yield {"type": "text", "text": "In 30 "}
+        yield {"type": "text", "text": "countries."}
+
+    async def main():
+        stream = remember(answer(), "k", "alice", "Roaming?", memory)
+        return [event async for event in stream]
+
+    events = asyncio.run(main())
+    assert [event["type"] for event in events] == ["text", "text"]
+    assert memory.history("k").turns == [("Roaming?", "In 30 countries.")]
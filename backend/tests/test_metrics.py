@@ -0,0 +1,122 @@
+import re
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from src import settings, utils
+from src.metrics import RequestMetrics, metrics
+
+
+class ClientError(Exception):
+    """Shaped like botocore's ClientError."""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+def sample(name, **labels):
+    """Current value of one series in the /metrics output, 0 if absent."""
+    wanted = ",".join(f'{k}="{v}"' for k, v in labels.items())
+    pattern = re.escape(name + "{" + wanted + "}") + r" (\S+)"
+    found = re.search(pattern, metrics.render())
+    return float(found.group(1)) if found else 0.0
+
+
+def fake_events(chunks, error=None):
+    def events(observer):
+        for chunk in chunks:
+            observer.chunk(chunk)
+            yield utils.text_event(chunk)
+        if error is not None:
+            raise error
+
+    return events
+
+
+def series(model):
+    return {
+        "chunks": sample("bedrock_stream_chunks_total", model=model),
+        "bytes": sample("bedrock_stream_bytes_total", model=model),
+        "ttft": sample("bedrock_time_to_first_token_seconds_count", model=model),
+        "gaps": sample("bedrock_inter_chunk_seconds_count", model=model),
+        "streams": sample("bedrock_stream_duration_seconds_count", model=model),
+        "active": sample("bedrock_active_streams", model=model),
+    }
+
+
+def test_observed_stream_records_ttft_chunks_bytes_and_error():
+    model = settings.current().models[0].id
+    before = series(model)
+    errors = sample("bedrock_upstream_errors_total", model=model, error="Boom")
+
+    stream = utils.observed_stream(
+        model, fake_events(["Salam", " dünya"], ClientError("Boom"))
+    )
+    assert next(stream) == utils.text_event("Salam")
+    assert sample("bedrock_active_streams", model=model) == before["active"] + 1
+    assert next(stream) == utils.text_event(" dünya")
+    with pytest.raises(ClientError):
+        next(stream)
+
+    after = series(model)
+    assert after["chunks"] - before["chunks"] == 2
+    assert after["bytes"] - before["bytes"] == len("Salam dünya".encode())
+    assert after["ttft"] - before["ttft"] == 1
+    assert after["gaps"] - before["gaps"] == 1
+    assert after["streams"] - before["streams"] == 1
+    assert after["active"] == before["active"]
+    assert (
+        sample("bedrock_upstream_errors_total", model=model, error="Boom") - errors == 1
+    )
+
+
+def test_throttled_call_retried_before_text(monkeypatch):
+    model = settings.current().models[0].id
+    monkeypatch.setattr(utils.time, "sleep", lambda seconds: None)
+    attempts = []
+
+    def events(observer):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ClientError("ThrottlingException")
+        yield utils.text_event("ok")
+
+    retries = sample("bedrock_upstream_retries_total", model=model)
+    assert list(utils.observed_stream(model, events)) == [utils.text_event("ok")]
+    assert len(attempts) == 2
+    assert sample("bedrock_upstream_retries_total", model=model) - retries == 1
+
+
+def test_unknown_model_recorded_as_other():
+    before = sample("bedrock_stream_chunks_total", model="other")
+    list(utils.observed_stream("made-up-model", fake_events(["x"])))
+    assert sample("bedrock_stream_chunks_total", model="other") - before == 1
+    assert 'model="made-up-model"' not in metrics.render()
+
+
+def test_request_metrics_middleware_times_by_route_without_wrapping_streams():
+    app = FastAPI()
+    app.add_middleware(RequestMetrics)
+
+    @app.get("/things/{thing}")
+    def thing(thing: str):
+        return {"thing": thing}
+
+    @app.get("/stream")
+    def stream():
+        return StreamingResponse(iter([b"a", b"b"]), media_type="text/plain")
+
+    labels = {"method": "GET", "route": "/things/{thing}", "status": "200"}
+    before = sample("http_requests_total", **labels)
+    client = TestClient(app)
+    assert client.get("/things/1").json() == {"thing": "1"}
+    assert client.get("/things/2").status_code == 200
+    assert client.get("/stream").text == "ab"
+    client.get("/missing")
+
+    assert sample("http_requests_total", **labels) - before == 2
+    assert sample("http_requests_total", method="GET", route="/stream", status="200")
+    assert sample("http_requests_total", method="GET", route="unmatched", status="404")
@@ -0,0 +1,94 @@
+import asyncio
+import json
+
+from src import sse
+from src.resumable import ResumableStreams
+
+
+def run(main):
+    return asyncio.run(asyncio.wait_for(main(), 5))
+
+
+def parse(data):
+    lines = data.decode().strip().splitlines()
+    fields = dict(line.split(": ", 1) for line in lines)
+    return fields["event"], json.loads(fields["data"])
+
+
+def parse_id(data):
+    return data.decode().split("\n", 1)[0].removeprefix("id: ").split(":")[0]
+
+
+async def models(count, produced):
+    for n in range(count):
+        produced.append(n)
+        # Every model event is sent as a frame of its own
+        yield {"type": "model", "model": f"m{n}"}
+
+
+def test_slow_reader_holds_back_the_producer(monkeypatch):
+    monkeypatch.setattr(sse, "SSE_QUEUE_SIZE", 2)
+    streams = ResumableStreams(max_frames=4)
+    produced = []
+
+    async def main():
+        received = []
+        async for data in streams.start(lambda: models(20, produced)):
+            received.append(parse(data))
+            if len(received) == 1:
+                await asyncio.sleep(0.05)
+                # The producer, and through it the upstream, waited instead
+                # of overwriting frames this reader has not read: only the
+                # buffer and the encoder's queue are ahead of the reader
+                assert len(produced) < 20
+        return received
+
+    received = run(main)
+    assert [data["model"] for _, data in received[:-1]] == [
+        f"m{n}" for n in range(20)
+    ]
+    assert received[-1][0] == "done"
+
+
+def test_stream_without_readers_keeps_the_newest_frames():
+    streams = ResumableStreams(max_frames=4)
+    produced = []
+
+    async def main():
+        follower = streams.start(lambda: models(20, produced))
+        first = await follower.__anext__()
+        await follower.aclose()
+        # Nobody reads: the answer still runs to the end
+        stream_id = parse_id(first)
+        await streams._streams[stream_id].task
+        # Frames 18 to 21 are still buffered
+        rest = [parse(data) async for data in streams.resume(f"{stream_id}:17")]
+        return first, rest
+
+    first, rest = run(main)
+    assert parse(first)[1] == {"model": "m0"}
+    assert len(produced) == 20
+    assert [data.get("model") for _, data in rest] == ["m17", "m18", "m19", None]
+
+
+def test_sweeper_cancels_a_stream_nobody_reads():
+    streams = ResumableStreams(idle_ttl=0.05)
+    cancelled = asyncio.Event()
+
+    async def hanging():
+        try:
+            yield {"type": "model", "model": "m0"}
+            await asyncio.Event().wait()
+        finally:
+            cancelled.set()
+
+    async def main():
+        sweeper = asyncio.create_task(streams.run_sweeper(interval=0.01))
+        follower = streams.start(hanging)
+        await follower.__anext__()
+        await follower.aclose()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        sweeper.cancel()
+        return streams.stats()
+
+    assert run(main)["streams"] == 0
@@ -0,0 +1,154 @@
+import pytest
+
+from src import retrieval, settings
+from src.clients import botocore_factory, registry
+from src.retrieval import (
+    dedupe,
+    effective_pipeline,
+    generate_from_passages_stream,
+    retrieve_passages,
+    trim_to_budget,
+)
+
+
+def result(text, score, uri="s3://kb/doc"):
+    return {
+        "content": {"text": text},
+        "location": {"s3Location": {"uri": uri}},
+        "score": score,
+    }
+
+
+class StubAgent:
+    """bedrock-agent-runtime with canned retrieve results."""
+
+    def __init__(self, results):
+        self.results = results
+        self.calls = []
+
+    def retrieve(self, **request):
+        self.calls.append(request)
+        return {"retrievalResults": self.results}
+
+
+class StubRuntime:
+    """bedrock-runtime whose converse_stream streams canned text."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.requests = []
+
+    def converse_stream(self, **request):
+        self.requests.append(request)
+        events = [{"contentBlockDelta": {"delta": {"text": c}}} for c in self.chunks]
+        events.append({"messageStop": {"stopReason": "end_turn"}})
+        events.append(
+            {"metadata": {"usage": {"inputTokens": 42, "outputTokens": 7}}}
+        )
+        return {"stream": iter(events)}
+
+
+@pytest.fixture
+def bedrock(monkeypatch):
+    raw = {
+        "kb_id": "KB1",
+        "region": "us-east-1",
+        "models": [{"id": "model"}],
+        "limits": {
+            "max_concurrent": 1,
+            "queue_size": 0,
+            "queue_timeout": 0,
+            "rate": 0,
+            "burst": 1,
+        },
+    }
+    monkeypatch.setattr(settings, "_current", settings.build(raw))
+    agent = StubAgent(
+        [
+            result("Plans start at 10 AZN a month.", 0.4),
+            result("Roaming packs work in 30 countries.", 0.9),
+            result("roaming packs work in 30 countries", 0.5),
+        ]
+    )
+    runtime = StubRuntime(["Roaming ", "30 countries."])
+    clients = {"bedrock-agent-runtime": agent, "bedrock-runtime": runtime}
+    registry.set_factory(lambda service, *args: clients[service])
+    retrieval.passage_cache.clear()
+    yield agent, runtime
+    registry.set_factory(botocore_factory)
+    retrieval.passage_cache.clear()
+
+
+def passage(text, score=1.0):
+    return {"text": text, "uri": "", "score": score, "kb": "KB1"}
+
+
+def test_dedupe_drops_repeats_and_passages_inside_better_ones():
+    passages = [
+        passage("Roaming packs work in 30 countries."),
+        passage("roaming packs, work in 30 countries"),
+        passage("in 30 countries"),
+        passage("Plans start at 10 AZN a month."),
+        passage("   "),
+    ]
+    assert dedupe(passages) == [passages[0], passages[3]]
+
+
+def test_trim_to_budget_cuts_the_last_passage_at_a_word(monkeypatch):
+    monkeypatch.setattr(retrieval, "RETRIEVAL_CHARS_PER_TOKEN", 1)
+    passages = [passage("a" * 6), passage("bbb ccc ddd"), passage("never sent")]
+    trimmed = trim_to_budget(passages, budget=13)
+    assert [p["text"] for p in trimmed] == ["a" * 6, "bbb"]
+    # The originals are left alone
+    assert passages[1]["text"] == "bbb ccc ddd"
+
+
+def test_passages_are_sorted_and_cached_by_query(bedrock):
+    agent, _ = bedrock
+    passages = retrieve_passages("Where does roaming work?")
+    assert [p["score"] for p in passages] == [0.9, 0.5, 0.4]
+    assert passages[0]["uri"] == "s3://kb/doc"
+
+    # A paraphrase that normalizes the same way skips retrieve
+    assert retrieve_passages("where does roaming work") == passages
+    assert len(agent.calls) == 1
+    assert agent.calls[0]["knowledgeBaseId"] == "KB1"
+
+
+def test_decoupled_stream_maps_converse_events(bedrock):
+    _, runtime = bedrock
+    events = list(generate_from_passages_stream("Roaming?", "model"))
+    assert events[:2] == [
+        {"type": "text", "text": "Roaming "},
+        {"type": "text", "text": "30 countries."},
+    ]
+    assert events[2] == {"type": "usage", "input_tokens": 42, "output_tokens": 7}
+    citations = events[3]["citations"]
+    assert events[3]["type"] == "citations"
+    # The duplicate passage is not sent to the model or cited
+    assert [c["text"] for c in citations] == [
+        "Roaming packs work in 30 countries.",
+        "Plans start at 10 AZN a month.",
+    ]
+    request = runtime.requests[0]
+    assert request["modelId"] == "model"
+    prompt = request["messages"][-1]["content"][0]["text"]
+    assert prompt.startswith("Passages:\n\n[1] Roaming packs")
+    assert prompt.endswith("Question: Roaming?")
+
+
+def test_several_knowledge_bases_use_the_decoupled_pipeline():
+    kbs = [settings.KnowledgeBase("KB1", "KB1", 2.0)]
+    assert effective_pipeline("managed", kbs) == "managed"
+    kbs.append(settings.KnowledgeBase("KB2", "KB2", 2.0))
+    assert effective_pipeline("managed", kbs) == "decoupled"
+
+
+def test_max_tokens_is_capped_at_the_model_limit(bedrock):
+    _, runtime = bedrock
+    inference = {"maxTokens": 100_000, "temperature": 0.1}
+    list(generate_from_passages_stream("Roaming?", "model", inference=inference))
+    assert runtime.requests[0]["inferenceConfig"] == {
+        "maxTokens": 4096,
+        "temperature": 0.1,
+    }
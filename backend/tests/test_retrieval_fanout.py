@@ -0,0 +1,151 @@
+import threading
+import time
+
+import pytest
+
+from src import retrieval, settings
+from src.clients import botocore_factory, registry
+from src.retrieval import KnowledgeBaseStats, retrieve_passages
+
+DEADLINE = 0.3
+
+
+class StubAgent:
+    """Knowledge bases whose search latency depends on the id.
+
+    A latency of None fails the search; "hang" blocks it until the test
+    ends, so nothing answers in time.
+    """
+
+    def __init__(self, latencies):
+        self.latencies = latencies
+        self.released = threading.Event()
+
+    def retrieve(self, knowledgeBaseId, retrievalQuery, **kwargs):
+        latency = self.latencies[knowledgeBaseId]
+        if latency is None:
+            raise RuntimeError(f"{knowledgeBaseId} is unavailable")
+        if latency == "hang":
+            self.released.wait(5)
+            raise RuntimeError(f"{knowledgeBaseId} never answered")
+        time.sleep(latency)
+        # Scores interleave between knowledge bases, so the merge must rerank
+        offset = sorted(self.latencies).index(knowledgeBaseId) / 10
+        return {
+            "retrievalResults": [
+                {
+                    "content": {"text": f"{knowledgeBaseId} passage {n}"},
+                    "location": {"s3Location": {"uri": f"s3://{knowledgeBaseId}/{n}"}},
+                    "score": 0.95 - n * 0.2 - offset,
+                }
+                for n in range(5)
+            ]
+        }
+
+
+@pytest.fixture
+def knowledge_bases(monkeypatch):
+    agent = StubAgent({"FASTKB": 0.02, "MIDKB": 0.1, "SLOWKB": 0.6})
+
+    def configure(**latencies):
+        agent.latencies.update(latencies)
+        raw = {
+            "region": "us-east-1",
+            "models": [{"id": "model"}],
+            "knowledge_bases": [
+                {"id": kb, "deadline": DEADLINE} for kb in agent.latencies
+            ],
+            "limits": {
+                "max_concurrent": 1,
+                "queue_size": 0,
+                "queue_timeout": 0,
+                "rate": 0,
+                "burst": 1,
+            },
+        }
+        monkeypatch.setattr(settings, "_current", settings.build(raw))
+        return agent
+
+    registry.set_factory(lambda service, *args: agent)
+    retrieval.passage_cache.clear()
+    yield configure
+    agent.released.set()
+    registry.set_factory(botocore_factory)
+    retrieval.passage_cache.clear()
+
+
+def timed(query, kb_ids=None):
+    started = time.perf_counter()
+    passages = retrieve_passages(query, top_k=8, kb_ids=kb_ids)
+    return passages, time.perf_counter() - started
+
+
+def cached(query, kb_ids=None):
+    kbs = settings.current().select_knowledge_bases(kb_ids)
+    key = retrieval.passage_cache.key(query, "retrieve:8", retrieval.kb_key(kbs))
+    return retrieval.passage_cache.get(key) is not None
+
+
+def test_late_and_failing_knowledge_bases_are_left_out(knowledge_bases):
+    knowledge_bases(BROKENKB=None)
+    passages, elapsed = timed("roaming")
+
+    # The slowest on-time search, not the sum, and no longer than the deadline
+    assert 0.1 <= elapsed < DEADLINE + 0.2
+    assert {p["kb"] for p in passages} == {"FASTKB", "MIDKB"}
+    scores = [p["score"] for p in passages]
+    assert scores == sorted(scores, reverse=True)
+    assert len(passages) == 8
+    # An answer missing a knowledge base is not cached
+    assert not cached("roaming")
+
+
+def test_late_search_is_cached_for_the_next_question(knowledge_bases):
+    knowledge_bases()
+    timed("roaming")
+    time.sleep(0.6)
+
+    passages, elapsed = timed("roaming", ["FASTKB", "SLOWKB"])
+    assert "SLOWKB" in {p["kb"] for p in passages}
+    assert elapsed < 0.05
+    assert cached("roaming", ["FASTKB", "SLOWKB"])
+
+
+def test_first_answer_is_used_when_none_is_on_time(knowledge_bases):
+    knowledge_bases(BROKENKB=None)
+    passages, _ = timed("roaming", ["SLOWKB", "BROKENKB"])
+    assert passages
+    assert {p["kb"] for p in passages} == {"SLOWKB"}
+
+
+def test_error_is_raised_when_every_knowledge_base_fails(knowledge_bases):
+    knowledge_bases(FASTKB=None, BROKENKB=None)
+    with pytest.raises(RuntimeError, match="unavailable"):
+        retrieve_passages("roaming", kb_ids=["FASTKB", "BROKENKB"])
+
+
+def test_waiting_for_a_first_answer_is_bounded(knowledge_bases, monkeypatch):
+    monkeypatch.setattr(retrieval, "KB_FANOUT_GRACE", 0.2)
+    knowledge_bases(HUNGKB="hang", OTHERKB="hang")
+    started = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        retrieve_passages("roaming", kb_ids=["HUNGKB", "OTHERKB"])
+    assert time.perf_counter() - started < DEADLINE + 0.2 + 0.2
+
+
+def test_stats_counters_are_exact_under_concurrent_updates():
+    stats = KnowledgeBaseStats(window=10, max_in_flight=1)
+
+    def update():
+        for _ in range(2000):
+            stats.count("searches")
+            stats.latency(0.01)
+
+    threads = [threading.Thread(target=update) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    snapshot = stats.snapshot()
+    assert snapshot["searches"] == 16000
+    assert snapshot["latency_p50"] == 0.01
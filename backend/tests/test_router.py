@@ -0,0 +1,79 @@
+import pytest
+
+from src import router as router_module
+from src import settings
+from src.admission import Rejected
+from src.router import ModelRouter
+from src.usage import UsageLedger
+
+MODELS = [
+    {"id": "small", "input_cost": 0.1, "output_cost": 0.1, "tier": 1},
+    {"id": "medium", "input_cost": 1, "output_cost": 1, "tier": 2},
+    {"id": "large", "input_cost": 5, "output_cost": 5, "tier": 3, "daily_budget": 1},
+]
+
+
+@pytest.fixture
+def config(monkeypatch):
+    raw = {
+        "kb_id": "KB1",
+        "region": "us-east-1",
+        "models": MODELS,
+        "limits": {
+            "max_concurrent": 1,
+            "queue_size": 0,
+            "queue_timeout": 0,
+            "rate": 0,
+            "burst": 1,
+        },
+    }
+    monkeypatch.setattr(settings, "_current", settings.build(raw))
+    ledger = UsageLedger(db_path="")
+    monkeypatch.setattr(router_module, "usage_ledger", ledger)
+    return ledger
+
+
+def answer(**kwargs):
+    yield {"type": "text", "text": kwargs["model_name"]}
+
+
+def test_fastest_ranks_unmeasured_models_at_the_prior(config):
+    router = ModelRouter(ttft_prior=1.0)
+    router._model_stats("large").success(0.5)
+    router._model_stats("small").success(2.0)
+    # medium is unmeasured: between a fast and a slow measured model
+    assert router.rank("fastest", "hi") == ["large", "medium", "small"]
+
+
+def test_fastest_tries_unmeasured_low_tiers_first(config):
+    assert ModelRouter().rank("fastest", "hi") == ["small", "medium", "large"]
+
+
+def test_models_over_budget_are_skipped(config):
+    config.record("someone", "large", 1000, 0)
+    assert "large" not in ModelRouter().rank("cheapest", "hi")
+
+
+def test_every_model_over_budget_is_a_budget_rejection(config, monkeypatch):
+    everything = {m["id"] for m in MODELS}
+    monkeypatch.setattr(config, "exhausted_models", lambda *_: everything)
+    router = ModelRouter(stream_fn=answer)
+    with pytest.raises(Rejected) as rejected:
+        list(router.stream("hi", "cheapest"))
+    assert rejected.value.status_code == 429
+    assert rejected.value.reason == "model_budget_exceeded"
+
+
+def test_fails_over_before_the_first_token(config):
+    def flaky(**kwargs):
+        if kwargs["model_name"] == "small":
+            raise RuntimeError("throttled")
+        yield from answer(**kwargs)
+
+    router = ModelRouter(stream_fn=flaky)
+    events = list(router.stream("hi", "cheapest"))
+    assert events == [
+        {"type": "model", "model": "medium"},
+        {"type": "text", "text": "medium"},
+    ]
+    assert router.failovers == 1
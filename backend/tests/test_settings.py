@@ -0,0 +1,126 @@
+import asyncio
+import json
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src import settings
+from src.settings import SettingsError
+
+
+@pytest.fixture
+def isolated(monkeypatch):
+    """Reloads in a test replace these copies, not the app's settings."""
+    monkeypatch.setattr(settings, "_current", settings.current())
+    monkeypatch.setattr(settings, "_listeners", [])
+
+
+def raw(**overrides):
+    values = {
+        "kb_id": "KB1",
+        "region": "eu-central-1",
+        "models": [{"id": "model", "input_cost": 1, "output_cost": 2}],
+        "limits": {
+            "max_concurrent": 4,
+            "queue_size": 8,
+            "queue_timeout": 1,
+            "rate": 2,
+            "burst": 5,
+        },
+    }
+    values.update(overrides)
+    return values
+
+
+def test_build_freezes_valid_settings():
+    config = settings.build(raw(), version=3, source="test")
+    assert config.kb_id == "KB1"
+    assert config.model_by_id["model"].arn == (
+        "arn:aws:bedrock:eu-central-1::foundation-model/model"
+    )
+    assert config.limits.max_concurrent == 4
+    assert (config.version, config.source) == (3, "test")
+    with pytest.raises(TypeError):
+        config.model_by_id["other"] = config.models[0]
+
+
+def test_build_lists_every_problem():
+    bad = raw(
+        kb_id="not an id!",
+        region="moon",
+        models=[{"id": "a", "input_cost": -1}, {"id": "a"}],
+        limits={"max_concurrent": 0},
+    )
+    with pytest.raises(SettingsError) as error:
+        settings.build(bad)
+    problems = "\n".join(error.value.problems)
+    for expected in (
+        "is not a knowledge base id",
+        "is not an AWS region",
+        "negative cost",
+        "listed twice",
+        "limits are invalid",
+    ):
+        assert expected in problems
+
+
+def test_reload_applies_file_and_notifies_listeners(tmp_path, isolated):
+    path = tmp_path / "settings.json"
+    path.write_text(json.dumps(raw()))
+    seen = []
+    settings.on_reload(seen.append)
+    version = settings.current().version
+
+    assert settings.reload(str(path))
+    assert settings.current().version == version + 1
+    assert settings.current().source == str(path)
+    assert seen == [settings.current()]
+
+
+def test_invalid_reload_keeps_current_settings(tmp_path, isolated):
+    before = settings.current()
+    path = tmp_path / "settings.json"
+    path.write_text(json.dumps(raw(region="moon")))
+    assert not settings.reload(str(path))
+    path.write_text("{not json")
+    assert not settings.reload(str(path))
+    assert settings.current() is before
+
+
+def test_failing_listener_does_not_stop_the_reload(tmp_path, isolated):
+    path = tmp_path / "settings.json"
+    path.write_text(json.dumps(raw()))
+    seen = []
+
+    def broken(new):
+        raise RuntimeError("listener bug")
+
+    settings.on_reload(broken)
+    settings.on_reload(seen.append)
+    assert settings.reload(str(path))
+    assert len(seen) == 1
+
+
+def test_sighup_handler_is_skipped_off_the_main_thread():
+    installed = []
+
+    def worker():
+        installed.append(asyncio.run(async_install()))
+
+    async def async_install():
+        return settings.install_sighup_handler()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    assert installed == [False]
+
+
+def test_generate_rejects_unknown_models():
+    from app import app
+
+    client = TestClient(app)
+    response = client.post("/generate", json={"prompt": "hi", "modelName": "nope"})
+    assert response.status_code == 400
+    assert "Unknown model 'nope'" in response.json()["detail"]
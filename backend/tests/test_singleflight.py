@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+
+from src.singleflight import SingleFlight
+
+
+class FakeUpstream:
+    """Async stream whose chunks are released one at a time by the test."""
+
+    def __init__(self, chunks, fail=None):
+        self.chunks = chunks
+        self.fail = fail
+        self.released = asyncio.Semaphore(0)
+        self.started = 0
+        self.cancelled = False
+
+    def release(self, n=1):
+        for _ in range(n):
+            self.released.release()
+
+    async def stream(self):
+        self.started += 1
+        try:
+            for chunk in self.chunks:
+                await self.released.acquire()
+                yield chunk
+            if self.fail is not None:
+                await self.released.acquire()
+                raise self.fail
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+def text(n):
+    return {"type": "text", "text": str(n)}
+
+
+async def take(stream, n):
+    return [await anext(stream) for _ in range(n)]
+
+
+def run(main):
+    # A wrong flight would wait forever for chunks nobody releases
+    asyncio.run(asyncio.wait_for(main(), 5))
+
+
+def test_late_joiner_replays_buffer_then_follows_live():
+    async def main():
+        flights = SingleFlight()
+        upstream = FakeUpstream([text(1), text(2), text(3)])
+        leader = flights.subscribe("key", upstream.stream)
+        upstream.release(2)
+        assert await take(leader, 2) == [text(1), text(2)]
+
+        joiner = flights.subscribe("key", upstream.stream)
+        # Buffered chunks first
+        assert await take(joiner, 2) == [text(1), text(2)]
+        upstream.release()
+        assert await anext(leader) == text(3)
+        assert await anext(joiner) == text(3)
+        for stream in (leader, joiner):
+            with pytest.raises(StopAsyncIteration):
+                await anext(stream)
+        assert upstream.started == 1
+        assert flights.stats() == {"in_flight": 0, "started": 1, "coalesced": 1}
+
+    run(main)
+
+
+def test_upstream_cancelled_when_last_subscriber_leaves():
+    async def main():
+        flights = SingleFlight()
+        upstream = FakeUpstream([text(n) for n in range(5)])
+        first = flights.subscribe("key", upstream.stream)
+        second = flights.subscribe("key", upstream.stream)
+        upstream.release()
+        assert await anext(first) == text(0)
+        assert await anext(second) == text(0)
+
+        await first.aclose()
+        await asyncio.sleep(0)
+        assert not upstream.cancelled
+        upstream.release()
+        assert await anext(second) == text(1)
+
+        await second.aclose()
+        await asyncio.sleep(0)
+        assert upstream.cancelled
+        assert flights.stats()["in_flight"] == 0
+
+        # The next request starts a fresh upstream
+        again = flights.subscribe("key", upstream.stream)
+        upstream.release()
+        assert await anext(again) == text(0)
+        assert upstream.started == 2
+        await again.aclose()
+
+    run(main)
+
+
+def test_upstream_error_reaches_every_subscriber():
+    async def main():
+        flights = SingleFlight()
+        upstream = FakeUpstream([text(1)], fail=RuntimeError("throttled"))
+        first = flights.subscribe("key", upstream.stream)
+        second = flights.subscribe("key", upstream.stream)
+        upstream.release()
+        # Both join before the upstream runs
+        assert await asyncio.gather(anext(first), anext(second)) == [text(1)] * 2
+        upstream.release()
+        for stream in (first, second):
+            with pytest.raises(RuntimeError, match="throttled"):
+                await anext(stream)
+
+    run(main)
+
+
+def test_session_only_reaches_the_leader():
+    async def main():
+        flights = SingleFlight()
+        session = {"type": "session", "session_id": "s"}
+        upstream = FakeUpstream([session, text(1)])
+        leader = flights.subscribe("key", upstream.stream)
+        joiner = flights.subscribe("key", upstream.stream)
+        upstream.release(2)
+        # Both join before the upstream runs
+        first = await asyncio.gather(anext(leader), anext(joiner))
+        assert first == [session, text(1)]
+        assert await anext(leader) == text(1)
+
+    run(main)
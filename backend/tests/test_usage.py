@@ -0,0 +1,96 @@
+import pytest
+
+from src import settings, usage
+from src.admission import Rejected
+from src.usage import UsageLedger
+
+MODELS = [
+    {"id": "small", "input_cost": 1, "output_cost": 1, "tier": 1},
+    {"id": "medium", "input_cost": 2, "output_cost": 2, "tier": 2},
+    {"id": "cheap-big", "input_cost": 3, "output_cost": 3, "tier": 3},
+    {"id": "large", "input_cost": 10, "output_cost": 10, "tier": 4, "daily_budget": 5},
+]
+
+
+@pytest.fixture
+def configure(monkeypatch):
+    def apply(**overrides):
+        raw = {
+            "kb_id": "KB1",
+            "region": "us-east-1",
+            "models": MODELS,
+            "limits": {
+                "max_concurrent": 1,
+                "queue_size": 0,
+                "queue_timeout": 0,
+                "rate": 0,
+                "burst": 1,
+            },
+            **overrides,
+        }
+        monkeypatch.setattr(settings, "_current", settings.build(raw))
+
+    apply()
+    return apply
+
+
+def test_record_prices_tokens_per_thousand(configure):
+    ledger = UsageLedger(db_path="")
+    assert ledger.record("alice", "medium", 1000, 500) == pytest.approx(3.0)
+    report = ledger.report()
+    assert report["users"]["alice"] == {
+        "requests": 1,
+        "input_tokens": 1000,
+        "output_tokens": 500,
+        "cost": 3.0,
+    }
+
+
+def test_unknown_models_are_charged_the_highest_rate(configure):
+    ledger = UsageLedger(db_path="")
+    assert ledger.record("alice", "removed-model", 1000, 0) == pytest.approx(10.0)
+
+
+def test_user_over_budget_is_rejected(configure):
+    configure(user_daily_budget=2)
+    ledger = UsageLedger(db_path="")
+    assert ledger.check("alice", "small") == "small"
+    ledger.record("alice", "small", 2000, 0)
+    with pytest.raises(Rejected) as rejected:
+        ledger.check("alice", "small")
+    assert (rejected.value.status_code, rejected.value.reason) == (
+        429,
+        "user_budget_exceeded",
+    )
+    # Other users keep their own budget
+    assert ledger.check("bob", "small") == "small"
+
+
+def test_model_over_budget_downgrades_to_the_best_cheaper_one(configure):
+    ledger = UsageLedger(db_path="")
+    ledger.record("alice", "large", 500, 0)
+    assert ledger.exhausted_models() == {"large"}
+    assert ledger.check("bob", "large") == "cheap-big"
+    assert ledger.check("bob", "medium") == "medium"
+
+
+def test_model_over_budget_is_rejected_when_configured(configure, monkeypatch):
+    monkeypatch.setattr(usage, "BUDGET_ACTION", "reject")
+    ledger = UsageLedger(db_path="")
+    ledger.record("alice", "large", 500, 0)
+    with pytest.raises(Rejected) as rejected:
+        ledger.check("bob", "large")
+    assert rejected.value.reason == "model_budget_exceeded"
+
+
+def test_totals_survive_a_restart_and_the_database_opens_lazily(configure, tmp_path):
+    path = tmp_path / "usage.sqlite3"
+    ledger = UsageLedger(db_path=str(path))
+    assert not path.exists()
+    ledger.record("alice", "large", 500, 0)
+    ledger.close()
+
+    restarted = UsageLedger(db_path=str(path))
+    assert restarted.exhausted_models() == {"large"}
+    assert restarted.report()["users"]["alice"]["cost"] == 5.0
+    restarted.close()
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from src import settings, usage, warmer
+from src.retrieval import kb_key
+from src.usage import UsageLedger
+from src.warmer import FAQWarmer, variant
+
+MODEL = settings.current().models[0].id
+
+
+class Slot:
+    released = False
+
+    def release(self):
+        self.released = True
+
+
+@pytest.fixture
+def faq(tmp_path, monkeypatch):
+    ledger = UsageLedger(db_path="")
+    monkeypatch.setattr(usage, "usage_ledger", ledger)
+    monkeypatch.setattr(warmer, "usage_ledger", ledger)
+
+    def answer(user_query, model_name):
+        yield {"type": "session", "sessionId": "s-1"}
+        yield {"type": "text", "text": "Roaming works in 30 countries."}
+        yield {"type": "usage", "input_tokens": 10, "output_tokens": 6}
+
+    monkeypatch.setattr(warmer, "retrieve_and_generate_stream", answer)
+    path = tmp_path / "faq.sqlite3"
+    store = FAQWarmer(questions_file="", db_path=str(path))
+    yield store, path
+    store.close()
+
+
+def test_precomputed_answer_is_replayed_as_generated(faq):
+    store, path = faq
+    slot = Slot()
+    kbs = kb_key(settings.current().knowledge_bases)
+
+    async def main():
+        assert await store._precompute("What is roaming?", MODEL, slot)
+        return await store.lookup("what is roaming", variant(MODEL), kbs)
+
+    assert not path.exists()
+    events = asyncio.run(asyncio.wait_for(main(), 5))
+    assert slot.released
+    assert path.exists()
+    # The session is not shared; events are stored as they were streamed
+    assert [event["type"] for event in events] == ["text", "usage"]
+    assert events[0] == {"type": "text", "text": "Roaming works in 30 countries."}
+    store.observe("What is roaming?")
+    stats = store.stats()
+    assert (stats["warmed"], stats["served"], stats["coverage"]) == (1, 1, 1.0)
+
+
+def test_frequent_prompts_become_questions(faq, monkeypatch):
+    store, _ = faq
+    monkeypatch.setattr(warmer, "FAQ_MINE_MIN_COUNT", 2)
+    for prompt in ("Tariffs?", "tariffs", "Coverage?"):
+        store.observe(prompt)
+    store.observe("Tariffs?", mine=False)
+    assert store.questions() == ["Tariffs?"]
+    assert store.requests == 4
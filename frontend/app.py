@@ -1,16 +1,10 @@
-import asyncio
-import atexit
 import os
 
-import nest_asyncio
 import streamlit as st
 
 from apps import mcp_playground
 from services.chat_service import init_session
-from utils.async_helpers import on_shutdown
-
-# Apply nest_asyncio to allow nested asyncio event loops (needed for Streamlit's execution model)
-nest_asyncio.apply()
+from utils.async_helpers import session_owner
 
 page_icon_path = os.path.join(".", "icons", "playground.png")
 
@@ -27,13 +21,9 @@ with open(os.path.join(".", ".streamlit", "style.css")) as f:
 
 
 def main():
-    # Initialize session state for event loop
-    if "loop" not in st.session_state:
-        st.session_state.loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(st.session_state.loop)
-
-    # Register shutdown handler
-    atexit.register(on_shutdown)
+    # Async work runs on one shared background loop (utils/background_loop.py);
+    # the session's shared resources are released when the session ends
+    session_owner()
 
     # Initialize the primary application
     init_session()
@@ -5,40 +5,55 @@ import streamlit as st
 
 # from utils.ai_prompts import make_system_prompt, make_main_prompt
 import ui_components.sidebar_components as sd_compents
-from services.chat_service import _append_message_to_session, get_current_chat
+from config import BACKEND_URL
+from services.backend_client import BackendError, stream_text
+from services.chat_service import (
+    _append_message_to_session,
+    get_chat_session_id,
+    set_chat_session_id,
+)
 from ui_components.main_components import display_tool_executions
+from ui_components.message_renderer import (
+    render_chat_window,
+    render_citations,
+    render_message,
+    render_model,
+)
 
 
-def request_stream(prompt: str, modelName: str, api_url: str):
-    """Send the raw uploaded file to FastAPI /predict."""
+def request_stream(
+    prompt: str,
+    modelName: str,
+    api_url: str,
+    meta=None,
+    sessionId=None,
+    chatId=None,
+    routing=None,
+    pipeline=None,
+    maxTokens=None,
+    temperature=None,
+):
+    """Stream the answer for *prompt* from the FastAPI /generate endpoint."""
     try:
-        data = {"prompt": prompt, "modelName": modelName}
+        data = {
+            "prompt": prompt,
+            "modelName": modelName,
+            "sessionId": sessionId,
+            "chatId": chatId,
+            "routing": routing,
+            "pipeline": pipeline,
+            "maxTokens": maxTokens,
+            "temperature": temperature,
+        }
         print(f"Sending request to API: {api_url} with data: {data}", flush=True)
-        with requests.post(api_url, json=data, stream=True) as resp:
-            # resp.iter_lines() yields chunks as they arrive
-            for line in resp:
-                if line.decode(encoding="utf-8", errors="ignore"):
-                    # line is already a string if decode_unicode=True
-                    # print(line)
-                    yield line.decode(encoding="utf-8", errors="ignore")
-        # FastAPI: 200 OK on success; 4xx/5xx otherwise with JSON detail
-        # if resp.headers.get("content-type", "").startswith("application/json"):
-        #     data = resp.json()
-        # else:
-        #     st.error(
-        #         f"Unexpected response from API (status {resp.status_code}): {resp.text[:400]}"
-        #     )
-        #     return None
-
-        if resp.status_code == 200:
-            return data
+        # Lets the backend rate-limit per user instead of per frontend host
+        headers = {"X-Client-Id": st.session_state.get("user_id", "")}
+        yield from stream_text(api_url, data, meta, headers)
+    except BackendError as e:
         # Error path from FastAPI (HTTPException)
-        detail = data.get("detail") if isinstance(data, dict) else None
-        st.error(f"API Error {resp.status_code}: {detail or data}")
-        return None
+        st.error(str(e))
     except requests.exceptions.RequestException as e:
         st.error(f"Network error while calling API: {e}")
-        return None
 
 
 def main():
@@ -51,17 +66,11 @@ def main():
     st.header("Chat with Agent")
     messages_container = st.container(border=True, height=600)
     # ------------------------------------------------------------------ Chat history
-    # Re-render previous messages
+    # Re-render the most recent messages; older ones load on demand
     if st.session_state.get("current_chat_id"):
-        st.session_state["messages"] = get_current_chat(
-            st.session_state["current_chat_id"]
+        st.session_state["messages"] = render_chat_window(
+            messages_container, st.session_state["current_chat_id"]
         )
-        for m in st.session_state["messages"]:
-            with messages_container.chat_message(m["role"]):
-                if "tool" in m and m["tool"]:
-                    st.code(m["tool"], language="yaml")
-                if "content" in m and m["content"]:
-                    st.markdown(m["content"])
 
     # ------------------------------------------------------------------ Chat input
     user_text = st.chat_input(
@@ -72,18 +81,21 @@ def main():
     # Main sidebar widgets
     sd_compents.create_sidebar_chat_buttons()
     sd_compents.create_provider_select_widget()
+    sd_compents.create_advanced_configuration_widget()
+    sd_compents.create_mcp_connection_widget()
+    sd_compents.create_mcp_tools_widget()
 
     # ------------------------------------------------------------------ Main Logic
     if user_text is None:  # nothing submitted yet
         st.stop()
 
     # ------------------------------------------------------------------ handle question (if any text)
-    api_url = "http://backend:8000/generate"
+    api_url = f"{BACKEND_URL}/generate"
     if user_text:
         user_text_dct = {"role": "user", "content": user_text}
         _append_message_to_session(user_text_dct)
         with messages_container.chat_message("user"):
-            st.markdown(user_text)
+            render_message(user_text_dct)
 
         with st.spinner("Thinking…", show_time=True):
             print(
@@ -113,15 +125,32 @@ def main():
                 )
                 # If agent is available, use it
 
+                meta = {}
                 response_stream = request_stream(
                     prompt=user_text,
                     modelName=st.session_state["params"]["model_name"],
                     api_url=api_url,
+                    meta=meta,
+                    sessionId=get_chat_session_id(),
+                    # The backend keeps the chat's history; only the new
+                    # question is sent
+                    chatId=st.session_state["current_chat_id"],
+                    routing=st.session_state["params"].get("routing"),
+                    pipeline=st.session_state["params"].get("pipeline"),
+                    **sd_compents.inference_overrides(st.session_state["params"]),
                 )
                 print("Response stream received:", response_stream, flush=True)
                 with messages_container.chat_message("assistant"):
                     response = st.write_stream(response_stream)
                     response_dct = {"role": "assistant", "content": response}
+                    if meta.get("model"):
+                        response_dct["model"] = meta["model"]
+                        render_model(meta["model"])
+                    if meta.get("citations"):
+                        response_dct["citations"] = meta["citations"]
+                        render_citations(meta["citations"])
+                if meta.get("session_id"):
+                    set_chat_session_id(meta["session_id"])
             except Exception as e:
                 response = f"⚠️ Something went wrong: {str(e)}"
                 st.error(response)
@@ -0,0 +1,65 @@
+"""Time chat-pane reruns for chats of 10, 100 and 1000 messages.
+
+Usage (from frontend/): uv run python -m benchmarks.render_bench
+"""
+
+import argparse
+import os
+import statistics
+
+from streamlit.testing.v1 import AppTest
+
+# Keep benchmark chats out of the real chat database
+os.environ.setdefault("CHAT_STORE_BACKEND", "memory")
+
+
+def chat_page(message_count: int):
+    import streamlit as st
+
+    from services.chat_service import _append_message_to_session, get_chat_store
+    from ui_components.message_renderer import render_chat_window
+
+    if "current_chat_id" not in st.session_state:
+        store = get_chat_store()
+        st.session_state["user_id"] = "bench"
+        st.session_state["messages"] = []
+        st.session_state["current_chat_id"] = store.create_chat("bench")["chat_id"]
+        answer = "Azercell tariff details with **markdown** and a $5 price. " * 20
+        for i in range(message_count):
+            role = "user" if i % 2 == 0 else "assistant"
+            _append_message_to_session({"role": role, "content": f"{i}: {answer}"})
+
+    render_chat_window(st.container(), st.session_state["current_chat_id"])
+
+
+def bench(message_count: int, reruns: int) -> dict:
+    at = AppTest.from_function(chat_page, args=(message_count,), default_timeout=60)
+    at.run()  # populate the chat
+    timings = []
+    for _ in range(reruns):
+        at.run()
+        timings.append(at.session_state["render_stats"][-1]["seconds"])
+    last = at.session_state["render_stats"][-1]
+    return {
+        "messages": message_count,
+        "rendered": last["rendered"],
+        "median_ms": statistics.median(timings) * 1000,
+        "max_ms": max(timings) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--reruns", type=int, default=10)
+    args = parser.parse_args()
+
+    for count in (10, 100, 1000):
+        result = bench(count, args.reruns)
+        print(
+            f"{result['messages']:>5} messages: rendered {result['rendered']:>3}, "
+            f"median {result['median_ms']:.2f} ms, max {result['max_ms']:.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Time chat search on a chat store with tens of thousands of messages.
+
+Fills a temporary SQLite chat store with one user's chats (and other
+users' chats, which searches must skip) made of synthetic questions and
+answers. Then times ``search`` for common, rare, prefix and multi-word
+queries, and for later result pages. It also times ``append_message``,
+which now updates the search index, and the memory store's scan of the
+same chats for comparison.
+
+The run fails (exit code 1) unless the p95 search time of every query
+stays under --budget-ms.
+
+Usage (from frontend/):
+    uv run python -m benchmarks.search_bench --chats 2000 --messages 25
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from services.chat_store import MemoryChatStore, SQLiteChatStore
+
+TOPICS = [
+    "tariff", "roaming", "internet", "balance", "sim", "esim", "bonus",
+    "transfer", "invoice", "number", "package", "minutes", "sms", "5g",
+]
+FILLER = (
+    "Azercell customers can check this in the app or by calling the support "
+    "line and the price depends on the plan chosen for the month"
+).split()
+QUERIES = {
+    "common word": "azercell",
+    "topic": "roaming",
+    "prefix": "trans",
+    "two words": "internet package",
+    "rare word": "zebra",
+    "no match": "xylophone",
+}
+
+
+def message(rng: random.Random, n: int) -> str:
+    words = rng.choices(FILLER, k=rng.randint(15, 60))
+    for _ in range(rng.randint(1, 3)):
+        words.insert(rng.randrange(len(words)), rng.choice(TOPICS))
+    if n % 997 == 0:
+        words.append("zebra")
+    return " ".join(words)
+
+
+def fill(store, user: str, chats: int, messages: int, rng: random.Random) -> float:
+    """Create the chats; returns the mean append time in seconds."""
+    appends = []
+    n = 0
+    for _ in range(chats):
+        chat_id = store.create_chat(user, " ".join(rng.sample(TOPICS, 3)))["chat_id"]
+        for seq in range(messages):
+            role = "user" if seq % 2 == 0 else "assistant"
+            msg = {"role": role, "content": message(rng, n)}
+            started = time.perf_counter()
+            store.append_message(chat_id, msg)
+            appends.append(time.perf_counter() - started)
+            n += 1
+    return statistics.mean(appends)
+
+
+def time_search(store, user: str, query: str, runs: int, offset: int = 0):
+    timings = []
+    hits = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        hits = store.search(user, query, offset, 21)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(0.95 * (len(timings) - 1))], hits
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--chats", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=25, help="per chat")
+    parser.add_argument("--other-users", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--budget-ms", type=float, default=50.0)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    path = os.path.join(tempfile.mkdtemp(), "chats.db")
+    store = SQLiteChatStore(path)
+    started = time.perf_counter()
+    append = fill(store, "bench", args.chats, args.messages, rng)
+    for n in range(args.other_users):
+        fill(store, f"other-{n}", args.chats // 2, args.messages, rng)
+    total = args.chats * args.messages * (1 + args.other_users / 2)
+    print(
+        f"{total:.0f} messages ({args.chats * args.messages} for the searching"
+        f" user) written in {time.perf_counter() - started:.1f} s,"
+        f" {append * 1e3:.3f} ms per append"
+    )
+
+    ok = True
+    print(f"{'query':14} {'p50 ms':>8} {'p95 ms':>8}  hits")
+    for name, query in QUERIES.items():
+        p50, p95, hits = time_search(store, "bench", query, args.runs)
+        ok = ok and p95 * 1e3 < args.budget_ms
+        print(f"{name:14} {p50 * 1e3:8.2f} {p95 * 1e3:8.2f}  {len(hits)}")
+    p50, p95, hits = time_search(store, "bench", QUERIES["topic"], args.runs, 200)
+    ok = ok and p95 * 1e3 < args.budget_ms
+    print(f"{'page 11':14} {p50 * 1e3:8.2f} {p95 * 1e3:8.2f}  {len(hits)}")
+
+    memory = MemoryChatStore()
+    fill(memory, "bench", args.chats, args.messages, random.Random(args.seed))
+    p50, _, _ = time_search(memory, "bench", QUERIES["topic"], 3)
+    print(f"memory store scan for comparison: {p50 * 1e3:.1f} ms")
+
+    print(f"{'ok' if ok else 'FAIL'}: p95 under {args.budget_ms} ms")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
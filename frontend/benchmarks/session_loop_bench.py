@@ -0,0 +1,133 @@
+"""Drive many simulated Streamlit sessions through the shared event loop.
+
+Each session is a thread, like a Streamlit script thread. It takes a
+session handle, acquires a shared async resource (a fake MCP engine with
+a configurable connect and call latency), runs a number of reruns that each
+make a few concurrent calls through ``run_async``, and then ends. Half the
+sessions disconnect explicitly; the rest just drop their handle, as
+Streamlit does with a closed session's state.
+
+The run fails (exit code 1) unless:
+- each distinct configuration was opened exactly once and then closed;
+- no references are left over;
+- the wall time shows the sessions' waits overlapping instead of queueing
+  behind each other.
+
+Usage (from frontend/):
+    uv run python -m benchmarks.session_loop_bench --sessions 200 --reruns 5
+"""
+
+import argparse
+import asyncio
+import gc
+import sys
+import threading
+import time
+
+from utils.async_helpers import _SessionHandle, run_async
+from utils.background_loop import get_loop, resources
+
+
+class FakeEngine:
+    """Stands in for a ToolEngine: slow to connect, slow to call."""
+
+    def __init__(self, connect_latency: float, call_latency: float):
+        self.connect_latency = connect_latency
+        self.call_latency = call_latency
+        self.calls = 0
+
+    async def __aenter__(self):
+        await asyncio.sleep(self.connect_latency)
+        return self
+
+    async def __aexit__(self, *exc):
+        await asyncio.sleep(0)
+
+    async def call(self) -> float:
+        self.calls += 1
+        await asyncio.sleep(self.call_latency)
+        return self.call_latency
+
+    async def execute(self, calls: int):
+        return await asyncio.gather(*(self.call() for _ in range(calls)))
+
+
+def session(n: int, args, engines: dict, errors: list, start: threading.Barrier):
+    key = f"servers-{n % args.configs}"
+    handle = _SessionHandle()
+    start.wait()
+    try:
+        engine = run_async(
+            resources.acquire(
+                key,
+                lambda: FakeEngine(args.connect_latency, args.call_latency),
+                handle.owner,
+            )
+        )
+        engines.setdefault(key, set()).add(id(engine))
+        for _ in range(args.reruns):
+            run_async(engine.execute(args.calls))
+        if n % 2:
+            run_async(resources.release(key, handle.owner))
+    except Exception as exc:  # reported below, the thread must not die silently
+        errors.append(repr(exc))
+    # The other half end like a closed Streamlit session: the handle is dropped
+    del handle
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--reruns", type=int, default=5)
+    parser.add_argument("--calls", type=int, default=3, help="tool calls per rerun")
+    parser.add_argument("--configs", type=int, default=4, help="distinct servers")
+    parser.add_argument("--connect-latency", type=float, default=0.2)
+    parser.add_argument("--call-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    get_loop()
+    engines: dict = {}
+    errors: list = []
+    start = threading.Barrier(args.sessions)
+    threads = [
+        threading.Thread(target=session, args=(n, args, engines, errors, start))
+        for n in range(args.sessions)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    # Let the finalizers' releases run on the loop
+    run_async(asyncio.sleep(0.1))
+    stats = resources.stats()
+
+    # One session's own waits, back to back; all sessions together should
+    # take little longer than that if they really overlap
+    one_session = args.connect_latency + args.reruns * args.call_latency
+    checks = {
+        "no errors": not errors,
+        "one engine per configuration": all(len(ids) == 1 for ids in engines.values())
+        and len(engines) == min(args.configs, args.sessions),
+        "every engine closed": stats["opened"] == stats["closed"] == len(engines),
+        "no references left": stats["references"] == 0 and stats["resources"] == 0,
+        "sessions overlap": elapsed < one_session * 3,
+    }
+    print(
+        f"{args.sessions} sessions x {args.reruns} reruns x {args.calls} calls "
+        f"in {elapsed:.2f} s (one session alone: {one_session:.2f} s)"
+    )
+    print(f"pool: {stats}")
+    for name, ok in checks.items():
+        print(f"  {'ok  ' if ok else 'FAIL'} {name}")
+    for error in errors[:5]:
+        print(f"  error: {error}")
+    sys.exit(0 if all(checks.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Throughput of the backend client against a local fake streaming server.
+
+The server streams SSE-framed Azerbaijani text in small chunked-encoding
+pieces cut at arbitrary byte offsets, so multi-byte characters are regularly
+split across chunks. The benchmark compares a pooled session with a new
+connection per request and reports how many characters each loses.
+
+Usage (from frontend/): uv run python -m benchmarks.stream_bench
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from services import backend_client
+
+ANSWER = "Azərbaycanda ən sərfəli tariflər: şəbəkədaxili zənglər, ölkədaxili SMS. " * 40
+PAYLOAD = b"".join(
+    b"event: text\ndata: %s\n\n"
+    % json.dumps({"text": ANSWER[i : i + 24]}, ensure_ascii=False).encode()
+    for i in range(0, len(ANSWER), 24)
+) + b'event: done\ndata: {"citations": []}\n\n'
+PIECE = 7  # bytes per chunk; not aligned to UTF-8 character boundaries
+
+
+class FakeStreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Like uvicorn, send small writes immediately
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("content-length", 0)))
+        self.send_response(200)
+        self.send_header("content-type", "text/event-stream")
+        self.send_header("transfer-encoding", "chunked")
+        self.end_headers()
+        for start in range(0, len(PAYLOAD), PIECE):
+            piece = PAYLOAD[start : start + PIECE]
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(piece), piece))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, *args):
+        pass
+
+
+def run_pooled(url: str, requests_count: int) -> tuple:
+    started = time.perf_counter()
+    for _ in range(requests_count):
+        text = "".join(backend_client.stream_text(url, {"prompt": "tariflər"}))
+    return time.perf_counter() - started, len(ANSWER) - len(text)
+
+
+def run_unpooled(url: str, requests_count: int) -> tuple:
+    """The previous behaviour: a new connection and lossy decoding per turn."""
+    started = time.perf_counter()
+    for _ in range(requests_count):
+        with requests.post(url, json={"prompt": "tariflər"}, stream=True) as resp:
+            raw = "".join(chunk.decode("utf-8", errors="ignore") for chunk in resp)
+        frames = backend_client.iter_sse([raw.encode()])
+        text = "".join(data["text"] for event, data, _ in frames if event == "text")
+    return time.perf_counter() - started, len(ANSWER) - len(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeStreamHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/generate"
+
+    megabytes = len(PAYLOAD) * args.requests / 1e6
+    try:
+        for name, runner in (("pooled", run_pooled), ("unpooled", run_unpooled)):
+            elapsed, lost = runner(url, args.requests)
+            print(
+                f"{name:>8}: {args.requests / elapsed:8.1f} req/s, "
+                f"{megabytes / elapsed:6.2f} MB/s, "
+                f"{lost} characters lost per answer"
+            )
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
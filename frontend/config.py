@@ -6,15 +6,33 @@ from dotenv import load_dotenv
 load_dotenv()
 env = os.getenv
 
-# Model mapping
+# Backend base URL; /generate and /models live under it
+BACKEND_URL = env("BACKEND_URL", "http://backend:8000").rstrip("/")
+
+# Model mapping, used until the backend's /models answers
 MODEL_OPTIONS = {
     "Claude 3 Haiku": "anthropic.claude-3-haiku-20240307-v1:0",
     "Claude 3.5 Sonnet": "anthropic.claude-3-5-sonnet-20240620-v1:0",
     "Nova pro": "amazon.nova-pro-v1:0",
 }
 
-# test
-# Load server configuration
+# Backend routing policies; "Manual" sends the selected model as is
+ROUTING_OPTIONS = {
+    "Manual": None,
+    "Cheapest first": "cheapest",
+    "Fastest first": "fastest",
+    "Auto (by question)": "auto",
+}
+
+# Backend pipelines: Bedrock's retrieve-and-generate, or a cached retrieval
+# step followed by direct generation
+PIPELINE_OPTIONS = {
+    "Retrieve and generate": "managed",
+    "Cached retrieval, then generate": "decoupled",
+}
+
+# Load server configuration; without the file no MCP servers are configured
+SERVER_CONFIG = {"mcpServers": {}}
 config_path = os.path.join(".", "servers_config.json")
 if os.path.exists(config_path):
     with open(config_path, "r") as f:
@@ -0,0 +1,217 @@
+"""HTTP client for the FastAPI backend.
+
+A single ``requests.Session`` is shared by every Streamlit session so turns
+reuse pooled keep-alive connections instead of opening a new TCP connection
+each time. Streamed bytes go through an incremental UTF-8 decoder, which
+holds back a multi-byte character split across network chunks until the
+rest of it arrives instead of dropping it, and are then parsed as
+server-sent events.
+"""
+
+import codecs
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+BACKEND_POOL_SIZE = int(os.getenv("BACKEND_POOL_SIZE", "20"))
+BACKEND_CONNECT_TIMEOUT = float(os.getenv("BACKEND_CONNECT_TIMEOUT", "5"))
+# Maximum silence between two streamed chunks
+BACKEND_READ_TIMEOUT = float(os.getenv("BACKEND_READ_TIMEOUT", "120"))
+# 0 streams bytes as they arrive, whatever their size
+BACKEND_CHUNK_SIZE = int(os.getenv("BACKEND_CHUNK_SIZE", "0")) or None
+# Reconnects with Last-Event-ID after the connection drops mid-answer
+BACKEND_RESUME_ATTEMPTS = int(os.getenv("BACKEND_RESUME_ATTEMPTS", "3"))
+# How long the model list from /models is reused before asking again
+MODELS_CACHE_TTL = float(os.getenv("MODELS_CACHE_TTL", "60"))
+
+
+class BackendError(Exception):
+    """The backend answered with a non-success status."""
+
+    def __init__(
+        self, status_code: int, detail: str, retry_after: Optional[int] = None
+    ):
+        message = f"API Error {status_code}: {detail}"
+        if retry_after is not None:
+            # 429/503 from admission control: the backend is busy, not broken
+            message += f" (try again in {retry_after} s)"
+        super().__init__(message)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=BACKEND_POOL_SIZE, pool_maxsize=BACKEND_POOL_SIZE
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+    return _session
+
+
+_models: Dict[str, str] = {}
+_models_fetched_at = 0.0
+_models_lock = threading.Lock()
+
+
+def get_model_options(base_url: str, fallback: Dict[str, str]) -> Dict[str, str]:
+    """Model display name -> id as configured on the backend.
+
+    The list is fetched from ``/models`` at most every MODELS_CACHE_TTL
+    seconds. While the backend cannot be reached the last list it sent is
+    kept, or *fallback* before it has answered once.
+    """
+    global _models, _models_fetched_at
+    with _models_lock:
+        if time.monotonic() - _models_fetched_at < MODELS_CACHE_TTL:
+            return _models or fallback
+        _models_fetched_at = time.monotonic()
+        try:
+            resp = get_session().get(
+                f"{base_url}/models", timeout=BACKEND_CONNECT_TIMEOUT
+            )
+            resp.raise_for_status()
+            models = {m["name"]: m["id"] for m in resp.json()["models"]}
+        except (requests.RequestException, ValueError, KeyError, TypeError):
+            return _models or fallback
+        if models:
+            _models = models
+        return _models or fallback
+
+
+def forget_chat(base_url: str, chat_id: str, user_id: str) -> bool:
+    """Drop the backend's memory of a deleted chat; False if it failed."""
+    try:
+        resp = get_session().delete(
+            f"{base_url}/chats/{chat_id}/memory",
+            headers={"X-Client-Id": user_id},
+            timeout=BACKEND_CONNECT_TIMEOUT,
+        )
+    except requests.RequestException:
+        return False
+    return resp.status_code == 200
+
+
+def _error_detail(resp: requests.Response) -> str:
+    if resp.headers.get("content-type", "").startswith("application/json"):
+        try:
+            data = resp.json()
+        except ValueError:
+            return resp.text[:400]
+        if isinstance(data, dict) and "detail" in data:
+            return str(data["detail"])
+        return str(data)
+    return resp.text[:400]
+
+
+def _retry_after(resp: requests.Response) -> Optional[int]:
+    value = resp.headers.get("Retry-After", "")
+    return int(value) if value.isdigit() else None
+
+
+def iter_sse(chunks: Iterator[bytes]) -> Iterator[Tuple[str, dict, Optional[str]]]:
+    """Parse a byte stream of SSE frames into (event, data, id) triples."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buffer = ""
+    for chunk in chunks:
+        buffer += decoder.decode(chunk).replace("\r\n", "\n")
+        *frames, buffer = buffer.split("\n\n")
+        for raw in frames:
+            parsed = _parse_frame(raw)
+            if parsed is not None:
+                yield parsed
+    buffer += decoder.decode(b"", final=True)
+    parsed = _parse_frame(buffer)
+    if parsed is not None:
+        yield parsed
+
+
+def _parse_frame(raw: str) -> Optional[Tuple[str, dict, Optional[str]]]:
+    event, data, event_id = "message", [], None
+    for line in raw.split("\n"):
+        if not line or line.startswith(":"):  # blank or heartbeat comment
+            continue
+        field, _, value = line.partition(":")
+        value = value[1:] if value.startswith(" ") else value
+        if field == "event":
+            event = value
+        elif field == "id":
+            event_id = value
+        elif field == "data":
+            data.append(value)
+    if not data:
+        return None
+    return event, json.loads("\n".join(data)), event_id
+
+
+def stream_text(
+    api_url: str,
+    payload: dict,
+    meta: Optional[dict] = None,
+    headers: Optional[dict] = None,
+) -> Iterator[str]:
+    """POST *payload* and yield the answer text as it streams in.
+
+    The Bedrock ``session_id``, the ``model`` a routing policy picked and the
+    final ``done`` event's citations are stored in *meta* if given. If the
+    connection drops mid-answer the request is re-sent with ``Last-Event-ID``
+    and the backend resumes the same answer.
+    """
+    meta = {} if meta is None else meta
+    last_event_id = None
+    attempts = 0
+    while True:
+        request_headers = dict(headers or {})
+        if last_event_id:
+            request_headers["Last-Event-ID"] = last_event_id
+        try:
+            with get_session().post(
+                api_url,
+                json=payload,
+                headers=request_headers,
+                stream=True,
+                timeout=(BACKEND_CONNECT_TIMEOUT, BACKEND_READ_TIMEOUT),
+            ) as resp:
+                if resp.status_code != 200:
+                    raise BackendError(
+                        resp.status_code, _error_detail(resp), _retry_after(resp)
+                    )
+                chunks = resp.iter_content(chunk_size=BACKEND_CHUNK_SIZE)
+                for event, data, event_id in iter_sse(chunks):
+                    if event_id:
+                        last_event_id = event_id
+                    if event == "text":
+                        yield data["text"]
+                    elif event == "session":
+                        meta["session_id"] = data["session_id"]
+                    elif event == "model":
+                        meta["model"] = data["model"]
+                    elif event == "done":
+                        meta["citations"] = data.get("citations", [])
+                        return
+                    elif event == "error":
+                        raise BackendError(resp.status_code, data.get("detail", ""))
+                # Closed without a done event: treat like a dropped connection
+                raise requests.exceptions.ChunkedEncodingError("Stream ended early")
+        except (
+            requests.exceptions.ChunkedEncodingError,
+            requests.exceptions.ConnectionError,
+        ):
+            attempts += 1
+            if last_event_id is None or attempts > BACKEND_RESUME_ATTEMPTS:
+                raise
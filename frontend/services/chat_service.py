@@ -1,17 +1,44 @@
+import hashlib
 import uuid
 
 import streamlit as st
 
-from config import SERVER_CONFIG
+from config import BACKEND_URL, SERVER_CONFIG
+from services.backend_client import forget_chat
+from services.chat_store import DEFAULT_CHAT_NAME, ChatStore, make_chat_store
+
+HISTORY_PAGE_SIZE = 50
+SEARCH_PAGE_SIZE = 20
+
+
+def content_hash(content: str) -> str:
+    return hashlib.blake2b(content.encode(), digest_size=8).hexdigest()
+
+
+@st.cache_resource
+def get_chat_store() -> ChatStore:
+    """One chat store per Streamlit process, shared by all sessions."""
+    return make_chat_store()
+
+
+def get_user_id() -> str:
+    """Identify the browser user; kept in the URL so reloads keep history."""
+    user_id = st.query_params.get("user")
+    if not user_id:
+        user_id = str(uuid.uuid4())
+        st.query_params["user"] = user_id
+    return user_id
 
 
 # Session state initialization
 def init_session():
     defaults = {
         "params": {},
+        "user_id": get_user_id(),
         "current_chat_id": None,
         "current_chat_index": 0,
-        "history_chats": get_history(),
+        "history_page": 0,
+        "search_page": 0,
         "messages": [],
         "client": None,
         "agent": None,
@@ -24,49 +51,72 @@ def init_session():
         if key not in st.session_state:
             st.session_state[key] = val
 
+    if st.session_state["current_chat_id"] is None:
+        get_history()
+
 
-def get_history():
-    if "history_chats" in st.session_state and st.session_state["history_chats"]:
-        return st.session_state["history_chats"]
-    else:
-        chat_id = str(uuid.uuid4())
-        new_chat = {"chat_id": chat_id, "chat_name": "New chat", "messages": []}
+def get_history(offset: int = 0, limit: int = HISTORY_PAGE_SIZE):
+    """Return a page of the user's chats, newest first, creating one if empty."""
+    store = get_chat_store()
+    user_id = st.session_state["user_id"]
+    chats = store.list_chats(user_id, offset, limit)
+    if not chats and offset == 0:
+        chats = [store.create_chat(user_id)]
+    if st.session_state.get("current_chat_id") is None:
         st.session_state["current_chat_index"] = 0
-        st.session_state["current_chat_id"] = chat_id
-    return [new_chat]
+        st.session_state["current_chat_id"] = chats[0]["chat_id"]
+    return chats
 
 
-def get_current_chat(chat_id):
+def count_history() -> int:
+    return get_chat_store().count_chats(st.session_state["user_id"])
+
+
+def search_history(query: str, offset: int = 0, limit: int = SEARCH_PAGE_SIZE):
+    """The user's chats matching *query*, best match first."""
+    return get_chat_store().search(st.session_state["user_id"], query, offset, limit)
+
+
+def get_current_chat(chat_id, offset: int = 0, limit=None):
     """Get messages for the current chat."""
-    for chat in st.session_state["history_chats"]:
-        if chat["chat_id"] == chat_id:
-            return chat["messages"]
-    return []
+    return get_chat_store().load_messages(chat_id, offset, limit)
 
 
 def _append_message_to_session(msg: dict) -> None:
     """
     Append *msg* to the current chat’s message list **and**
-    keep history_chats in-sync.
+    persist it in the chat store.
     """
+    store = get_chat_store()
     chat_id = st.session_state["current_chat_id"]
+    # id and hash let the renderer memoize finished messages
+    msg.setdefault("id", str(uuid.uuid4()))
+    msg.setdefault("hash", content_hash(msg.get("content") or ""))
     st.session_state["messages"].append(msg)
-    for chat in st.session_state["history_chats"]:
-        if chat["chat_id"] == chat_id:
-            chat["messages"] = st.session_state["messages"]  # same list
-            if chat["chat_name"] == "New chat":  # rename once
-                chat["chat_name"] = " ".join(msg["content"].split()[:5]) or "Empty"
-            break
+    store.append_message(chat_id, msg)
+    chat = store.get_chat(chat_id)
+    if chat and chat["chat_name"] == DEFAULT_CHAT_NAME:  # rename once
+        store.rename_chat(chat_id, " ".join(msg["content"].split()[:5]) or "Empty")
+
+
+def get_chat_session_id():
+    """Bedrock session of the current chat, sent so follow-ups keep context."""
+    chat = get_chat_store().get_chat(st.session_state["current_chat_id"])
+    return chat["session_id"] if chat else None
+
+
+def set_chat_session_id(session_id: str) -> None:
+    get_chat_store().set_session_id(st.session_state["current_chat_id"], session_id)
 
 
 def create_chat():
     """Create a new chat session."""
-    chat_id = str(uuid.uuid4())
-    new_chat = {"chat_id": chat_id, "chat_name": "New chat", "messages": []}
+    new_chat = get_chat_store().create_chat(st.session_state["user_id"])
 
-    st.session_state["history_chats"].append(new_chat)
     st.session_state["current_chat_index"] = 0
-    st.session_state["current_chat_id"] = chat_id
+    st.session_state["current_chat_id"] = new_chat["chat_id"]
+    st.session_state["history_page"] = 0
+    st.session_state["messages"] = []
     return new_chat
 
 
@@ -75,19 +125,14 @@ def delete_chat(chat_id: str):
     if not chat_id:  # protection against accidental call
         return
 
-    # 1) Remove from session_state.history_chats
-    st.session_state["history_chats"] = [
-        c for c in st.session_state["history_chats"] if c["chat_id"] != chat_id
-    ]
+    # 1) Remove from the chat store and the backend's conversation memory
+    get_chat_store().delete_chat(chat_id)
+    forget_chat(BACKEND_URL, chat_id, st.session_state["user_id"])
 
     # 2) Switch current_chat to another one or create new
     if st.session_state["current_chat_id"] == chat_id:
-        if st.session_state["history_chats"]:  # if chats still exist
-            first = st.session_state["history_chats"][0]
-            st.session_state["current_chat_id"] = first["chat_id"]
-            st.session_state["current_chat_index"] = 0
-            st.session_state["messages"] = first["messages"]
-        else:  # if all deleted → new empty
-            new_chat = create_chat()
-            st.session_state["messages"] = new_chat["messages"]
+        st.session_state["current_chat_id"] = None
+        st.session_state["history_page"] = 0
+        first = get_history(limit=1)[0]  # newest remaining or a new empty chat
+        st.session_state["messages"] = get_current_chat(first["chat_id"])
     return
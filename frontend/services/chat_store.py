@@ -0,0 +1,459 @@
+"""Chat history storage shared by every Streamlit session.
+
+Two backends implement the same ``ChatStore`` interface:
+
+* ``MemoryChatStore`` keeps chats in a dict indexed by ``chat_id``; it is
+  fast but lost when the Streamlit process restarts.
+* ``SQLiteChatStore`` persists chats and messages in SQLite (WAL mode) with
+  indexes by user and by chat, so history survives restarts and message
+  pages are read on demand instead of being held in memory.
+
+Appends are O(1) in both backends and listings are paginated.
+
+``search`` finds a user's chats by the text of their messages. The SQLite
+store keeps an FTS5 index of message text, updated as each message is
+appended, and ranks chats by the BM25 score of their best message. Each
+row also carries a token standing for its user, so a search only reads
+that user's rows. Ranking is limited to the user's SEARCH_MAX_RANKED most
+recent matching messages; a word found in nearly every message would
+otherwise have to be scored everywhere. Existing databases are indexed
+once, on first open. The memory store scans the user's messages instead.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+CHAT_STORE_BACKEND = os.getenv("CHAT_STORE_BACKEND", "sqlite")
+CHAT_STORE_PATH = os.getenv("CHAT_STORE_PATH", os.path.join(".", "chats.db"))
+
+DEFAULT_CHAT_NAME = "New chat"
+# Words of context around a search match
+SNIPPET_WORDS = 10
+# Most recent matching messages ranked per search
+SEARCH_MAX_RANKED = int(os.getenv("SEARCH_MAX_RANKED", "2000"))
+
+_WORD = re.compile(r"\w+")
+
+
+def search_terms(query: str) -> List[str]:
+    """Words of a search query; each matches words that start with it."""
+    return _WORD.findall(query.casefold())
+
+
+def _owner_token(user_id: str) -> str:
+    # One alphanumeric token, so the tokenizer keeps it whole
+    return "u" + hashlib.blake2b(user_id.encode(), digest_size=8).hexdigest()
+
+
+def _message_text(msg: dict) -> Optional[str]:
+    content = msg.get("content")
+    return content if isinstance(content, str) and content else None
+
+
+class ChatStore(ABC):
+    @abstractmethod
+    def create_chat(self, user_id: str, chat_name: str = DEFAULT_CHAT_NAME) -> dict:
+        """Create an empty chat and return its metadata."""
+
+    @abstractmethod
+    def get_chat(self, chat_id: str) -> Optional[dict]:
+        """Return chat metadata (without messages) or None."""
+
+    @abstractmethod
+    def rename_chat(self, chat_id: str, chat_name: str) -> None: ...
+
+    @abstractmethod
+    def delete_chat(self, chat_id: str) -> None: ...
+
+    @abstractmethod
+    def set_session_id(self, chat_id: str, session_id: str) -> None:
+        """Remember the backend (Bedrock) session continuing this chat."""
+
+    @abstractmethod
+    def append_message(self, chat_id: str, msg: dict) -> None: ...
+
+    @abstractmethod
+    def count_messages(self, chat_id: str) -> int: ...
+
+    @abstractmethod
+    def load_messages(
+        self, chat_id: str, offset: int = 0, limit: Optional[int] = None
+    ) -> List[dict]:
+        """Return messages ``offset .. offset + limit`` in conversation order."""
+
+    @abstractmethod
+    def list_chats(self, user_id: str, offset: int = 0, limit: int = 50) -> List[dict]:
+        """Return chat metadata for *user_id*, newest first."""
+
+    @abstractmethod
+    def count_chats(self, user_id: str) -> int: ...
+
+    @abstractmethod
+    def search(
+        self, user_id: str, query: str, offset: int = 0, limit: int = 20
+    ) -> List[dict]:
+        """Chats of *user_id* whose messages contain every word of *query*.
+
+        Best match first, one hit per chat: ``chat_id``, ``chat_name``, the
+        ``seq`` of the best matching message and a ``snippet`` of it.
+        """
+
+    def load_recent_messages(self, chat_id: str, limit: int) -> List[dict]:
+        total = self.count_messages(chat_id)
+        return self.load_messages(chat_id, max(0, total - limit), limit)
+
+
+class MemoryChatStore(ChatStore):
+    def __init__(self):
+        self._chats: Dict[str, dict] = {}
+        # user_id -> {chat_id: None}, kept in creation order
+        self._by_user: Dict[str, Dict[str, None]] = {}
+        self._lock = threading.Lock()
+
+    def create_chat(self, user_id, chat_name=DEFAULT_CHAT_NAME):
+        chat = {
+            "chat_id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "chat_name": chat_name,
+            "created_at": time.time(),
+            "session_id": None,
+            "messages": [],
+        }
+        with self._lock:
+            self._chats[chat["chat_id"]] = chat
+            self._by_user.setdefault(user_id, {})[chat["chat_id"]] = None
+        return self._meta(chat)
+
+    @staticmethod
+    def _meta(chat: dict) -> dict:
+        return {k: v for k, v in chat.items() if k != "messages"}
+
+    def get_chat(self, chat_id):
+        chat = self._chats.get(chat_id)
+        return self._meta(chat) if chat else None
+
+    def rename_chat(self, chat_id, chat_name):
+        chat = self._chats.get(chat_id)
+        if chat:
+            chat["chat_name"] = chat_name
+
+    def set_session_id(self, chat_id, session_id):
+        chat = self._chats.get(chat_id)
+        if chat:
+            chat["session_id"] = session_id
+
+    def delete_chat(self, chat_id):
+        with self._lock:
+            chat = self._chats.pop(chat_id, None)
+            if chat:
+                self._by_user.get(chat["user_id"], {}).pop(chat_id, None)
+
+    def append_message(self, chat_id, msg):
+        chat = self._chats.get(chat_id)
+        if chat is not None:
+            chat["messages"].append(msg)
+
+    def count_messages(self, chat_id):
+        chat = self._chats.get(chat_id)
+        return len(chat["messages"]) if chat else 0
+
+    def load_messages(self, chat_id, offset=0, limit=None):
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            return []
+        end = None if limit is None else offset + limit
+        return chat["messages"][offset:end]
+
+    def list_chats(self, user_id, offset=0, limit=50):
+        chat_ids = list(self._by_user.get(user_id, {}))
+        page = chat_ids[::-1][offset : offset + limit]
+        return [self._meta(self._chats[chat_id]) for chat_id in page]
+
+    def count_chats(self, user_id):
+        return len(self._by_user.get(user_id, {}))
+
+    def search(self, user_id, query, offset=0, limit=20):
+        terms = search_terms(query)
+        if not terms:
+            return []
+        hits: List[Tuple[int, int, dict]] = []
+        chat_ids = list(self._by_user.get(user_id, {}))[::-1]
+        for age, chat_id in enumerate(chat_ids):
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                continue
+            best = None
+            for seq, msg in enumerate(list(chat["messages"])):
+                text = _message_text(msg)
+                if text is None:
+                    continue
+                words = search_terms(text)
+                score = sum(
+                    1 for word in words for term in terms if word.startswith(term)
+                )
+                matched = all(any(w.startswith(t) for w in words) for t in terms)
+                if matched and (best is None or score > best[0]):
+                    best = (score, seq, text)
+            if best is not None:
+                score, seq, text = best
+                hit = {
+                    "chat_id": chat_id,
+                    "chat_name": chat["chat_name"],
+                    "seq": seq,
+                    "snippet": _snippet(text, terms),
+                }
+                hits.append((-score, age, hit))
+        hits.sort(key=lambda item: item[:2])
+        return [hit for _, _, hit in hits[offset : offset + limit]]
+
+
+def _snippet(text: str, terms: List[str]) -> str:
+    words = text.split()
+    first = next(
+        (
+            n
+            for n, word in enumerate(words)
+            if any(w.startswith(t) for w in search_terms(word) for t in terms)
+        ),
+        0,
+    )
+    start = max(0, first - SNIPPET_WORDS // 2)
+    end = start + SNIPPET_WORDS
+    return (
+        ("… " if start else "")
+        + " ".join(words[start:end])
+        + (" …" if end < len(words) else "")
+    )
+
+
+class SQLiteChatStore(ChatStore):
+    def __init__(self, path: str = CHAT_STORE_PATH):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS chats (
+                    chat_id TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    chat_name TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    session_id TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_chats_user
+                    ON chats (user_id, created_at);
+                CREATE TABLE IF NOT EXISTS messages (
+                    chat_id TEXT NOT NULL
+                        REFERENCES chats (chat_id) ON DELETE CASCADE,
+                    seq INTEGER NOT NULL,
+                    body TEXT NOT NULL,
+                    PRIMARY KEY (chat_id, seq)
+                );
+                """
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(chats)")}
+            if "session_id" not in columns:  # databases created before sessions
+                self._conn.execute("ALTER TABLE chats ADD COLUMN session_id TEXT")
+            indexed = self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'"
+            ).fetchone()
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 ("
+                "content, owner, chat_id UNINDEXED, seq UNINDEXED, "
+                "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+            )
+            if not indexed:  # databases created before search
+                rows = self._conn.execute(
+                    "SELECT json_extract(m.body, '$.content'), c.user_id, "
+                    "m.chat_id, m.seq FROM messages m "
+                    "JOIN chats c ON c.chat_id = m.chat_id "
+                    "WHERE json_type(m.body, '$.content') = 'text'"
+                )
+                self._conn.executemany(
+                    "INSERT INTO messages_fts (content, owner, chat_id, seq) "
+                    "VALUES (?, ?, ?, ?)",
+                    (
+                        (text, _owner_token(user_id), chat_id, seq)
+                        for text, user_id, chat_id, seq in rows
+                    ),
+                )
+
+    def create_chat(self, user_id, chat_name=DEFAULT_CHAT_NAME):
+        chat = {
+            "chat_id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "chat_name": chat_name,
+            "created_at": time.time(),
+            "session_id": None,
+        }
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO chats (chat_id, user_id, chat_name, created_at) "
+                "VALUES (:chat_id, :user_id, :chat_name, :created_at)",
+                chat,
+            )
+        return chat
+
+    def get_chat(self, chat_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM chats WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def rename_chat(self, chat_id, chat_name):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE chats SET chat_name = ? WHERE chat_id = ?",
+                (chat_name, chat_id),
+            )
+
+    def set_session_id(self, chat_id, session_id):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE chats SET session_id = ? WHERE chat_id = ?",
+                (session_id, chat_id),
+            )
+
+    def delete_chat(self, chat_id):
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT user_id FROM chats WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+            if row is None:
+                return
+            self._conn.execute("DELETE FROM chats WHERE chat_id = ?", (chat_id,))
+            # Only the owner's rows are read, not the whole index
+            self._conn.execute(
+                "DELETE FROM messages_fts WHERE rowid IN (SELECT rowid FROM "
+                "messages_fts WHERE messages_fts MATCH ? AND chat_id = ?)",
+                (_owner_match(row["user_id"]), chat_id),
+            )
+
+    def append_message(self, chat_id, msg):
+        text = _message_text(msg)
+        with self._lock, self._conn:
+            # MAX(seq) is answered from the primary-key index
+            cursor = self._conn.execute(
+                "INSERT INTO messages (chat_id, seq, body) VALUES "
+                "(?, (SELECT COALESCE(MAX(seq), -1) + 1 FROM messages "
+                "WHERE chat_id = ?), ?)",
+                (chat_id, chat_id, json.dumps(msg)),
+            )
+            if text is not None:
+                self._conn.execute(
+                    "INSERT INTO messages_fts (content, owner, chat_id, seq) "
+                    "SELECT ?, ?, m.chat_id, m.seq FROM messages m "
+                    "WHERE m.rowid = ?",
+                    (text, _owner_token(self._user_of(chat_id)), cursor.lastrowid),
+                )
+
+    def _user_of(self, chat_id: str) -> str:
+        row = self._conn.execute(
+            "SELECT user_id FROM chats WHERE chat_id = ?", (chat_id,)
+        ).fetchone()
+        return row["user_id"] if row else ""
+
+    def count_messages(self, chat_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COALESCE(MAX(seq), -1) + 1 FROM messages WHERE chat_id = ?",
+                (chat_id,),
+            ).fetchone()
+        return row[0]
+
+    def load_messages(self, chat_id, offset=0, limit=None):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT body FROM messages WHERE chat_id = ? AND seq >= ? "
+                "ORDER BY seq LIMIT ?",
+                (chat_id, offset, -1 if limit is None else limit),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def list_chats(self, user_id, offset=0, limit=50):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM chats WHERE user_id = ? "
+                "ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                (user_id, limit, offset),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def count_chats(self, user_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM chats WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return row[0]
+
+    def search(self, user_id, query, offset=0, limit=20):
+        terms = search_terms(query)
+        if not terms:
+            return []
+        # Quoted prefix terms, so user input is never read as FTS5 syntax
+        words = " ".join(f'"{term}"*' for term in terms)
+        match = f"{_owner_match(user_id)} AND content : ({words})"
+        with self._lock:
+            # Rowids grow with time, so the inner query reads the newest
+            # matches only. With MIN(), SQLite takes the other columns from
+            # each chat's best row.
+            rows = self._conn.execute(
+                "SELECT chat_id, seq, hit, MIN(score) AS score FROM ("
+                "SELECT chat_id, seq, rowid AS hit, rank AS score "
+                "FROM messages_fts WHERE messages_fts MATCH ? "
+                "ORDER BY rowid DESC LIMIT ?) "
+                "GROUP BY chat_id ORDER BY score, hit DESC LIMIT ? OFFSET ?",
+                (match, SEARCH_MAX_RANKED, limit, offset),
+            ).fetchall()
+            if not rows:
+                return []
+            marks = ",".join("?" * len(rows))
+            # Names and snippets only for the page, not for every match
+            names = dict(
+                self._conn.execute(
+                    f"SELECT chat_id, chat_name FROM chats WHERE chat_id IN ({marks})",
+                    [row["chat_id"] for row in rows],
+                ).fetchall()
+            )
+            # By rowid, without MATCH: snippet() would read every match again
+            texts = dict(
+                self._conn.execute(
+                    f"SELECT rowid, content FROM messages_fts WHERE rowid IN ({marks})",
+                    [row["hit"] for row in rows],
+                ).fetchall()
+            )
+        return [
+            {
+                "chat_id": row["chat_id"],
+                "chat_name": names.get(row["chat_id"], ""),
+                "seq": row["seq"],
+                "snippet": _snippet(texts.get(row["hit"], ""), terms),
+            }
+            for row in rows
+            if row["chat_id"] in names
+        ]
+
+
+def _owner_match(user_id: str) -> str:
+    return f'owner : "{_owner_token(user_id)}"'
+
+
+def make_chat_store(backend: str = CHAT_STORE_BACKEND) -> ChatStore:
+    if backend == "memory":
+        return MemoryChatStore()
+    if backend == "sqlite":
+        return SQLiteChatStore()
+    raise ValueError(f"Unknown chat store backend: {backend}")
@@ -0,0 +1,184 @@
+"""Run tools from the configured MCP servers.
+
+``ToolEngine`` connects to every server in ``SERVER_CONFIG["mcpServers"]``
+at once and keeps one client session per server open until it is closed.
+A Streamlit rerun therefore reuses the sessions instead of reconnecting. A
+server that cannot be reached within MCP_CONNECT_TIMEOUT is listed in
+``errors`` and the other servers are still used.
+
+The tool calls of one turn run concurrently. Each call has its own timeout:
+a server's ``tool_timeouts`` entry for that tool, else the server's
+``tool_timeout``, else MCP_TOOL_TIMEOUT. Every call, including failed or
+timed-out ones, produces an execution record with its start time and
+duration, so slow tools show up in the execution history.
+
+Tool parameter lists are parsed once per server, tool and server version
+(see ``utils.tool_schema_parser.cached_tool_parameters``), not on every
+render.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.tools import BaseTool
+from langchain_mcp_adapters.sessions import create_session
+from langchain_mcp_adapters.tools import load_mcp_tools
+
+from utils.tool_schema_parser import cached_tool_parameters
+
+MCP_CONNECT_TIMEOUT = float(os.getenv("MCP_CONNECT_TIMEOUT", "15"))
+MCP_TOOL_TIMEOUT = float(os.getenv("MCP_TOOL_TIMEOUT", "30"))
+
+# Server config keys read by the engine, not passed to the MCP transport
+ENGINE_KEYS = ("tool_timeout", "tool_timeouts")
+
+logger = logging.getLogger(__name__)
+
+
+class ToolCall:
+    __slots__ = ("name", "args", "id")
+
+    def __init__(self, name: str, args: Dict[str, Any], id: Optional[str] = None):
+        self.name = name
+        self.args = args
+        self.id = id
+
+
+class ToolEngine:
+    def __init__(self, servers: Dict[str, dict]):
+        self.servers = servers
+        # tool name -> (server, tool); the first server to offer a name wins
+        self._tools: Dict[str, Tuple[str, BaseTool]] = {}
+        self._parameters: Dict[str, List[str]] = {}
+        self.errors: Dict[str, str] = {}
+        self.server_versions: Dict[str, str] = {}
+        self._closing: Optional[asyncio.Event] = None
+        self._holders: Dict[str, asyncio.Task] = {}
+
+    async def __aenter__(self) -> "ToolEngine":
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    @property
+    def tools(self) -> List[BaseTool]:
+        return [tool for _, tool in self._tools.values()]
+
+    @property
+    def connected(self) -> List[str]:
+        return list(self.server_versions)
+
+    async def connect(self) -> None:
+        """Open a session to every server concurrently; failures are recorded."""
+        self._closing = asyncio.Event()
+        ready = {
+            name: asyncio.get_running_loop().create_future() for name in self.servers
+        }
+        self._holders = {
+            name: asyncio.create_task(self._hold(name, config, ready[name]))
+            for name, config in self.servers.items()
+        }
+        waits = [asyncio.wait_for(f, MCP_CONNECT_TIMEOUT) for f in ready.values()]
+        results = await asyncio.gather(*waits, return_exceptions=True)
+        for name, result in zip(ready, results):
+            if isinstance(result, BaseException):
+                self.errors[name] = _reason(result)
+                logger.warning("MCP server %s unavailable: %s", name, result)
+                self._holders.pop(name).cancel()
+                continue
+            version, tools = result
+            self.server_versions[name] = version
+            for tool in tools:
+                if tool.name in self._tools:
+                    logger.warning("Tool %s of %s is shadowed", tool.name, name)
+                    continue
+                self._tools[tool.name] = (name, tool)
+                self._parameters[tool.name] = cached_tool_parameters(
+                    tool, name, version
+                )
+
+    async def _hold(self, name: str, config: dict, ready: asyncio.Future) -> None:
+        """Keep one server's session open until the engine closes.
+
+        The MCP transports run in anyio task groups, which must be left by
+        the task that entered them, so each session lives in its own task.
+        """
+        connection = {k: v for k, v in config.items() if k not in ENGINE_KEYS}
+        try:
+            async with create_session(connection) as session:
+                initialized = await session.initialize()
+                tools = await load_mcp_tools(session)
+                if not ready.done():
+                    ready.set_result((initialized.serverInfo.version, tools))
+                await self._closing.wait()
+        except Exception as exc:
+            if not ready.done():
+                ready.set_exception(exc)
+            else:
+                logger.warning("MCP server %s disconnected: %s", name, exc)
+
+    def parameters(self, tool_name: str) -> List[str]:
+        return self._parameters.get(tool_name, [])
+
+    def _timeout(self, server: str, tool_name: str) -> float:
+        config = self.servers.get(server, {})
+        per_tool = config.get("tool_timeouts") or {}
+        default = config.get("tool_timeout", MCP_TOOL_TIMEOUT)
+        return float(per_tool.get(tool_name, default))
+
+    async def execute(self, calls: List[ToolCall]) -> List[Dict[str, Any]]:
+        """Run independent *calls* concurrently; one record per call, in order."""
+        return list(await asyncio.gather(*(self._execute(call) for call in calls)))
+
+    async def _execute(self, call: ToolCall) -> Dict[str, Any]:
+        server, tool = self._tools.get(call.name, (None, None))
+        record: Dict[str, Any] = {
+            "tool_name": call.name,
+            "call_id": call.id,
+            "server": server,
+            "input": call.args,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+        }
+        started = time.perf_counter()
+        if tool is None:
+            record.update(status="error", output=f"Unknown tool {call.name!r}")
+        else:
+            timeout = self._timeout(server, call.name)
+            try:
+                output = await asyncio.wait_for(tool.ainvoke(call.args), timeout)
+                record.update(status="ok", output=_as_text(output))
+            except asyncio.TimeoutError:
+                record.update(status="timeout", output=f"No result after {timeout} s")
+            except Exception as exc:
+                record.update(status="error", output=str(exc))
+        record["duration"] = round(time.perf_counter() - started, 3)
+        return record
+
+    async def close(self) -> None:
+        if self._closing is not None:
+            self._closing.set()
+        await asyncio.gather(*self._holders.values(), return_exceptions=True)
+        self._holders = {}
+        self._tools.clear()
+        self._parameters.clear()
+        self.server_versions.clear()
+
+
+def _reason(exc: BaseException) -> str:
+    # Transport errors arrive wrapped in anyio's exception groups
+    while isinstance(exc, BaseExceptionGroup) and exc.exceptions:
+        exc = exc.exceptions[0]
+    return f"{type(exc).__name__}: {exc}" if str(exc) else type(exc).__name__
+
+
+def _as_text(output: Any) -> str:
+    if isinstance(output, str):
+        return output
+    return json.dumps(output, ensure_ascii=False, default=str)
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+from typing import ClassVar
+
+import pytest
+
+from utils.background_loop import BackgroundLoop, ResourcePool
+
+
+class FakeResource:
+    """Async context manager that takes a moment to connect."""
+
+    instances: ClassVar[list] = []
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.entered = 0
+        self.exited = 0
+        FakeResource.instances.append(self)
+
+    async def __aenter__(self):
+        await asyncio.sleep(0.05)
+        if self.fail:
+            raise ConnectionError("server down")
+        self.entered += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self.exited += 1
+
+
+@pytest.fixture
+def loop():
+    FakeResource.instances.clear()
+    loop = BackgroundLoop(name="test-loop")
+    yield loop
+    loop.stop()
+
+
+def test_many_sessions_share_one_resource(loop):
+    pool = ResourcePool()
+    threads = 32
+    acquired = threading.Barrier(threads)
+    got = []
+
+    def session(n):
+        owner = f"session-{n}"
+        got.append(loop.run(pool.acquire("server", FakeResource, owner), timeout=5))
+        # Everyone holds a reference before anyone lets go
+        acquired.wait(timeout=5)
+        loop.run(pool.release("server", owner), timeout=5)
+
+    workers = [threading.Thread(target=session, args=(n,)) for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=10)
+
+    assert len(got) == threads
+    (resource,) = FakeResource.instances
+    assert all(item is resource for item in got)
+    assert (resource.entered, resource.exited) == (1, 1)
+    assert pool.stats() == {"resources": 0, "references": 0, "opened": 1, "closed": 1}
+
+
+def test_resource_stays_open_until_the_last_owner_releases(loop):
+    pool = ResourcePool()
+    loop.run(pool.acquire("server", FakeResource, "a"))
+    # A second acquire by the same owner adds no reference
+    loop.run(pool.acquire("server", FakeResource, "a"))
+    loop.run(pool.acquire("server", FakeResource, "b"))
+    assert pool.stats()["references"] == 2
+
+    loop.run(pool.release_owner("a"))
+    assert FakeResource.instances[0].exited == 0
+    loop.run(pool.release("server", "b"))
+    assert FakeResource.instances[0].exited == 1
+
+
+def test_failed_open_reaches_every_waiter_and_is_retried(loop):
+    pool = ResourcePool()
+
+    def broken():
+        return FakeResource(fail=True)
+
+    async def both():
+        return await asyncio.gather(
+            pool.acquire("server", broken, "a"),
+            pool.acquire("server", broken, "b"),
+            return_exceptions=True,
+        )
+
+    results = loop.run(both())
+    assert all(isinstance(result, ConnectionError) for result in results)
+    assert len(FakeResource.instances) == 1
+    assert pool.stats()["resources"] == 0
+
+    resource = loop.run(pool.acquire("server", FakeResource, "a"))
+    assert resource.entered == 1
+
+
+def test_run_refuses_to_block_the_loop_thread(loop):
+    async def noop():
+        pass
+
+    async def nested():
+        work = noop()
+        try:
+            loop.run(work)
+        finally:
+            work.close()
+
+    with pytest.raises(RuntimeError, match="deadlock"):
+        loop.run(nested())
@@ -0,0 +1,23 @@
+import pytest
+
+from ui_components.message_renderer import escape_prices
+
+
+@pytest.mark.parametrize(
+    "content, escaped",
+    [
+        ("Plans cost $5 and $10.", "Plans cost \\$5 and \\$10."),
+        ("Display $$5x$$ math", "Display $$5x$$ math"),
+        ("Already \\$5", "Already \\$5"),
+        ("Euler: $e^{i\\pi} = -1$", "Euler: $e^{i\\pi} = -1$"),
+        ("Use `echo $5` here, $5 there", "Use `echo $5` here, \\$5 there"),
+        (
+            "```bash\nprice=$5\n```\nIt is $5",
+            "```bash\nprice=$5\n```\nIt is \\$5",
+        ),
+        ("```\nunterminated $5", "```\nunterminated $5"),
+        ("No dollars here", "No dollars here"),
+    ],
+)
+def test_escape_prices(content, escaped):
+    assert escape_prices(content) == escaped
@@ -12,4 +12,20 @@ def display_tool_executions():
                 st.markdown(f"**Input:** ```json{json.dumps(exec_record['input'])}```")
                 st.markdown(f"**Output:** ```{exec_record['output'][:250]}...```")
                 st.markdown(f"**Time:** {exec_record['timestamp']}")
+                if "duration" in exec_record:
+                    st.markdown(
+                        f"**Duration:** {exec_record['duration']} s "
+                        f"({exec_record['status']})"
+                    )
                 st.divider()
+            # Where tool latency goes, slowest tool first
+            totals = {}
+            for exec_record in st.session_state.tool_executions:
+                name = exec_record["tool_name"]
+                calls, seconds = totals.get(name, (0, 0.0))
+                totals[name] = (calls + 1, seconds + exec_record.get("duration", 0.0))
+            st.markdown("### Time per tool")
+            for name, (calls, seconds) in sorted(
+                totals.items(), key=lambda item: -item[1][1]
+            ):
+                st.markdown(f"`{name}`: {seconds:.2f} s over {calls} calls")
@@ -0,0 +1,108 @@
+import os
+import re
+import time
+from collections import deque
+from typing import Callable, Dict, List
+
+import streamlit as st
+
+from config import BACKEND_URL, MODEL_OPTIONS
+from services.backend_client import get_model_options
+from services.chat_service import get_chat_store
+
+# Messages shown on first render and added per "load earlier" click
+RENDER_WINDOW = int(os.getenv("RENDER_WINDOW", "20"))
+
+# Called once per rerun with the render statistics of the chat pane
+render_hooks: List[Callable[[Dict], None]] = []
+
+# Fenced code blocks and inline code spans, which markdown shows verbatim
+_CODE = re.compile(r"(```.*?(?:```|$)|~~~.*?(?:~~~|$)|`[^`\n]*`)", re.DOTALL)
+# A "$" followed by a digit starts a price, not LaTeX
+_PRICE_DOLLAR = re.compile(r"(?<![\\$])\$(?=\d)")
+
+
+def escape_prices(content: str) -> str:
+    """Escape the "$" of prices so Streamlit does not render "$5 and $10" as math.
+
+    Code and other "$" signs, such as intended LaTeX, are left as they are.
+    """
+    parts = _CODE.split(content)
+    # Odd parts are the code the pattern captured
+    for i in range(0, len(parts), 2):
+        parts[i] = _PRICE_DOLLAR.sub(r"\\$", parts[i])
+    return "".join(parts)
+
+
+def render_citations(citations: List[dict]) -> None:
+    with st.expander(f"Sources ({len(citations)})", expanded=False):
+        for i, citation in enumerate(citations, 1):
+            st.markdown(f"**[{i}]** {citation.get('uri') or 'knowledge base'}")
+            st.caption(citation.get("text", "")[:300])
+
+
+def render_model(model_id: str) -> None:
+    """Caption naming the model a routing policy picked."""
+    options = get_model_options(BACKEND_URL, MODEL_OPTIONS)
+    names = {v: k for k, v in options.items()}
+    st.caption(f"Answered by {names.get(model_id, model_id)}")
+
+
+def render_message(msg: dict) -> None:
+    """Render a message that is not part of the stored window (e.g. just sent)."""
+    if msg.get("tool"):
+        st.code(msg["tool"], language="yaml")
+    if msg.get("content"):
+        st.markdown(escape_prices(msg["content"]))
+    if msg.get("citations"):
+        render_citations(msg["citations"])
+    if msg.get("model"):
+        render_model(msg["model"])
+
+
+def render_chat_window(container, chat_id: str) -> List[dict]:
+    """Render the last messages of *chat_id* and return the rendered window."""
+    started = time.perf_counter()
+    if st.session_state.get("render_chat_id") != chat_id:
+        st.session_state["render_chat_id"] = chat_id
+        st.session_state["render_window"] = RENDER_WINDOW
+    window = st.session_state["render_window"]
+
+    store = get_chat_store()
+    total = store.count_messages(chat_id)
+    start = max(0, total - window)
+    if start and container.button(
+        f"Load earlier messages ({start} more)", key="load_earlier_messages"
+    ):
+        st.session_state["render_window"] = window + RENDER_WINDOW
+        st.rerun()
+
+    messages = store.load_messages(chat_id, start, window)
+    for m in messages:
+        with container.chat_message(m["role"]):
+            if m.get("tool"):
+                st.code(m["tool"], language="yaml")
+            if m.get("content"):
+                st.markdown(escape_prices(m["content"]))
+            if m.get("citations"):
+                render_citations(m["citations"])
+            if m.get("model"):
+                render_model(m["model"])
+
+    stats = {
+        "chat_id": chat_id,
+        "total_messages": total,
+        "rendered": len(messages),
+        "seconds": time.perf_counter() - started,
+    }
+    for hook in render_hooks:
+        hook(stats)
+    return messages
+
+
+def record_render_stats(stats: Dict) -> None:
+    """Default hook: keep the recent per-rerun costs in the session."""
+    st.session_state.setdefault("render_stats", deque(maxlen=100)).append(stats)
+
+
+render_hooks.append(record_render_stats)
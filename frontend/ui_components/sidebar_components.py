@@ -1,32 +1,86 @@
 
+import json
+import traceback
+
 import streamlit as st
 
-from config import MODEL_OPTIONS
-from services.chat_service import create_chat, delete_chat
-from utils.async_helpers import reset_connection_state
+from config import BACKEND_URL, MODEL_OPTIONS, PIPELINE_OPTIONS, ROUTING_OPTIONS
+from services.backend_client import get_model_options
+from services.chat_service import (
+    HISTORY_PAGE_SIZE,
+    SEARCH_PAGE_SIZE,
+    count_history,
+    create_chat,
+    delete_chat,
+    get_history,
+    search_history,
+)
+from utils.async_helpers import (
+    connect_to_mcp_servers,
+    reset_agent,
+    reset_connection_state,
+    run_tool,
+)
+
+
+# Generation parameters the sidebar starts at. They are only sent once
+# changed, so untouched requests keep the model's defaults and share the
+# backend's cached answers with everyone else.
+DEFAULT_MAX_TOKENS = 4096
+DEFAULT_TEMPERATURE = 1.0
+
+
+def _reset_search_page():
+    st.session_state["search_page"] = 0
 
 
 def create_history_chat_container():
+    query = st.sidebar.text_input(
+        "Search chats",
+        key="history_query",
+        placeholder="Search chats",
+        label_visibility="collapsed",
+        on_change=_reset_search_page,
+    )
+    if query.strip():
+        create_search_results_container(query)
+        return
+
+    page = st.session_state["history_page"]
+    chats = get_history(page * HISTORY_PAGE_SIZE, HISTORY_PAGE_SIZE)
     history_container = st.sidebar.container(height=200, border=None)
     with history_container:
-        chat_history_menu = [
-            f"{chat['chat_name']}_::_{chat['chat_id']}"
-            for chat in st.session_state["history_chats"]
-        ]
-        chat_history_menu = chat_history_menu[:50][::-1]
+        chat_names = {chat["chat_id"]: chat["chat_name"] for chat in chats}
+        chat_history_menu = list(chat_names)
 
         if chat_history_menu:
+            current_id = st.session_state["current_chat_id"]
+            index = None  # e.g. a chat opened from search on another page
+            if current_id in chat_names:
+                index = chat_history_menu.index(current_id)
+                st.session_state["current_chat_index"] = index
             current_chat = st.radio(
                 label="History Chats",
-                format_func=lambda x: x.split("_::_")[0] + "..." if "_::_" in x else x,
+                format_func=lambda x: chat_names[x] + "...",
                 options=chat_history_menu,
                 label_visibility="collapsed",
-                index=st.session_state["current_chat_index"],
-                key="current_chat",
+                index=index,
             )
 
             if current_chat:
-                st.session_state["current_chat_id"] = current_chat.split("_::_")[1]
+                st.session_state["current_chat_id"] = current_chat
+
+    pages = max(1, -(-count_history() // HISTORY_PAGE_SIZE))
+    if pages > 1:
+        with st.sidebar:
+            c1, c2, c3 = st.columns([1, 2, 1])
+            if c1.button("‹", disabled=page == 0, key="history_prev"):
+                st.session_state["history_page"] = page - 1
+                st.rerun()
+            c2.caption(f"Page {page + 1} of {pages}")
+            if c3.button("›", disabled=page + 1 >= pages, key="history_next"):
+                st.session_state["history_page"] = page + 1
+                st.rerun()
 
 
 def create_sidebar_chat_buttons():
@@ -49,28 +103,49 @@ def create_sidebar_chat_buttons():
 
 def create_model_select_widget():
     params = st.session_state["params"]
+    model_options = get_model_options(BACKEND_URL, MODEL_OPTIONS)
     params["model_id"] = st.sidebar.selectbox(
-        "🔎 Choose model", options=MODEL_OPTIONS.keys(), index=0
+        "🔎 Choose model", options=model_options.keys(), index=0
     )
 
 
 def create_provider_select_widget():
     params = st.session_state.setdefault("params", {})
+    # The backend may have reloaded a different model list since last run
+    model_options = get_model_options(BACKEND_URL, MODEL_OPTIONS)
+    names = list(model_options.keys())
     # Load previously selected provider or default to the first
-    default_provider = params.get("model_id", list(MODEL_OPTIONS.keys())[0])
-    default_index = list(MODEL_OPTIONS.keys()).index(default_provider)
+    default_provider = params.get("model_id", names[0])
+    default_index = names.index(default_provider) if default_provider in names else 0
     # Provider selector with synced state
     selected_provider = st.sidebar.selectbox(
         "🔎 Choose Model",
-        options=list(MODEL_OPTIONS.keys()),
+        options=names,
         index=default_index,
         key="provider_selection",
-        on_change=reset_connection_state,
+        on_change=reset_agent,
     )
     params["model_id"] = selected_provider
-    params["model_name"] = MODEL_OPTIONS[selected_provider]
+    params["model_name"] = model_options[selected_provider]
     # Save new provider and its index
-    params["provider_index"] = list(MODEL_OPTIONS.keys()).index(selected_provider)
+    params["provider_index"] = names.index(selected_provider)
+
+    routing = st.sidebar.selectbox(
+        "🔀 Model routing",
+        options=list(ROUTING_OPTIONS.keys()),
+        key="routing_selection",
+        help="Let the backend pick the model and fail over when it errors",
+    )
+    params["routing"] = ROUTING_OPTIONS[routing]
+
+    pipeline = st.sidebar.selectbox(
+        "🧩 Pipeline",
+        options=list(PIPELINE_OPTIONS.keys()),
+        key="pipeline_selection",
+        help="Cached retrieval skips the knowledge-base search for repeated "
+        "questions but does not keep Bedrock conversation context",
+    )
+    params["pipeline"] = PIPELINE_OPTIONS[pipeline]
 
 
 def create_advanced_configuration_widget():
@@ -80,71 +155,137 @@ def create_advanced_configuration_widget():
             "Max tokens",
             min_value=1024,
             max_value=10240,
-            value=4096,
+            value=DEFAULT_MAX_TOKENS,
             step=512,
+            help="Capped at what the chosen model can generate",
         )
-        params["temperature"] = st.slider("Temperature", 0.0, 1.0, step=0.05, value=1.0)
-
-
-# def create_mcp_connection_widget():
-#     with st.sidebar:
-#         st.subheader("Server Management")
-#         with st.expander(f"MCP Servers ({len(st.session_state.servers)})"):
-#             for name, config in st.session_state.servers.items():
-#                 with st.container(border=True):
-#                     st.markdown(f"**Server:** {name}")
-#                     st.markdown(f"**URL:** {config['url']}")
-#                     if st.button(f"Remove {name}", key=f"remove_{name}"):
-#                         del st.session_state.servers[name]
-#                         st.rerun()
-
-#         if st.session_state.get("agent"):
-#             st.success(f"📶 Connected to {len(st.session_state.servers)} MCP servers!"
-#                        f" Found {len(st.session_state.tools)} tools.")
-#             if st.button("Disconnect to MCP Servers"):
-#                 with st.spinner("Connecting to MCP servers..."):
-#                     try:
-#                         reset_connection_state()
-#                         st.rerun()
-#                     except Exception as e:
-#                         st.error(f"Error disconnecting to MCP servers: {str(e)}")
-#                         st.code(traceback.format_exc(), language="python")
-#         else:
-#             st.warning("⚠️ Not connected to MCP server")
-#             if st.button("Connect to MCP Servers"):
-#                 with st.spinner("Connecting to MCP servers..."):
-#                     try:
-#                         connect_to_mcp_servers()
-#                         st.rerun()
-#                     except Exception as e:
-#                         st.error(f"Error connecting to MCP servers: {str(e)}")
-#                         st.code(traceback.format_exc(), language="python")
-
-# def create_mcp_tools_widget():
-#     with st.sidebar:
-#         if st.session_state.tools:
-#             st.subheader("🧰 Available Tools")
-
-#             selected_tool_name = st.selectbox(
-#                 "Select a Tool",
-#                 options=[tool.name for tool in st.session_state.tools],
-#                 index=0
-#             )
-
-#             if selected_tool_name:
-#                 selected_tool = next(
-#                     (tool for tool in st.session_state.tools if tool.name == selected_tool_name),
-#                     None
-#                 )
-
-#                 if selected_tool:
-#                     with st.container():
-#                         st.write("**Description:**")
-#                         st.write(selected_tool.description)
-
-#                         parameters = extract_tool_parameters(selected_tool)
-
-#                         if parameters:
-#                             st.write("**Parameters:**")
-#                             for param in parameters:
-#                                 st.code(param)
+        params["temperature"] = st.slider(
+            "Temperature", 0.0, 1.0, step=0.05, value=DEFAULT_TEMPERATURE
+        )
+
+
+def inference_overrides(params) -> dict:
+    """/generate fields for the generation parameters the user changed."""
+    overrides = {}
+    max_tokens = params.get("max_tokens", DEFAULT_MAX_TOKENS)
+    if max_tokens != DEFAULT_MAX_TOKENS:
+        overrides["maxTokens"] = max_tokens
+    temperature = params.get("temperature", DEFAULT_TEMPERATURE)
+    if temperature != DEFAULT_TEMPERATURE:
+        overrides["temperature"] = temperature
+    return overrides
+
+
+def create_mcp_connection_widget():
+    servers = st.session_state.servers
+    if not servers:
+        return
+    # Connect once per session; the sessions then survive reruns
+    if st.session_state.client is None and not st.session_state.get("mcp_tried"):
+        st.session_state.mcp_tried = True
+        with st.spinner("Connecting to MCP servers..."):
+            connect_to_mcp_servers()
+
+    with st.sidebar:
+        st.subheader("Server Management")
+        engine = st.session_state.client
+        with st.expander(f"MCP Servers ({len(servers)})"):
+            for name, config in servers.items():
+                with st.container(border=True):
+                    st.markdown(f"**Server:** {name}")
+                    st.markdown(f"**URL:** {config.get('url', config.get('command'))}")
+                    if engine is not None and name in engine.errors:
+                        st.caption(f"⚠️ {engine.errors[name]}")
+
+        if engine is not None and engine.connected:
+            st.success(
+                f"📶 Connected to {len(engine.connected)} of {len(servers)} MCP "
+                f"servers. Found {len(st.session_state.tools)} tools."
+            )
+            if st.button("Disconnect from MCP Servers"):
+                reset_connection_state()
+                st.rerun()
+        else:
+            st.warning("⚠️ Not connected to MCP server")
+        if st.button("Reconnect to MCP Servers"):
+            with st.spinner("Connecting to MCP servers..."):
+                try:
+                    connect_to_mcp_servers()
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Error connecting to MCP servers: {str(e)}")
+                    st.code(traceback.format_exc(), language="python")
+
+
+def create_mcp_tools_widget():
+    engine = st.session_state.client
+    if engine is None or not st.session_state.tools:
+        return
+    with st.sidebar:
+        st.subheader("🧰 Available Tools")
+        selected_tool_name = st.selectbox(
+            "Select a Tool", options=[tool.name for tool in st.session_state.tools]
+        )
+        selected_tool = next(
+            (t for t in st.session_state.tools if t.name == selected_tool_name), None
+        )
+        if selected_tool is None:
+            return
+        st.write("**Description:**")
+        st.write(selected_tool.description)
+        # Parsed once per server version, not on every rerun
+        parameters = engine.parameters(selected_tool.name)
+        if parameters:
+            st.write("**Parameters:**")
+            for param in parameters:
+                st.code(param)
+        with st.form(f"run_{selected_tool.name}"):
+            raw_args = st.text_area("Arguments (JSON)", value="{}")
+            if st.form_submit_button("Run tool"):
+                try:
+                    args = json.loads(raw_args or "{}")
+                except ValueError as e:
+                    st.error(f"Arguments must be JSON: {e}")
+                else:
+                    record = run_tool(selected_tool.name, args)
+                    st.caption(f"{record['status']} in {record['duration']} s")
+
+
+def create_search_results_container(query: str):
+    """Chats matching *query* from the search index, a page at a time."""
+    page = st.session_state["search_page"]
+    # One extra hit tells whether there is a next page
+    hits = search_history(query, page * SEARCH_PAGE_SIZE, SEARCH_PAGE_SIZE + 1)
+    has_next = len(hits) > SEARCH_PAGE_SIZE
+    hits = hits[:SEARCH_PAGE_SIZE]
+    results_container = st.sidebar.container(height=200, border=None)
+    with results_container:
+        if not hits:
+            st.caption("No chats match.")
+        else:
+            labels = {
+                hit["chat_id"]: f"{hit['chat_name']} — {hit['snippet']}" for hit in hits
+            }
+            options = list(labels)
+            current_id = st.session_state["current_chat_id"]
+            selected = st.radio(
+                label="Search results",
+                format_func=labels.get,
+                options=options,
+                label_visibility="collapsed",
+                # Searching alone does not switch chats
+                index=options.index(current_id) if current_id in labels else None,
+            )
+            if selected and selected != current_id:
+                st.session_state["current_chat_id"] = selected
+
+    if page or has_next:
+        with st.sidebar:
+            c1, c2, c3 = st.columns([1, 2, 1])
+            if c1.button("‹", disabled=page == 0, key="search_prev"):
+                st.session_state["search_page"] = page - 1
+                st.rerun()
+            c2.caption(f"Results page {page + 1}")
+            if c3.button("›", disabled=not has_next, key="search_next"):
+                st.session_state["search_page"] = page + 1
+                st.rerun()
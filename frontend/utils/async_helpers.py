@@ -1,31 +1,93 @@
+import json
+import uuid
+import weakref
+
 import streamlit as st
 
+from services.tool_engine import ToolCall, ToolEngine
+from utils.background_loop import get_loop, loop_running, resources
+
 
 # Helper function for running async functions
-def run_async(coro):
-    """Run an async function within the stored event loop."""
-    return st.session_state.loop.run_until_complete(coro)
+def run_async(coro, timeout=None):
+    """Run *coro* on the shared background loop and wait for its result."""
+    return get_loop().run(coro, timeout)
+
+
+def submit_async(coro):
+    """Schedule *coro* on the shared loop; returns a concurrent Future."""
+    return get_loop().submit(coro)
+
+
+class _SessionHandle:
+    """Lives in a session's state; its finalizer releases the session's resources.
+
+    Streamlit has no session-end callback, but it drops a session's state
+    once the session is closed. The finalizer then runs and releases
+    everything the session held in the shared resource pool.
+    """
+
+    def __init__(self):
+        self.owner = str(uuid.uuid4())
+        # At interpreter exit background_loop.shutdown closes everything
+        weakref.finalize(self, _release_owner, self.owner).atexit = False
+
+
+def _release_owner(owner: str) -> None:
+    if loop_running():
+        submit_async(resources.release_owner(owner))
+
+
+def session_owner() -> str:
+    if "session_handle" not in st.session_state:
+        st.session_state.session_handle = _SessionHandle()
+    return st.session_state.session_handle.owner
+
+
+def connect_to_mcp_servers():
+    """Open sessions to all configured MCP servers; kept across reruns.
+
+    Sessions configured with the same servers share one engine.
+    """
+    reset_connection_state()
+    servers = st.session_state.servers
+    key = "mcp:" + json.dumps(servers, sort_keys=True)
+    engine = run_async(
+        resources.acquire(key, lambda: ToolEngine(servers), session_owner())
+    )
+    st.session_state.client = engine
+    st.session_state.client_key = key
+    st.session_state.tools = engine.tools
+    return engine
+
+
+def execute_tools(calls):
+    """Run a turn's tool calls concurrently and add them to the history."""
+    records = run_async(st.session_state.client.execute(calls))
+    st.session_state.tool_executions.extend(records)
+    return records
+
+
+def run_tool(name: str, args: dict):
+    return execute_tools([ToolCall(name, args)])[0]
+
+
+def reset_agent():
+    """Drop the model-specific agent; MCP sessions stay connected."""
+    st.session_state.agent = None
 
 
 def reset_connection_state():
     """Reset all connection-related session state variables."""
     if st.session_state.client is not None:
         try:
-            # Close the existing client properly
-            run_async(st.session_state.client.__aexit__(None, None, None))
+            # Closed once no other session uses it
+            run_async(
+                resources.release(st.session_state.client_key, session_owner())
+            )
         except Exception as e:
             st.error(f"Error closing previous client: {str(e)}")
 
     st.session_state.client = None
     st.session_state.agent = None
     st.session_state.tools = []
-
-
-def on_shutdown():
-    # Proper cleanup when the session ends
-    if st.session_state.client is not None:
-        try:
-            # Close the client properly
-            run_async(st.session_state.client.__aexit__(None, None, None))
-        except Exception as e:
-            st.error(f"Error during shutdown: {str(e)}")
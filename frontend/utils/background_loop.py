@@ -0,0 +1,162 @@
+"""One asyncio event loop per process, running in a background thread.
+
+Streamlit runs each session's script in its own thread. Instead of each
+session owning an event loop (and blocking its script thread on it with
+``run_until_complete``), all async work goes to this one loop. The loop
+keeps running between reruns, so long-lived connections such as MCP
+sessions stay serviced and the work of many sessions interleaves.
+
+``submit`` is thread-safe and returns a ``concurrent.futures.Future``.
+``run`` waits for the result.
+
+``ResourcePool`` shares async resources (anything with ``__aenter__`` and
+``__aexit__``, e.g. a ``ToolEngine``) between sessions. Resources are keyed
+by their configuration and reference-counted per owner. The last owner to
+release a resource closes it. All bookkeeping runs on the loop thread, so
+it needs no locks.
+"""
+
+import asyncio
+import atexit
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Coroutine, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundLoop:
+    def __init__(self, name: str = "frontend-async"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro: Coroutine) -> Future:
+        """Schedule *coro* on the loop from any thread."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """Run *coro* on the loop and block the calling thread for its result."""
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("run() would deadlock on the loop's own thread")
+        return self.submit(coro).result(timeout)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        if not self.loop.is_running():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+
+
+class _Shared:
+    __slots__ = ("opening", "owners")
+
+    def __init__(self, opening: asyncio.Task):
+        self.opening = opening
+        self.owners: Set[str] = set()
+
+
+class ResourcePool:
+    def __init__(self):
+        self._shared: Dict[str, _Shared] = {}
+        self.opened = 0
+        self.closed = 0
+
+    async def acquire(self, key: str, make: Callable[[], Any], owner: str) -> Any:
+        """The resource for *key*, entered on first use; *owner* holds a reference.
+
+        Acquiring a key the owner already holds returns the same resource
+        without adding another reference.
+        """
+        shared = self._shared.get(key)
+        if shared is None:
+            shared = self._shared[key] = _Shared(asyncio.create_task(self._open(make)))
+        shared.owners.add(owner)
+        try:
+            # Shielded: one waiting session going away must not cancel the
+            # connection the others are waiting for
+            return await asyncio.shield(shared.opening)
+        except Exception:
+            if self._shared.get(key) is shared:
+                del self._shared[key]
+            raise
+
+    async def _open(self, make: Callable[[], Any]) -> Any:
+        resource = make()
+        await resource.__aenter__()
+        self.opened += 1
+        return resource
+
+    async def release(self, key: str, owner: str) -> None:
+        """Drop *owner*'s reference; the last one closes the resource."""
+        shared = self._shared.get(key)
+        if shared is None:
+            return
+        shared.owners.discard(owner)
+        if not shared.owners:
+            del self._shared[key]
+            await self._close(shared)
+
+    async def release_owner(self, owner: str) -> None:
+        """Release everything *owner* holds, e.g. when its session ends."""
+        for key in [k for k, s in self._shared.items() if owner in s.owners]:
+            await self.release(key, owner)
+
+    async def close_all(self) -> None:
+        shared, self._shared = list(self._shared.values()), {}
+        for item in shared:
+            await self._close(item)
+
+    async def _close(self, shared: _Shared) -> None:
+        try:
+            resource = await shared.opening
+            await resource.__aexit__(None, None, None)
+            self.closed += 1
+        except Exception:
+            logger.exception("Closing a shared resource failed")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "resources": len(self._shared),
+            "references": sum(len(s.owners) for s in self._shared.values()),
+            "opened": self.opened,
+            "closed": self.closed,
+        }
+
+
+_loop: Optional[BackgroundLoop] = None
+_loop_lock = threading.Lock()
+resources = ResourcePool()
+
+
+def get_loop() -> BackgroundLoop:
+    """The process-wide loop, started on first use and stopped at exit."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = BackgroundLoop()
+            atexit.register(shutdown)
+    return _loop
+
+
+def loop_running() -> bool:
+    return _loop is not None
+
+
+def shutdown() -> None:
+    """Close every shared resource, then stop the loop."""
+    global _loop
+    with _loop_lock:
+        loop, _loop = _loop, None
+    if loop is None:
+        return
+    try:
+        loop.run(resources.close_all(), timeout=10)
+    except Exception:
+        logger.exception("Closing shared resources at exit failed")
+    loop.stop()
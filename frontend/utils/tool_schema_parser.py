@@ -1,3 +1,9 @@
+from typing import Dict, List, Tuple
+
+# (server, tool name, server version) -> parsed parameters
+_parameters_cache: Dict[Tuple[str, str, str], List[str]] = {}
+
+
 def extract_tool_parameters(tool):
     parameters = []
 
@@ -8,7 +14,7 @@ def extract_tool_parameters(tool):
     if isinstance(schema, dict):
         schema_dict = schema
     else:
-        schema_dict = schema.schema()
+        schema_dict = schema.model_json_schema()
 
     properties = schema_dict.get("properties", {})
     required = schema_dict.get("required", [])
@@ -27,3 +33,16 @@ def extract_tool_parameters(tool):
         parameters.append(desc)
 
     return parameters
+
+
+def cached_tool_parameters(tool, server: str, version: str) -> List[str]:
+    """``extract_tool_parameters``, parsed once per server, tool and version.
+
+    A tool's schema only changes with a new server version, so every
+    session and rerun after the first reuses the parsed list.
+    """
+    key = (server, tool.name, version)
+    parameters = _parameters_cache.get(key)
+    if parameters is None:
+        parameters = _parameters_cache[key] = extract_tool_parameters(tool)
+    return parameters